@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+"""Benchmark comparing the step time of regular and fused update rules."""
+
+from __future__ import print_function
+
+import sys
+import time
+
+import numpy as np
+import lasagne
+import theano
+import theano.tensor as T
+
+NUM_LAYERS = 100
+NUM_UNITS = 16
+BATCH_SIZE = 32
+NUM_STEPS = 100
+METHODS = ['sgd', 'momentum', 'rmsprop', 'adadelta']
+
+
+def build_model(num_layers=NUM_LAYERS, num_units=NUM_UNITS,
+                batch_size=BATCH_SIZE):
+    """Create an MLP of `num_layers` hidden layers of `num_units` each."""
+    layer = lasagne.layers.InputLayer(shape=(batch_size, num_units))
+    for _ in range(num_layers):
+        layer = lasagne.layers.DenseLayer(
+            layer,
+            num_units=num_units,
+            nonlinearity=lasagne.nonlinearities.tanh,
+            W=lasagne.init.Normal(0.01),
+        )
+    return layer
+
+
+def time_step(output_layer, update_fn, num_steps=NUM_STEPS, **kwargs):
+    """Compile a training function and return the compile time and the
+       mean step time.
+    """
+    X_batch = T.matrix('x')
+    loss = T.mean(output_layer.get_output(X_batch) ** 2)
+    params = lasagne.layers.get_all_params(output_layer)
+    updates = update_fn(loss, params, **kwargs)
+    start = time.time()
+    train = theano.function([X_batch], loss, updates=updates)
+    compile_time = time.time() - start
+
+    input_shape = output_layer.get_output_shape()
+    X = lasagne.utils.floatX(np.random.randn(*input_shape))
+    train(X)  # warm up
+    start = time.time()
+    for _ in range(num_steps):
+        train(X)
+    return compile_time, (time.time() - start) / num_steps
+
+
+def main(num_steps=NUM_STEPS, methods=METHODS, num_layers=NUM_LAYERS):
+    output_layer = build_model(num_layers=num_layers)
+    print("MLP with %d layers, %d parameter tensors" %
+          (num_layers, len(lasagne.layers.get_all_params(output_layer))))
+    print("%-10s %14s %14s %12s %12s %8s" % (
+        "method", "compile", "compile fused", "step", "step fused",
+        "speedup"))
+    for method in methods:
+        update_fn = getattr(lasagne.updates, method)
+        kwargs = {'learning_rate': 0.01}
+
+        def fused_fn(loss_or_grads, params, **kwargs):
+            return lasagne.updates.fused(update_fn, loss_or_grads, params,
+                                         **kwargs)
+
+        compile_regular, regular = time_step(output_layer, update_fn,
+                                             num_steps, **kwargs)
+        compile_fused, fused = time_step(output_layer, fused_fn, num_steps,
+                                         **kwargs)
+        print("%-10s %13.1fs %13.1fs %10.2fms %10.2fms %7.2fx" % (
+            method, compile_regular, compile_fused, regular * 1000,
+            fused * 1000, regular / fused))
+
+
+if __name__ == '__main__':
+    main(methods=sys.argv[1:] or METHODS)
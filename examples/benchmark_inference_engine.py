@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+"""Benchmark comparing per-example prediction calls with the batching
+   inference engine under concurrent load."""
+
+from __future__ import print_function
+
+import sys
+import threading
+import time
+
+import numpy as np
+import lasagne
+import theano
+from lasagne.serving import InferenceEngine
+
+NUM_REQUESTS = 2000
+NUM_CLIENTS = 64
+NUM_UNITS = 256
+
+# CPU time of all threads of the process
+cpu_time = getattr(time, 'process_time', None) or time.clock
+
+
+def build_model(num_units=NUM_UNITS):
+    """Create an MLP with a variable batch size."""
+    layer = lasagne.layers.InputLayer(shape=(None, num_units))
+    for _ in range(3):
+        layer = lasagne.layers.DenseLayer(layer, num_units=num_units)
+    return lasagne.layers.DenseLayer(
+        layer, num_units=10, nonlinearity=lasagne.nonlinearities.softmax)
+
+
+def run_clients(predict, examples, num_clients):
+    """Calls `predict` for each example from `num_clients` threads and
+       returns the CPU time and wall time per request."""
+    def client(idx):
+        for example in examples[idx::num_clients]:
+            predict(example)
+    threads = [threading.Thread(target=client, args=(idx,))
+               for idx in range(num_clients)]
+    start, start_cpu = time.time(), cpu_time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return ((cpu_time() - start_cpu) / len(examples),
+            (time.time() - start) / len(examples))
+
+
+def run_async(engine, examples):
+    """Awaits all examples from an asyncio event loop and returns the CPU
+       time and wall time per request."""
+    import asyncio
+    loop = asyncio.new_event_loop()
+    start, start_cpu = time.time(), cpu_time()
+    futures = [engine.predict_async(example, loop=loop)
+               for example in examples]
+    loop.run_until_complete(asyncio.gather(*futures))
+    loop.close()
+    return ((cpu_time() - start_cpu) / len(examples),
+            (time.time() - start) / len(examples))
+
+
+def main(num_clients=NUM_CLIENTS):
+    network = build_model()
+    examples = lasagne.utils.floatX(
+        np.random.randn(NUM_REQUESTS, NUM_UNITS))
+
+    l_in = lasagne.layers.get_all_layers(network)[0]
+    predict_fn = theano.function(
+        [l_in.input_var],
+        lasagne.layers.get_output(network, deterministic=True))
+    lock = threading.Lock()
+
+    def predict_single(example):
+        # the compiled function is not thread-safe
+        with lock:
+            return predict_fn(example[np.newaxis])[0]
+    predict_single(examples[0])  # warm up
+
+    with InferenceEngine(network, max_batch_size=64) as engine:
+        for bucket in engine.function.buckets:  # compile all variants
+            engine.function(examples[:bucket])
+        results = [("single", run_clients(predict_single, examples,
+                                          num_clients)),
+                   ("engine", run_clients(engine.predict, examples,
+                                          num_clients))]
+        if sys.version_info >= (3, 4):
+            results.append(("asyncio", run_async(engine, examples)))
+        mean_batch_size = float(engine.num_requests) / engine.num_batches
+
+    print("%d requests from %d client threads" % (NUM_REQUESTS, num_clients))
+    print("%-10s %14s %14s %8s" % ("method", "cpu/request", "wall/request",
+                                   "speedup"))
+    for name, (cpu, wall) in results:
+        print("%-10s %12.1fus %12.1fus %7.1fx" % (
+            name, cpu * 1e6, wall * 1e6, results[0][1][0] / cpu))
+    print("mean batch size: %.1f" % mean_batch_size)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
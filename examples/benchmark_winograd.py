@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+"""Benchmark comparing the default convolution with Winograd's algorithm for
+   the 3x3 convolutional layers of a VGG-style network on the CPU."""
+
+from __future__ import print_function
+
+import sys
+import time
+
+import numpy as np
+import lasagne
+import theano
+import theano.tensor as T
+from lasagne.theano_extensions.conv import (conv2d_winograd,
+                                            winograd_multiplies)
+
+BATCH_SIZE = 16
+NUM_STEPS = 10
+# (input channels, filters, image size) of the layers
+LAYERS = [(3, 32, 64), (32, 32, 64), (32, 64, 32), (64, 64, 32),
+          (64, 128, 16), (128, 128, 16)]
+
+
+def build_layer(num_channels, num_filters, image_size, convolution,
+                batch_size=BATCH_SIZE):
+    """Create a 3x3 'same' convolutional layer."""
+    l_in = lasagne.layers.InputLayer(
+        shape=(batch_size, num_channels, image_size, image_size))
+    return lasagne.layers.Conv2DLayer(
+        l_in, num_filters=num_filters, filter_size=3, border_mode='same',
+        convolution=convolution)
+
+
+def time_layer(layer, num_steps=NUM_STEPS):
+    """Compile the forward pass and a training step of a layer and return
+       their mean time."""
+    X_batch = T.tensor4('x')
+    output = lasagne.layers.get_output(layer, X_batch)
+    forward = theano.function([X_batch], output)
+    updates = lasagne.updates.sgd(T.mean(output ** 2), layer.get_params(),
+                                  learning_rate=0.01)
+    train = theano.function([X_batch], updates=updates)
+
+    X = lasagne.utils.floatX(np.random.randn(*layer.input_shape))
+    times = []
+    for fn in (forward, train):
+        fn(X)  # warm up
+        start = time.time()
+        for _ in range(num_steps):
+            fn(X)
+        times.append((time.time() - start) / num_steps)
+    return times
+
+
+def main(num_steps=NUM_STEPS):
+    print("batch size %d, %s" % (BATCH_SIZE, theano.config.floatX))
+    print("%-16s %9s %11s %11s %11s %11s" % (
+        "layer", "mults", "forward", "winograd", "train", "winograd"))
+    for num_channels, num_filters, image_size in LAYERS:
+        # multiplications of the direct method per Winograd multiplication
+        reduction = (9. * image_size ** 2 /
+                     winograd_multiplies((image_size + 2, image_size + 2)))
+        times = [time_layer(build_layer(num_channels, num_filters,
+                                        image_size, convolution),
+                            num_steps)
+                 for convolution in (T.nnet.conv2d, conv2d_winograd)]
+        print("%3dx%-3d %3dx%-3d %8.2fx %9.1fms %9.1fms %9.1fms %9.1fms" % (
+            num_channels, num_filters, image_size, image_size, reduction,
+            times[0][0] * 1000, times[1][0] * 1000, times[0][1] * 1000,
+            times[1][1] * 1000))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
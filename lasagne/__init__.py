@@ -2,10 +2,40 @@
 Tools to train neural nets in Theano
 """
 
-from . import nonlinearities
-from . import init
-from . import layers
-from . import objectives
-from . import regularization
-from . import updates
-from . import utils
+import importlib
+import sys
+
+_submodules = [
+    "nonlinearities",
+    "init",
+    "layers",
+    "compile",
+    "checkpoint",
+    "data",
+    "objectives",
+    "regularization",
+    "updates",
+    "flat",
+    "parallel",
+    "serving",
+    "runtime",
+    "export",
+    "quantization",
+    "utils",
+]
+
+if sys.version_info >= (3, 7):
+    # Import the submodules on first access, so that lasagne.runtime can be
+    # imported without importing Theano, which takes seconds.
+    def __getattr__(name):
+        if name in _submodules:
+            return importlib.import_module("." + name, __name__)
+        raise AttributeError("module %r has no attribute %r" %
+                             (__name__, name))
+
+    def __dir__():
+        return sorted(set(globals()) | set(_submodules))
+else:
+    for _name in _submodules:
+        importlib.import_module("." + _name, __name__)
+    del _name
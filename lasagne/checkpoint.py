@@ -0,0 +1,439 @@
+"""
+Functions to save and load network parameters in a memory-mappable format.
+
+A checkpoint is a single file holding a small JSON header followed by the raw
+contents of all arrays, each starting at a 64-byte aligned offset. Arrays can
+thus be memory-mapped straight from the file instead of being read and
+unpickled, which makes loading large models nearly instantaneous and lets
+several processes share the same pages of a read-only model file.
+
+ * save_params()
+ * load_params()
+
+Optionally, the optimizer state (the shared variables updated by a
+dictionary from :mod:`lasagne.updates` that are not network parameters, such
+as momentum velocities or accumulated squared gradients) is saved and loaded
+along with the parameters. To keep checkpointing from stalling training, a
+:class:`CheckpointWriter` takes a snapshot of all values and writes it on a
+background thread:
+
+ * CheckpointWriter
+
+Lower-level functions read and write arbitrary lists of arrays in the same
+format:
+
+ * write_arrays()
+ * read_arrays()
+
+Usage
+-----
+>>> import os, tempfile
+>>> from lasagne.layers import InputLayer, DenseLayer
+>>> from lasagne.checkpoint import save_params, load_params
+>>> l_in = InputLayer((100, 20))
+>>> l1 = DenseLayer(l_in, num_units=50, name='hidden')
+>>> filename = os.path.join(tempfile.mkdtemp(), 'model.lsgn')
+>>> save_params(filename, l1)
+>>> load_params(filename, l1)
+>>> load_params(filename, l1, layer_names=['hidden'])
+"""
+
+import json
+import os
+import struct
+import threading
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+import numpy as np
+
+
+__all__ = [
+    "save_params",
+    "load_params",
+    "CheckpointWriter",
+    "write_arrays",
+    "read_arrays",
+]
+
+
+MAGIC = b'LSGNCKPT'
+VERSION = 1
+ALIGNMENT = 64
+
+# magic string, format version and length of the JSON header in bytes
+_PREAMBLE = struct.Struct('<8sII')
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_arrays(filename, arrays, metadata=None):
+    """
+    Writes a list of arrays to a checkpoint file.
+
+    The file is written under a temporary name first and then renamed, so
+    readers never see a partially written checkpoint.
+
+    Parameters
+    ----------
+    filename : str
+        The file to write to.
+    arrays : list of (dict, numpy array) tuples
+        The arrays to write, each along with a dictionary of information to
+        store with it (e.g., a name). The dictionaries must be serializable
+        to JSON.
+    metadata : dict, optional
+        Additional information to store in the file header. Must be
+        serializable to JSON.
+    """
+    arrays = [(info, np.asarray(array)) for info, array in arrays]
+    entries = []
+    offset = 0
+    for info, array in arrays:
+        entry = dict(info)
+        entry.update(dtype=array.dtype.str, shape=list(array.shape),
+                     offset=offset)
+        entries.append(entry)
+        offset = _align(offset + array.nbytes)
+    header = json.dumps({'metadata': metadata or {},
+                         'arrays': entries}).encode('utf-8')
+    data_start = _align(_PREAMBLE.size + len(header))
+
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'wb') as f:
+        f.write(_PREAMBLE.pack(MAGIC, VERSION, len(header)))
+        f.write(header)
+        for entry, (info, array) in zip(entries, arrays):
+            f.seek(data_start + entry['offset'])
+            f.write(np.ascontiguousarray(array).data)
+        f.truncate(data_start + offset)
+        # make sure the data is on disk before the file replaces the old one
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp_filename, filename)
+
+
+def read_arrays(filename, mmap_mode='r'):
+    """
+    Reads all arrays from a checkpoint file.
+
+    Parameters
+    ----------
+    filename : str
+        The file to read from.
+    mmap_mode : {'r', 'r+', 'c'} or None
+        How to map the arrays into memory, with the same meaning as for
+        :func:`numpy.memmap`. The default ``'r'`` maps the file read-only,
+        ``'c'`` maps it copy-on-write, so the arrays can be modified without
+        affecting the file. If None, the arrays are read into memory.
+
+    Returns
+    -------
+    metadata : dict
+        The metadata stored with :func:`write_arrays`.
+    arrays : list of (dict, numpy array) tuples
+        The arrays along with their information dictionaries.
+    """
+    with open(filename, 'rb') as f:
+        magic, version, header_length = _PREAMBLE.unpack(
+            f.read(_PREAMBLE.size))
+        if magic != MAGIC:
+            raise ValueError("%s is not a Lasagne checkpoint file" % filename)
+        if version > VERSION:
+            raise ValueError("%s has checkpoint format version %d, only "
+                             "versions up to %d are supported" %
+                             (filename, version, VERSION))
+        header = json.loads(f.read(header_length).decode('utf-8'))
+        data_start = _align(_PREAMBLE.size + header_length)
+        if mmap_mode is None:
+            f.seek(0)
+            buf = np.frombuffer(f.read(), dtype=np.uint8)
+
+    if mmap_mode is not None:
+        file_size = os.path.getsize(filename)
+        if file_size > data_start:
+            buf = np.memmap(filename, dtype=np.uint8, mode=mmap_mode)
+        else:
+            buf = np.zeros(data_start, dtype=np.uint8)
+
+    arrays = []
+    for entry in header['arrays']:
+        dtype = np.dtype(entry.pop('dtype'))
+        shape = tuple(entry.pop('shape'))
+        start = data_start + entry.pop('offset')
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        array = buf[start:start + nbytes].view(dtype).reshape(shape)
+        if mmap_mode is None:
+            array = array.copy()
+        arrays.append((entry, array))
+    return header['metadata'], arrays
+
+
+def _param_entries(layer_or_layers):
+    """
+    Returns the parameters of a network in the order of `get_all_params()`,
+    each with the information identifying it in a checkpoint.
+    """
+    from .layers.helper import get_all_layers
+    entries = []
+    seen = set()
+    for layer in get_all_layers(layer_or_layers):
+        for idx, param in enumerate(layer.get_params()):
+            if param not in seen:
+                seen.add(param)
+                entries.append(({'group': 'params',
+                                 'name': param.name,
+                                 'layer': layer.name,
+                                 'param_index': idx}, param))
+    return entries
+
+
+def _state_entries(layer_or_layers, updates):
+    """
+    Returns the optimizer state variables in `updates` along with the
+    information identifying them in a checkpoint.
+    """
+    from .layers.helper import get_all_params
+    from .updates import OptimizerState
+    if not isinstance(updates, OptimizerState):
+        updates = OptimizerState(updates, get_all_params(layer_or_layers))
+    return [({'group': 'state', 'name': name}, var)
+            for name, var in updates.variables.items()]
+
+
+def _entries(layer_or_layers, updates):
+    entries = _param_entries(layer_or_layers)
+    if updates is not None:
+        entries.extend(_state_entries(layer_or_layers, updates))
+    return entries
+
+
+def save_params(filename, layer_or_layers, updates=None):
+    """
+    Saves the parameters of a network to a checkpoint file.
+
+    Parameters
+    ----------
+    filename : str
+        The file to write to.
+    layer_or_layers : Layer, list or NetworkGraph
+        The :class:`Layer` instance for which to save all parameters, or a
+        list of :class:`Layer` instances.
+    updates : OrderedDict, list of pairs or OptimizerState, optional
+        An update dictionary as returned by the functions in
+        :mod:`lasagne.updates`. If given, all shared variables it updates
+        that are not parameters of the network (the optimizer state) are
+        saved as well, under the names given by
+        :class:`lasagne.updates.OptimizerState`. Alternatively, an
+        :class:`lasagne.updates.OptimizerState` can be passed directly.
+
+    Notes
+    -----
+    Values are saved in the dtype of their variables, so the checkpoint of a
+    network with float16 parameter storage (see
+    :func:`lasagne.layers.set_storage_dtype`) takes half the space of a
+    float32 one.
+    """
+    arrays = [(info, var.get_value(borrow=True))
+              for info, var in _entries(layer_or_layers, updates)]
+    write_arrays(filename, arrays)
+
+
+def load_params(filename, layer_or_layers, layer_names=None, mmap_mode='c',
+                updates=None):
+    """
+    Loads the parameters of a network from a checkpoint file.
+
+    Parameters
+    ----------
+    filename : str
+        The file to read from, as written by :func:`save_params`.
+    layer_or_layers : Layer, list or NetworkGraph
+        The :class:`Layer` instance for which to set all parameters, or a
+        list of :class:`Layer` instances.
+    layer_names : list of str, optional
+        If given, only the parameters of the layers with these names are
+        loaded, matched by name to the layers stored in the checkpoint.
+        Otherwise, all parameters are loaded and matched by their position,
+        as with :func:`lasagne.layers.set_all_param_values`.
+    mmap_mode : {'c', 'r', 'r+'} or None
+        How to map the parameter values into memory, see
+        :func:`read_arrays`. The default ``'c'`` (copy-on-write) shares the
+        pages of the file until a parameter is modified. If None, the values
+        are read into memory.
+    updates : OrderedDict, list of pairs or OptimizerState, optional
+        An update dictionary as returned by the functions in
+        :mod:`lasagne.updates`, or an
+        :class:`lasagne.updates.OptimizerState`. If given, the optimizer
+        state saved along with the parameters is loaded into the matching
+        state variables, by name.
+
+    Notes
+    -----
+    The parameters are set with ``borrow=True``, so on the CPU their values
+    are the memory-mapped arrays themselves and no data is copied. Values
+    stored in a different dtype than their parameter (such as a checkpoint
+    saved from a network with float16 storage, see
+    :func:`lasagne.layers.set_storage_dtype`) are converted into memory.
+    """
+    _, arrays = read_arrays(filename, mmap_mode)
+    stored = [(info, array) for info, array in arrays
+              if info.get('group') == 'params']
+    entries = _param_entries(layer_or_layers)
+
+    if layer_names is None:
+        if len(stored) != len(entries):
+            raise ValueError("mismatch: got %d values to set %d parameters" %
+                             (len(stored), len(entries)))
+        pairs = [(param, array) for (_, param), (_, array)
+                 in zip(entries, stored)]
+    else:
+        layer_names = set(layer_names)
+        stored = dict(((info['layer'], info['param_index']), array)
+                      for info, array in stored
+                      if info['layer'] in layer_names)
+        missing = layer_names - set(layer for layer, _ in stored)
+        if missing:
+            raise ValueError("no parameters stored for layer(s) %s" %
+                             ", ".join(sorted(missing)))
+        pairs = []
+        for info, param in entries:
+            if info['layer'] in layer_names:
+                key = (info['layer'], info['param_index'])
+                if key not in stored:
+                    raise ValueError("no value stored for parameter %d of "
+                                     "layer %s" % key[::-1])
+                pairs.append((param, stored[key]))
+
+    if updates is not None:
+        stored_state = dict((info['name'], array) for info, array in arrays
+                            if info.get('group') == 'state')
+        state = _state_entries(layer_or_layers, updates)
+        missing = set(info['name'] for info, _ in state) - set(stored_state)
+        if missing:
+            raise ValueError("no values stored for optimizer state "
+                             "variable(s) %s" % ", ".join(sorted(missing)))
+        pairs.extend((var, stored_state[info['name']])
+                     for info, var in state)
+
+    for param, array in pairs:
+        shape = param.get_value(borrow=True).shape
+        if shape != array.shape:
+            raise ValueError("mismatch: parameter %s has shape %r, but the "
+                             "stored value has shape %r" %
+                             (param.name, shape, array.shape))
+    for param, array in pairs:
+        if array.dtype != param.dtype:
+            # e.g., float16 values into float32 parameters or vice versa
+            array = array.astype(param.dtype)
+        param.set_value(array, borrow=True)
+
+
+class CheckpointWriter(object):
+    """
+    Writes checkpoints on a background thread.
+
+    :meth:`save` takes an in-memory copy of all parameter values (and,
+    optionally, the optimizer state), which is fast, and hands it over to a
+    background thread that writes it to disk. Training can continue as soon
+    as :meth:`save` returns.
+
+    Parameters
+    ----------
+    max_pending : int
+        The maximum number of snapshots waiting to be written. If exceeded,
+        :meth:`save` blocks until a snapshot has been written, so memory use
+        stays bounded when checkpoints are requested faster than they can be
+        written.
+
+    Notes
+    -----
+    Files are written under a temporary name and renamed when complete, so
+    an interrupted write never leaves a truncated checkpoint behind. Errors
+    occurring on the background thread are raised by the next call to
+    :meth:`save`, :meth:`wait` or :meth:`close`.
+
+    Examples
+    --------
+    >>> import os, tempfile
+    >>> from lasagne.layers import InputLayer, DenseLayer
+    >>> l1 = DenseLayer(InputLayer((100, 20)), num_units=50)
+    >>> filename = os.path.join(tempfile.mkdtemp(), 'model.lsgn')
+    >>> with CheckpointWriter() as writer:
+    ...     writer.save(filename, l1)
+    >>> load_params(filename, l1)
+    """
+    def __init__(self, max_pending=1):
+        self._queue = queue.Queue(max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                write_arrays(*job)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def save(self, filename, layer_or_layers, updates=None, metadata=None):
+        """
+        Takes a snapshot of the parameters of a network and queues it to be
+        written to a checkpoint file.
+
+        Parameters
+        ----------
+        filename : str
+            The file to write to.
+        layer_or_layers : Layer, list or NetworkGraph
+            The :class:`Layer` instance for which to save all parameters, or
+            a list of :class:`Layer` instances.
+        updates : OrderedDict, list of pairs or OptimizerState, optional
+            The optimizer state to save as well, see :func:`save_params`.
+        metadata : dict, optional
+            Additional information to store in the file header, e.g., the
+            number of the current epoch. Must be serializable to JSON.
+        """
+        self._raise_error()
+        if not self._thread.is_alive():
+            raise RuntimeError("save() called on a closed CheckpointWriter")
+        arrays = [(info, var.get_value())
+                  for info, var in _entries(layer_or_layers, updates)]
+        self._queue.put((filename, arrays, metadata))
+
+    def wait(self):
+        """
+        Blocks until all queued snapshots have been written.
+        """
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """
+        Writes all queued snapshots and stops the background thread.
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,497 @@
+"""
+Functions to compile Theano functions with caching.
+
+Compiling the training and prediction functions of a network spends most of
+its time in Theano's graph optimizer, and this work is repeated every time a
+script is started. This module keeps compiled functions in an in-process LRU
+cache and, optionally, in a persistent on-disk cache, so that compiling the
+same model again skips graph optimization entirely:
+
+ * function()
+ * FunctionCache
+ * fingerprint()
+
+For networks with a variable batch size, a :class:`BucketedFunction`
+compiles variants specialized to a set of batch sizes and dispatches each
+call to the best-fitting one:
+
+ * BucketedFunction
+
+Cache entries are keyed on the structure of the computation graph (the
+operations, variable types, constants and shared variable shapes), on the
+keyword arguments passed to :func:`theano.function` and on the Theano
+version and configuration. Shared variables such as the network parameters
+are never written to disk: when a function is loaded from disk, it is bound
+to the shared variables of the graph it was requested for.
+
+Usage
+-----
+>>> import theano.tensor as T
+>>> from lasagne.layers import InputLayer, DenseLayer, get_all_params
+>>> from lasagne.updates import sgd
+>>> from lasagne.compile import FunctionCache, function
+>>> l_in = InputLayer((100, 20))
+>>> l1 = DenseLayer(l_in, num_units=3)
+>>> x = T.matrix('x')
+>>> loss = l1.get_output(x).mean()
+>>> updates = sgd(loss, get_all_params(l1), learning_rate=0.01)
+>>> cache = FunctionCache(maxsize=8)  # pass cache_dir to persist on disk
+>>> train_fn = function([x], loss, updates=updates, network=l1, cache=cache)
+>>> function([x], loss, updates=updates, network=l1, cache=cache) is train_fn
+True
+"""
+
+from collections import OrderedDict
+import hashlib
+import os
+import pickle
+import tempfile
+import warnings
+
+import numpy as np
+
+import theano
+
+
+__all__ = [
+    "fingerprint",
+    "FunctionCache",
+    "function",
+    "BucketedFunction",
+]
+
+
+def _describe(value):
+    """
+    Returns a description of a layer attribute that is stable across
+    processes, or None if the attribute should not be part of a fingerprint.
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    elif isinstance(value, (tuple, list)):
+        items = [_describe(v) for v in value]
+        if all(v is not None or w is None for v, w in zip(items, value)):
+            return tuple(items)
+    elif isinstance(value, np.ndarray):
+        return (value.dtype.str, value.shape,
+                hashlib.sha1(np.ascontiguousarray(value)).hexdigest())
+    elif isinstance(value, theano.compile.SharedVariable):
+        data = value.get_value(borrow=True, return_internal_type=True)
+        return (str(value.type), getattr(data, 'shape', None))
+    elif hasattr(value, '__call__') and hasattr(value, '__name__'):
+        # functions such as nonlinearities or convolution implementations
+        return "%s.%s" % (getattr(value, '__module__', None), value.__name__)
+    return None
+
+
+def fingerprint(layer_or_layers):
+    """
+    Computes a fingerprint of the network below one or more given
+    :class:`Layer` instances.
+
+    The fingerprint covers the classes of all layers, how they are
+    connected, their output shapes, their hyperparameters (attributes of
+    simple types, arrays and named callables such as nonlinearities) and
+    the shapes and types of their parameters. It does not depend on the
+    current parameter values.
+
+    Parameters
+    ----------
+    layer_or_layers : Layer or list
+        The :class:`Layer` instance for which to compute the fingerprint,
+        or a list of :class:`Layer` instances.
+
+    Returns
+    -------
+    str
+        A hexadecimal digest that is equal for structurally identical
+        networks, also across processes.
+    """
+    from .layers.helper import _get_all_layers
+    layers = _get_all_layers(layer_or_layers)
+    index = dict((layer, idx) for idx, layer in enumerate(layers))
+    description = []
+    for layer in layers:
+        cls = type(layer)
+        attributes = []
+        for name, value in sorted(vars(layer).items()):
+            if name in ('name', 'input_var', 'input_layer', 'input_layers'):
+                continue
+            value = _describe(value)
+            if value is not None:
+                attributes.append((name, value))
+        incomings = [getattr(layer, 'input_layer', None)]
+        incomings = getattr(layer, 'input_layers', incomings)
+        description.append((
+            "%s.%s" % (cls.__module__, cls.__name__),
+            tuple(index.get(incoming) for incoming in incomings),
+            _describe(layer.get_output_shape()),
+            tuple(attributes),
+            tuple(_describe(param) for param in layer.get_params()),
+        ))
+    return hashlib.sha1(repr(description).encode('utf-8')).hexdigest()
+
+
+def _graph_signature(inputs, outputs):
+    """
+    Describes the graph computing `outputs` from `inputs` by its structure.
+
+    Returns a list of tokens (from which a cache key can be derived) and the
+    list of shared variables the graph depends on, in a deterministic order.
+    """
+    ids = {}
+    shared = []
+    tokens = []
+
+    def ident(var):
+        if var not in ids:
+            if isinstance(var, theano.compile.SharedVariable):
+                shared.append(var)
+                tokens.append(('shared', _describe(var)))
+            elif isinstance(var, theano.gof.Constant):
+                data = np.asarray(var.data)
+                tokens.append(('constant', str(var.type), _describe(data)))
+            else:
+                tokens.append(('variable', str(var.type)))
+            ids[var] = len(ids)
+        return ids[var]
+
+    for var in inputs:
+        ident(var)
+    for node in theano.gof.graph.io_toposort(inputs, outputs):
+        tokens.append((type(node.op).__name__, str(node.op),
+                       tuple(ident(var) for var in node.inputs)))
+        for var in node.outputs:
+            ident(var)
+    tokens.append(tuple(ident(var) for var in outputs))
+    return tokens, shared
+
+
+class _Pickler(pickle.Pickler):
+    """
+    Pickles a compiled function, replacing shared variables, their
+    containers and their data by references.
+    """
+    def __init__(self, file, shared):
+        pickle.Pickler.__init__(self, file, pickle.HIGHEST_PROTOCOL)
+        self.references = {}
+        for idx, var in enumerate(shared):
+            self.references[id(var)] = ('variable', idx)
+            self.references[id(var.container)] = ('container', idx)
+            self.references[id(var.container.data)] = ('data', idx)
+
+    def persistent_id(self, obj):
+        return self.references.get(id(obj))
+
+
+class _Unpickler(pickle.Unpickler):
+    """
+    Unpickles a compiled function, resolving references to shared variables
+    pickled by :class:`_Pickler`.
+    """
+    def __init__(self, file, shared):
+        pickle.Unpickler.__init__(self, file)
+        self.shared = shared
+
+    def persistent_load(self, pid):
+        kind, idx = pid
+        var = self.shared[idx]
+        if kind == 'variable':
+            return var
+        elif kind == 'container':
+            return var.container
+        else:
+            return var.container.data
+
+
+class FunctionCache(object):
+    """
+    A cache of compiled Theano functions.
+
+    Parameters
+    ----------
+    maxsize : int
+        The maximum number of functions kept in memory. When exceeded, the
+        least recently used function is evicted.
+    cache_dir : str or None
+        A directory to persist compiled functions in. It is created if it
+        does not exist. If None, functions are only cached in memory.
+
+    Notes
+    -----
+    The in-memory cache only returns a function if it was compiled for the
+    very same shared variables. The on-disk cache is keyed on the graph
+    structure alone, so a function stored by one process can be loaded for
+    a structurally identical network in another process.
+    """
+    def __init__(self, maxsize=32, cache_dir=None):
+        self.maxsize = maxsize
+        self.cache_dir = cache_dir
+        self._functions = OrderedDict()
+        if cache_dir is not None and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def __len__(self):
+        return len(self._functions)
+
+    def clear(self):
+        """Removes all functions from the in-memory cache."""
+        self._functions.clear()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.pkl')
+
+    def _load(self, key, shared):
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        reoptimize = theano.config.reoptimize_unpickled_function
+        theano.config.reoptimize_unpickled_function = False
+        try:
+            with open(path, 'rb') as f:
+                fn = _Unpickler(f, shared).load()
+        except Exception as e:
+            warnings.warn("Could not load cached function %s, it will be "
+                          "recompiled (original exception: %s)" % (path, e))
+            return None
+        finally:
+            theano.config.reoptimize_unpickled_function = reoptimize
+        # make sure the function is bound to our shared variables only
+        shared_ids = set(id(var) for var in shared)
+        if not all(id(i.variable) in shared_ids
+                   for i in fn.maker.inputs if i.implicit):
+            return None
+        return fn
+
+    def _store(self, key, shared, fn):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                _Pickler(f, shared).dump(fn)
+            # renaming is atomic, so other processes never see partial files
+            os.rename(tmp_path, self._path(key))
+        except Exception as e:
+            warnings.warn("Could not store compiled function in %s "
+                          "(original exception: %s)" % (self.cache_dir, e))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def function(self, inputs, outputs=None, updates=None, givens=None,
+                 network=None, **kwargs):
+        """
+        Returns a compiled function, from cache if possible.
+
+        Takes the same arguments as :func:`theano.function`. See
+        :func:`lasagne.compile.function` for details.
+        """
+        if isinstance(updates, dict):
+            updates = list(updates.items())
+        if isinstance(givens, dict):
+            givens = list(givens.items())
+        updates = list(updates or [])
+        givens = list(givens or [])
+        if outputs is None:
+            output_list = []
+        elif isinstance(outputs, (list, tuple)):
+            output_list = list(outputs)
+        else:
+            output_list = [outputs]
+
+        # collect everything the compiled function depends on, including
+        # the default updates of shared variables (e.g. random states)
+        graph_outputs = (output_list + [u for _, u in updates] +
+                         [v for v, _ in updates] + [v for _, v in givens] +
+                         [v for v, _ in givens])
+        while True:
+            tokens, shared = _graph_signature(list(inputs), graph_outputs)
+            extra = [var.default_update for var in shared
+                     if getattr(var, 'default_update', None) is not None and
+                     var.default_update not in graph_outputs]
+            if not extra or kwargs.get('no_default_updates'):
+                break
+            graph_outputs = graph_outputs + extra
+
+        options = sorted((name, _describe(value) if _describe(value)
+                          is not None else type(value).__name__)
+                         for name, value in kwargs.items())
+        description = (tokens,
+                       fingerprint(network) if network is not None else None,
+                       isinstance(outputs, (list, tuple)),
+                       len(updates), len(givens), options,
+                       theano.__version__, theano.config.floatX,
+                       theano.config.device, theano.config.mode,
+                       theano.config.optimizer)
+        key = hashlib.sha1(repr(description).encode('utf-8')).hexdigest()
+
+        memory_key = (key, tuple(id(var) for var in shared))
+        fn = self._functions.pop(memory_key, None)
+        if fn is None and self.cache_dir is not None:
+            fn = self._load(key, shared)
+        if fn is None:
+            fn = theano.function(inputs, outputs, updates=updates,
+                                 givens=givens, **kwargs)
+            if self.cache_dir is not None:
+                self._store(key, shared, fn)
+
+        # (re-)insert as the most recently used entry
+        self._functions[memory_key] = fn
+        while len(self._functions) > self.maxsize:
+            self._functions.popitem(last=False)
+        return fn
+
+
+_default_cache = FunctionCache()
+
+
+def function(inputs, outputs=None, updates=None, givens=None, network=None,
+             cache=None, **kwargs):
+    """
+    Compiles a Theano function, or returns a cached one.
+
+    Parameters
+    ----------
+    inputs : list of symbolic variables
+        The input variables of the function, as for :func:`theano.function`.
+    outputs : symbolic expression or list of expressions
+        The outputs of the function.
+    updates : OrderedDict or list of pairs
+        Updates of shared variables, e.g. as returned by the functions of
+        :mod:`lasagne.updates`.
+    givens : dict or list of pairs
+        Substitutions to apply to the graph before compilation.
+    network : Layer or list, optional
+        The output layer(s) of the network the function is compiled for. If
+        given, the :func:`fingerprint` of the network is made part of the
+        cache key.
+    cache : FunctionCache, optional
+        The cache to use. Defaults to a module-level in-memory cache.
+    **kwargs
+        Any additional keyword arguments are passed to
+        :func:`theano.function`.
+
+    Returns
+    -------
+    theano.compile.Function
+        The compiled function.
+    """
+    if cache is None:
+        cache = _default_cache
+    return cache.function(inputs, outputs, updates=updates, givens=givens,
+                          network=network, **kwargs)
+
+
+class BucketedFunction(object):
+    """
+    A compiled function specialized to a set of batch sizes.
+
+    Networks built with a batch size of None can process batches of any
+    size, but operations such as convolutions then cannot be specialized
+    to the input shape. This class compiles one variant of a function per
+    batch size ("bucket"), built with the batch size known in advance, and
+    runs each call with the smallest bucket large enough for the batch. The
+    inputs are padded to the bucket size, and the outputs are cut back to
+    the batch size. Batches larger than the largest bucket are processed in
+    several parts.
+
+    Variants are compiled on first use.
+
+    Parameters
+    ----------
+    inputs : list of symbolic variables
+        The input variables of the function. The first axis of each input
+        is the batch axis.
+    build_outputs : callable
+        A function taking a batch size (an int, or None for the generic
+        variant) and returning the output expression or a list of output
+        expressions. Typically, it passes the batch size on as the
+        `batch_size` keyword argument of :func:`lasagne.layers.get_output`,
+        which specializes the convolution layers to it.
+    buckets : sequence of int
+        The batch sizes to compile variants for. Defaults to the powers of
+        two from 1 to 512.
+    pad : bool
+        If True, batch sizes that are not a bucket are padded up to the next
+        bucket. This requires that each example of the outputs only depends
+        on the same example of the inputs, which holds for inference, but
+        not for a loss averaged over the batch. If False, such batches are
+        processed by a generic variant compiled with a batch size of None.
+    cache : FunctionCache or None
+        The cache to compile the variants with, see :func:`function`.
+    **kwargs
+        Any additional keyword arguments are passed to :func:`function`,
+        e.g. `updates` for a training function with ``pad=False``.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> import theano.tensor as T
+    >>> from lasagne.layers import InputLayer, Conv2DLayer, get_output
+    >>> l_in = InputLayer((None, 1, 8, 8))
+    >>> l_conv = Conv2DLayer(l_in, num_filters=2, filter_size=(3, 3))
+    >>> x = T.tensor4('x')
+    >>> predict = BucketedFunction(
+    ...     [x], lambda n: get_output(l_conv, x, batch_size=n),
+    ...     buckets=[4, 16])
+    >>> X = np.ones((6, 1, 8, 8), dtype=theano.config.floatX)
+    >>> predict(X).shape
+    (6, 2, 6, 6)
+    >>> sorted(predict.variants)
+    [16]
+    """
+    def __init__(self, inputs, build_outputs, buckets=None, pad=True,
+                 cache=None, **kwargs):
+        if buckets is None:
+            buckets = [2 ** i for i in range(10)]
+        self.inputs = list(inputs)
+        self.build_outputs = build_outputs
+        self.buckets = sorted(set(buckets))
+        self.pad = pad
+        self.cache = cache
+        self.kwargs = kwargs
+        self.variants = {}
+        self._single_output = None
+
+    def variant(self, batch_size):
+        """
+        Returns the variant compiled for a batch size, compiling it if
+        needed. A batch size of None returns the generic variant.
+        """
+        if batch_size not in self.variants:
+            outputs = self.build_outputs(batch_size)
+            self._single_output = not isinstance(outputs, (list, tuple))
+            self.variants[batch_size] = function(
+                self.inputs, outputs, cache=self.cache, **self.kwargs)
+        return self.variants[batch_size]
+
+    def __call__(self, *values):
+        """
+        Calls the best-fitting variant on the given input values.
+        """
+        if len(values) != len(self.inputs):
+            raise ValueError("Expected %d inputs, got %d" %
+                             (len(self.inputs), len(values)))
+        num_examples = len(values[0])
+        largest = self.buckets[-1]
+        if num_examples > largest and self.pad:
+            parts = [self(*[value[start:start + largest]
+                            for value in values])
+                     for start in range(0, num_examples, largest)]
+            if self._single_output:
+                return np.concatenate(parts)
+            return [np.concatenate(outputs) for outputs in zip(*parts)]
+
+        if num_examples in self.buckets:
+            return self.variant(num_examples)(*values)
+        elif not self.pad or num_examples == 0:
+            return self.variant(None)(*values)
+
+        bucket = min(b for b in self.buckets if b >= num_examples)
+        # pad by repeating the last example, which keeps values valid
+        values = [np.concatenate([value, np.repeat(value[-1:],
+                                                   bucket - num_examples,
+                                                   axis=0)])
+                  for value in values]
+        outputs = self.variant(bucket)(*values)
+        if self._single_output:
+            return outputs[:num_examples]
+        return [output[:num_examples] for output in outputs]
@@ -0,0 +1,800 @@
+"""
+Functions to stream minibatches into a training loop.
+
+Instead of loading a whole dataset into shared variables up front, the
+functions in this module stream it in minibatches. They can be chained into
+a pipeline of generators, each of them yielding minibatches as tuples of
+numpy arrays:
+
+ * iterate_minibatches()
+ * iterate_files()
+ * shuffle()
+ * prefetch()
+
+A :class:`DoubleBuffer` feeds the minibatches to a compiled function
+through shared variables, filling the next minibatch in the background
+while the current one is processed:
+
+ * DoubleBuffer
+
+Datasets larger than the available memory can be converted once into
+shards of ``.npy`` files, which are memory-mapped and read from disk as the
+minibatches are consumed:
+
+ * convert_to_shards()
+ * ShardedDataset
+
+To train with `givens` that slice minibatches out of shared variables, a
+dataset can be paged through the shared variables in chunks:
+
+ * PagedDataset
+
+Usage
+-----
+>>> import numpy as np
+>>> import theano
+>>> import theano.tensor as T
+>>> from lasagne.data import iterate_minibatches, shuffle, DoubleBuffer
+>>> X = np.random.randn(1000, 20)
+>>> y = np.random.randint(0, 3, 1000)
+>>> x_var, y_var = T.matrix('x'), T.ivector('y')
+>>> buffer = DoubleBuffer([x_var, y_var])
+>>> fn = theano.function([], [x_var.shape[0], y_var.sum()],
+...                      givens=buffer.givens)
+>>> batches = shuffle(iterate_minibatches([X, y], 100), buffer_size=500)
+>>> results = [fn() for _ in buffer.feed(batches)]
+>>> sum(r[0] for r in results), sum(r[1] for r in results) == y.sum()
+(1000, True)
+"""
+
+import gzip
+import json
+import mmap
+import os
+import pickle
+import sys
+import threading
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+import numpy as np
+
+import theano
+
+
+__all__ = [
+    "iterate_minibatches",
+    "iterate_files",
+    "shuffle",
+    "prefetch",
+    "DoubleBuffer",
+    "convert_to_shards",
+    "ShardedDataset",
+    "PagedDataset",
+]
+
+
+def _as_tuple(batch):
+    if isinstance(batch, np.ndarray):
+        return (batch,)
+    return tuple(batch)
+
+
+def iterate_minibatches(inputs, batch_size, drop_last=False):
+    """
+    Iterates over arrays in minibatches, in order.
+
+    Parameters
+    ----------
+    inputs : list of arrays
+        Arrays of the same size along the first axis, e.g. the inputs and
+        targets of a dataset. Memory-mapped arrays are only read as the
+        minibatches are consumed.
+    batch_size : int
+        The number of examples per minibatch.
+    drop_last : bool
+        If True, the last minibatch is omitted if it is smaller than
+        `batch_size`.
+
+    Yields
+    ------
+    tuple of arrays
+        A slice of each of the `inputs`.
+    """
+    inputs = _as_tuple(inputs)
+    num_examples = len(inputs[0])
+    if any(len(value) != num_examples for value in inputs):
+        raise ValueError("All inputs must have the same number of examples")
+    stop = num_examples
+    if drop_last:
+        stop -= num_examples % batch_size
+    for start in range(0, stop, batch_size):
+        yield tuple(value[start:start + batch_size] for value in inputs)
+
+
+def _load(filename):
+    """
+    Loads a ``.npy`` file memory-mapped, or the arrays of a ``.npz`` file in
+    the order they were stored in.
+    """
+    if os.path.splitext(filename)[1] == '.npy':
+        return (np.load(filename, mmap_mode='r'),)
+    with np.load(filename) as archive:
+        return tuple(archive[name] for name in archive.files)
+
+
+def iterate_files(filenames, batch_size, load=None, drop_last=False):
+    """
+    Iterates over a dataset stored in multiple files in minibatches.
+
+    Only one file is held in memory at a time. Minibatches do not span
+    files, so the last minibatch of each file may be smaller than
+    `batch_size`.
+
+    Parameters
+    ----------
+    filenames : iterable of str
+        The files to read, in order.
+    batch_size : int
+        The number of examples per minibatch.
+    load : callable or None
+        A function taking a filename and returning a list of arrays of the
+        same size along the first axis. By default, ``.npy`` files are
+        memory-mapped and yield minibatches of a single array, and ``.npz``
+        files yield minibatches of the arrays they contain.
+    drop_last : bool
+        If True, the last minibatch of each file is omitted if it is
+        smaller than `batch_size`.
+
+    Yields
+    ------
+    tuple of arrays
+        Slices of the arrays of the current file.
+    """
+    if load is None:
+        load = _load
+    for filename in filenames:
+        for batch in iterate_minibatches(load(filename), batch_size,
+                                         drop_last):
+            yield batch
+
+
+def shuffle(batches, buffer_size, rng=None):
+    """
+    Shuffles the examples of a stream of minibatches using a bounded buffer.
+
+    Examples are collected in a buffer of `buffer_size` examples. Once it is
+    full, each incoming example takes the place of an example drawn at
+    random from the buffer, so each example can move across
+    ``buffer_size / batch_size`` minibatches. The drawn examples are yielded
+    in random order, one minibatch per incoming minibatch. The buffer is
+    emptied at the end of the stream.
+
+    Parameters
+    ----------
+    batches : iterable of tuples of arrays
+        The minibatches to shuffle.
+    buffer_size : int
+        The number of examples to hold in the buffer. A buffer at least as
+        large as the dataset results in a uniform shuffle.
+    rng : numpy.random.RandomState or None
+        The random number generator to use. Defaults to ``numpy.random``.
+
+    Yields
+    ------
+    tuple of arrays
+        The shuffled minibatches.
+
+    Notes
+    -----
+    The buffer is allocated once, with the dtypes and shapes of the first
+    minibatch, so each minibatch only costs copying its examples in and out
+    of the buffer, independently of `buffer_size`.
+    """
+    if rng is None:
+        rng = np.random
+    buffer = None
+    filled = 0
+    batch_size = None
+    for batch in batches:
+        batch = tuple(np.asarray(value) for value in _as_tuple(batch))
+        if buffer is None:
+            batch_size = len(batch[0])
+            buffer = tuple(np.empty((buffer_size,) + value.shape[1:],
+                                    dtype=value.dtype) for value in batch)
+        # fill the free slots of the buffer first
+        num_in = min(len(batch[0]), buffer_size - filled)
+        for slots, value in zip(buffer, batch):
+            slots[filled:filled + num_in] = value[:num_in]
+        filled += num_in
+        batch = tuple(value[num_in:] for value in batch)
+        if len(batch[0]):
+            if buffer_size:
+                batch = _swap(buffer, batch, rng)
+            order = rng.permutation(len(batch[0]))
+            yield tuple(value[order] for value in batch)
+    if filled:
+        order = rng.permutation(filled)
+        for start in range(0, filled, batch_size):
+            idx = order[start:start + batch_size]
+            yield tuple(slots[idx] for slots in buffer)
+
+
+def _swap(buffer, batch, rng):
+    """
+    Puts each example of a minibatch into a random slot of a full buffer,
+    and returns the examples taken out in the order of the minibatch.
+    """
+    idx = rng.randint(0, len(buffer[0]), len(batch[0]))
+    out = tuple(slots[idx] for slots in buffer)
+    # if a slot is drawn more than once, the example taken out the second
+    # time is the one put in the first time, and the last one stays
+    order = np.argsort(idx, kind='mergesort')
+    repeated = idx[order[1:]] == idx[order[:-1]]
+    later, earlier = order[1:][repeated], order[:-1][repeated]
+    last = order[np.append(~repeated, True)]
+    for taken, slots, value in zip(out, buffer, batch):
+        taken[later] = value[earlier]
+        slots[idx[last]] = value[last]
+    return out
+
+
+class _Error(object):
+    """Wraps an exception raised in a background thread."""
+    def __init__(self, exception):
+        self.exception = exception
+
+
+_END = object()
+
+
+def _background(iterable, process, maxsize):
+    """
+    Iterates over `iterable` in a background thread, applying `process` to
+    each item, and yields the results. At most `maxsize` results are kept
+    ahead of the consumer. Exceptions are re-raised in the consumer.
+    """
+    results = queue.Queue(maxsize=maxsize)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(process(item)):
+                    return
+        except Exception as e:
+            put(_Error(e))
+            return
+        put(_END)
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item = results.get()
+            if item is _END:
+                return
+            elif isinstance(item, _Error):
+                raise item.exception
+            yield item
+    finally:
+        stopped.set()
+
+
+def prefetch(batches, num_batches=2, dtype=None):
+    """
+    Prepares minibatches in a background thread, ahead of the consumer.
+
+    The minibatches are copied into contiguous in-memory arrays, which
+    reads memory-mapped data, and floating-point arrays are converted to
+    `dtype`. The training loop thus does not wait for disk reads or
+    conversions, as long as it takes longer to process a minibatch than to
+    prepare one.
+
+    Parameters
+    ----------
+    batches : iterable of tuples of arrays
+        The minibatches to prefetch, e.g. from :func:`iterate_minibatches`.
+    num_batches : int
+        The maximum number of minibatches prepared ahead.
+    dtype : str or None
+        The dtype to convert floating-point arrays to. Defaults to
+        ``theano.config.floatX``.
+
+    Yields
+    ------
+    tuple of arrays
+        The prepared minibatches.
+    """
+    if dtype is None:
+        dtype = theano.config.floatX
+
+    def convert(batch):
+        return tuple(np.array(value, dtype=dtype)
+                     if np.issubdtype(value.dtype, np.floating)
+                     else np.array(value)
+                     for value in _as_tuple(batch))
+    return _background(batches, convert, num_batches)
+
+
+class DoubleBuffer(object):
+    """
+    Feeds minibatches to compiled functions through shared variables.
+
+    For each symbolic input, a shared variable is created that replaces the
+    input in the compiled function (see :attr:`givens`). Minibatches are
+    written into one of two preallocated sets of arrays in a background
+    thread, converting them to the dtypes of the inputs, while the function
+    processes the minibatch in the other set.
+
+    Parameters
+    ----------
+    inputs : list of symbolic variables
+        The inputs to feed, e.g. the input and target variables of a
+        training function.
+
+    Attributes
+    ----------
+    shared : list of shared variables
+        The shared variables holding the current minibatch.
+
+    Notes
+    -----
+    On the CPU, the shared variables are bound to the buffers without
+    copying. The dtype conversion happens in the background thread, so
+    arrays of any dtype can be fed to ``floatX`` inputs.
+    """
+    def __init__(self, inputs):
+        self.inputs = list(inputs)
+        self.shared = [theano.shared(np.zeros((0,) * var.ndim,
+                                              dtype=var.dtype),
+                                     broadcastable=var.broadcastable,
+                                     name=var.name)
+                       for var in self.inputs]
+
+    @property
+    def givens(self):
+        """
+        A list of pairs replacing each input by its shared variable, to be
+        passed as `givens` to :func:`theano.function`.
+        """
+        return list(zip(self.inputs, self.shared))
+
+    def feed(self, batches):
+        """
+        Iterates over minibatches, binding each one to the shared variables.
+
+        Parameters
+        ----------
+        batches : iterable of tuples of arrays
+            The minibatches to feed, one array per input.
+
+        Yields
+        ------
+        int
+            The number of examples in the current minibatch. Any function
+            compiled with :attr:`givens` can be called to process it before
+            advancing the iteration.
+        """
+        buffers = [[None] * len(self.inputs) for _ in range(2)]
+        free = queue.Queue()
+        free.put(0)
+        free.put(1)
+
+        def fill(batch):
+            batch = _as_tuple(batch)
+            if len(batch) != len(self.inputs):
+                raise ValueError("Expected %d arrays per minibatch, got %d" %
+                                 (len(self.inputs), len(batch)))
+            slot = free.get()
+            num_examples = len(batch[0])
+            for idx, (var, value) in enumerate(zip(self.inputs, batch)):
+                array = buffers[slot][idx]
+                if (array is None or array.shape[1:] != value.shape[1:] or
+                        len(array) < num_examples):
+                    array = np.empty(value.shape, dtype=var.dtype)
+                    buffers[slot][idx] = array
+                array[:num_examples] = value
+            return slot, num_examples
+
+        previous = None
+        try:
+            for slot, num_examples in _background(batches, fill, 1):
+                for shared, array in zip(self.shared, buffers[slot]):
+                    shared.set_value(array[:num_examples], borrow=True)
+                if previous is not None:
+                    free.put(previous)
+                previous = slot
+                yield num_examples
+        finally:
+            # unblock the background thread if the iteration was aborted
+            free.put(0)
+            free.put(1)
+
+
+MANIFEST = 'dataset.json'
+
+
+def _shard_filename(directory, name, idx):
+    return os.path.join(directory, "%s.%05d.npy" % (name, idx))
+
+
+def _load_pickle(f):
+    if sys.version_info[0] >= 3:
+        # pickles written by Python 2 store array data as byte strings
+        return pickle.load(f, encoding='latin-1')
+    return pickle.load(f)
+
+
+def _load_source(source, split=None):
+    """
+    Returns the arrays of a dataset as a list of (name, array) pairs.
+    """
+    if isinstance(source, str):
+        if source.endswith('.npz'):
+            source = np.load(source)
+        else:
+            opener = gzip.open if source.endswith('.gz') else open
+            with opener(source, 'rb') as f:
+                source = _load_pickle(f)
+    if split is not None:
+        source = source[split]
+    if hasattr(source, 'keys'):
+        return [(name, source[name]) for name in sorted(source.keys())]
+    if any(isinstance(array, (tuple, list)) for array in source):
+        raise ValueError("The dataset holds nested sequences of arrays, such "
+                         "as (train, valid, test) splits; pass `split` to "
+                         "select one of them")
+    return [("arr_%d" % idx, np.asarray(array))
+            for idx, array in enumerate(source)]
+
+
+def convert_to_shards(source, directory, names=None, max_shard_bytes=2**28,
+                      split=None):
+    """
+    Converts a dataset into memory-mappable ``.npy`` shards.
+
+    This needs to be done once. Afterwards, the dataset can be opened with
+    :class:`ShardedDataset` without reading or decompressing it.
+
+    Parameters
+    ----------
+    source : str, dict or list of arrays
+        The dataset: arrays of the same size along the first axis, or a dict
+        mapping names to such arrays, or the filename of a ``.npz`` file or
+        of a (gzipped) pickle holding such a list or dict. Pickles written
+        by Python 2 can be read as well.
+    directory : str
+        The directory to write the shards to. It is created if it does not
+        exist.
+    names : list of str or None
+        Names for the arrays. Defaults to the keys of a dict (in sorted
+        order) or to ``arr_0``, ``arr_1`` and so on.
+    max_shard_bytes : int
+        The maximum size of a shard, summed over all arrays. Each shard
+        holds at least one example.
+    split : int, str or None
+        Selects a part of a source that holds several splits of a dataset,
+        such as ``1`` for the validation set of the MNIST pickle, which is a
+        tuple ``((X_train, y_train), (X_valid, y_valid), (X_test, y_test))``.
+
+    Returns
+    -------
+    ShardedDataset
+        The converted dataset.
+
+    Notes
+    -----
+    Each array is stored as a series of ``<name>.<shard>.npy`` files, and
+    the layout is described by a ``dataset.json`` file. The data of ``.npy``
+    files starts at an offset aligned to 16 bytes or more, so memory-mapped
+    shards can be used in computations without copying.
+    """
+    arrays = _load_source(source, split)
+    if names is not None:
+        if len(names) != len(arrays):
+            raise ValueError("Got %d names for %d arrays" %
+                             (len(names), len(arrays)))
+        arrays = [(name, array) for name, (_, array) in zip(names, arrays)]
+    num_examples = len(arrays[0][1])
+    if any(len(array) != num_examples for _, array in arrays):
+        raise ValueError("All arrays must have the same number of examples")
+
+    example_bytes = sum(array[:1].nbytes for _, array in arrays)
+    shard_size = max(1, max_shard_bytes // max(example_bytes, 1))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    shards = []
+    for idx, start in enumerate(range(0, num_examples, shard_size)):
+        stop = min(start + shard_size, num_examples)
+        for name, array in arrays:
+            out = np.lib.format.open_memmap(
+                _shard_filename(directory, name, idx), mode='w+',
+                dtype=array.dtype, shape=(stop - start,) + array.shape[1:])
+            out[...] = array[start:stop]
+            out.flush()
+            del out
+        shards.append(stop - start)
+
+    manifest = {
+        'arrays': [{'name': name, 'dtype': array.dtype.str,
+                    'shape': list(array.shape[1:])}
+                   for name, array in arrays],
+        'shards': shards,
+    }
+    with open(os.path.join(directory, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return ShardedDataset(directory)
+
+
+def _advise(array, advice, start=0, stop=None):
+    """
+    Advises the kernel how examples `start` to `stop` of a memory-mapped
+    array will be accessed. Does nothing if this is not supported.
+    """
+    mm = getattr(array, '_mmap', None)
+    if mm is None or not hasattr(mm, 'madvise') or not len(array):
+        return
+    if stop is None:
+        stop = len(array)
+    example_bytes = array.nbytes // len(array)
+    data_start = array.offset % mmap.ALLOCATIONGRANULARITY
+    begin = data_start + start * example_bytes
+    end = data_start + stop * example_bytes
+    begin -= begin % mmap.PAGESIZE
+    try:
+        mm.madvise(advice, begin, max(min(end, len(mm)) - begin, 0))
+    except (OSError, ValueError):
+        pass
+
+
+class ShardedDataset(object):
+    """
+    A dataset stored as memory-mapped ``.npy`` shards.
+
+    Shards are mapped into memory when they are first accessed; the data
+    is only read from disk as minibatches are consumed, so datasets may be
+    much larger than the available memory.
+
+    Parameters
+    ----------
+    directory : str
+        A directory written by :func:`convert_to_shards`.
+    names : list of str or None
+        The names of the arrays to read, in the order they should appear in
+        the minibatches. Defaults to all arrays, in the order they were
+        converted.
+
+    Examples
+    --------
+    In a training loop, the minibatches can be prefetched in a background
+    thread (see :func:`prefetch`) and fed to a compiled function through a
+    :class:`DoubleBuffer`:
+
+    >>> import tempfile
+    >>> import theano
+    >>> import theano.tensor as T
+    >>> directory = tempfile.mkdtemp()
+    >>> X = np.random.randn(1000, 20).astype(theano.config.floatX)
+    >>> y = np.random.randint(0, 3, 1000).astype('int32')
+    >>> dataset = convert_to_shards({'X': X, 'y': y}, directory,
+    ...                             max_shard_bytes=10000)
+    >>> len(dataset), dataset.names, dataset.shard_sizes[:3]
+    (1000, ['X', 'y'], [60, 60, 60])
+    >>> x_var, y_var = T.matrix('x'), T.ivector('y')
+    >>> buffer = DoubleBuffer([x_var, y_var])
+    >>> iter_train = theano.function([], [x_var.shape[0], y_var.sum()],
+    ...                              givens=buffer.givens)
+    >>> batches = dataset.iterate(100, shuffle=True)
+    >>> results = [iter_train() for _ in buffer.feed(prefetch(batches))]
+    >>> sum(r[0] for r in results), sum(r[1] for r in results) == y.sum()
+    (1000, True)
+    """
+    def __init__(self, directory, names=None):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST)) as f:
+            manifest = json.load(f)
+        available = [info['name'] for info in manifest['arrays']]
+        if names is None:
+            names = available
+        missing = set(names) - set(available)
+        if missing:
+            raise ValueError("no array(s) named %s in %s" %
+                             (", ".join(sorted(missing)), directory))
+        self.names = list(names)
+        self.shard_sizes = list(manifest['shards'])
+        self._shards = [None] * len(self.shard_sizes)
+
+    def __len__(self):
+        return sum(self.shard_sizes)
+
+    def shard(self, idx):
+        """
+        Returns the memory-mapped arrays of the shard with index `idx`.
+        """
+        if self._shards[idx] is None:
+            self._shards[idx] = tuple(
+                np.load(_shard_filename(self.directory, name, idx),
+                        mmap_mode='r')
+                for name in self.names)
+        return self._shards[idx]
+
+    def iterate(self, batch_size, shuffle=False, rng=None, drop_last=False):
+        """
+        Iterates over the dataset in minibatches.
+
+        Parameters
+        ----------
+        batch_size : int
+            The number of examples per minibatch. Minibatches do not span
+            shards, so the last minibatch of each shard may be smaller.
+        shuffle : bool
+            If False, the dataset is read sequentially, and the kernel is
+            advised to read ahead aggressively. If True, the shards and the
+            minibatches within each shard are visited in random order, and
+            the kernel is advised to read the next minibatch ahead. Each
+            minibatch is still read from a contiguous block of the disk,
+            so the examples of a minibatch stay together; to mix them, pass
+            the minibatches through :func:`shuffle`.
+        rng : numpy.random.RandomState or None
+            The random number generator to use. Defaults to
+            ``numpy.random``.
+        drop_last : bool
+            If True, the last minibatch of each shard is omitted if it is
+            smaller than `batch_size`.
+
+        Yields
+        ------
+        tuple of arrays
+            Memory-mapped slices of the arrays of the dataset. They are only
+            read from disk when they are accessed.
+        """
+        if rng is None:
+            rng = np.random
+        blocks = []
+        shard_order = np.arange(len(self.shard_sizes))
+        if shuffle:
+            shard_order = rng.permutation(shard_order)
+        for idx in shard_order:
+            size = self.shard_sizes[idx]
+            if drop_last:
+                size -= size % batch_size
+            starts = np.arange(0, size, batch_size)
+            if shuffle:
+                starts = rng.permutation(starts)
+            blocks.extend((idx, start) for start in starts)
+
+        advice = getattr(mmap, 'MADV_RANDOM' if shuffle
+                         else 'MADV_SEQUENTIAL', None)
+        for position, (idx, start) in enumerate(blocks):
+            shard = self.shard(idx)
+            if position == 0 or idx != blocks[position - 1][0]:
+                if advice is not None:
+                    for array in shard:
+                        _advise(array, advice)
+            if shuffle and position + 1 < len(blocks):
+                # read ahead the next minibatch
+                next_idx, next_start = blocks[position + 1]
+                if hasattr(mmap, 'MADV_WILLNEED'):
+                    for array in self.shard(next_idx):
+                        _advise(array, mmap.MADV_WILLNEED, next_start,
+                                next_start + batch_size)
+            yield tuple(array[start:start + batch_size] for array in shard)
+
+
+class PagedDataset(object):
+    """
+    Pages a dataset through shared variables in fixed-size chunks.
+
+    Training functions that slice minibatches out of shared variables with
+    `givens` (e.g. ``givens={X_batch: X_shared[batch_slice]}``) avoid
+    passing data on each call, but need the dataset to be resident in the
+    shared variables. This class only keeps one chunk of the dataset in the
+    shared variables at a time, and loads the next chunk in a background
+    thread while the current one is used (see :class:`DoubleBuffer`).
+
+    Parameters
+    ----------
+    source : list of arrays or ShardedDataset
+        Arrays of the same size along the first axis, which may be
+        memory-mapped, or a :class:`ShardedDataset`.
+    chunk_size : int
+        The maximum number of examples per chunk. For a
+        :class:`ShardedDataset`, chunks do not span shards.
+    dtypes : list of str or None
+        The dtypes of the shared variables. Defaults to
+        ``theano.config.floatX`` for floating-point arrays and to the dtype
+        of the array otherwise.
+
+    Attributes
+    ----------
+    shared : list of shared variables
+        The shared variables holding the current chunk, one for each array,
+        to be used in the `givens` of the compiled functions.
+
+    Examples
+    --------
+    >>> import theano
+    >>> import theano.tensor as T
+    >>> X = np.random.randn(1000, 20)
+    >>> y = np.random.randint(0, 3, 1000).astype('int32')
+    >>> paged = PagedDataset([X, y], chunk_size=300)
+    >>> X_shared, y_shared = paged.shared
+    >>> batch_index = T.iscalar('batch_index')
+    >>> batch_slice = slice(batch_index * 100, (batch_index + 1) * 100)
+    >>> X_batch, y_batch = T.matrix('x'), T.ivector('y')
+    >>> iter_train = theano.function(
+    ...     [batch_index], [X_batch.shape[0], y_batch.sum()],
+    ...     givens={X_batch: X_shared[batch_slice],
+    ...             y_batch: y_shared[batch_slice]})
+    >>> results = []
+    >>> for num_examples in paged.chunks():
+    ...     for b in range(num_examples // 100):
+    ...         results.append(iter_train(b))
+    >>> len(results), sum(r[1] for r in results) == y.sum()
+    (10, True)
+    """
+    def __init__(self, source, chunk_size, dtypes=None):
+        self.source = source
+        self.chunk_size = chunk_size
+        if isinstance(source, ShardedDataset):
+            arrays = source.shard(0)
+        else:
+            arrays = _as_tuple(source)
+        if dtypes is None:
+            dtypes = [theano.config.floatX
+                      if np.issubdtype(array.dtype, np.floating)
+                      else array.dtype for array in arrays]
+        variables = [theano.tensor.TensorType(dtype, (False,) * array.ndim)()
+                     for dtype, array in zip(dtypes, arrays)]
+        self._buffer = DoubleBuffer(variables)
+        self.shared = self._buffer.shared
+
+    def __len__(self):
+        if isinstance(self.source, ShardedDataset):
+            return len(self.source)
+        return len(_as_tuple(self.source)[0])
+
+    def chunks(self, shuffle=False, rng=None):
+        """
+        Iterates over the dataset in chunks, binding each chunk to the
+        shared variables.
+
+        Parameters
+        ----------
+        shuffle : bool
+            If True, the chunks are visited in random order. The examples
+            within a chunk are not shuffled; shuffle the minibatch indices
+            within each chunk instead.
+        rng : numpy.random.RandomState or None
+            The random number generator to use. Defaults to
+            ``numpy.random``.
+
+        Yields
+        ------
+        int
+            The number of examples in the current chunk.
+        """
+        if isinstance(self.source, ShardedDataset):
+            chunks = self.source.iterate(self.chunk_size, shuffle=shuffle,
+                                         rng=rng)
+        else:
+            arrays = _as_tuple(self.source)
+            starts = np.arange(0, len(arrays[0]), self.chunk_size)
+            if shuffle:
+                starts = (rng or np.random).permutation(starts)
+            chunks = (tuple(array[start:start + self.chunk_size]
+                            for array in arrays) for start in starts)
+        return self._buffer.feed(chunks)
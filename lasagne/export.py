@@ -0,0 +1,275 @@
+"""
+Functions to export networks for prediction without Theano.
+
+Networks are exported to an execution plan: a list of NumPy operations along
+with the parameter values they need. The plan is run by a
+:class:`lasagne.runtime.Predictor`, which does not depend on Theano, so
+prediction workers start without importing Theano or compiling anything:
+
+ * export_network()
+
+The following layers are supported: :class:`InputLayer`,
+:class:`DenseLayer`, :class:`NINLayer`, :class:`NonlinearityLayer`,
+:class:`Conv1DLayer`, :class:`Conv2DLayer`, :class:`MaxPool1DLayer`,
+:class:`MaxPool2DLayer`, :class:`GlobalPoolLayer`, :class:`FeaturePoolLayer`,
+:class:`FlattenLayer`, :class:`ReshapeLayer`, :class:`DimshuffleLayer`,
+:class:`PadLayer`, :class:`ConcatLayer`, :class:`ElemwiseSumLayer`,
+:class:`LocalResponseNormalization2DLayer`, and :class:`DropoutLayer` and
+:class:`GaussianNoiseLayer` (which are omitted, as for the deterministic
+output), with any of the nonlinearities of :mod:`lasagne.nonlinearities`.
+
+Usage
+-----
+>>> import numpy as np
+>>> import theano
+>>> from lasagne.layers import InputLayer, DenseLayer, get_output
+>>> from lasagne.export import export_network
+>>> l_in = InputLayer((None, 20))
+>>> l1 = DenseLayer(l_in, num_units=3)
+>>> predictor = export_network(l1)  # pass a filename to save it as well
+>>> X = np.ones((5, 20), dtype=theano.config.floatX)
+>>> predictor.predict(X).shape
+(5, 3)
+>>> np.allclose(predictor.predict(X), get_output(l1, X).eval())
+True
+"""
+
+import numpy as np
+
+import theano.tensor as T
+
+from . import nonlinearities
+from .layers import (InputLayer, DenseLayer, NINLayer, NonlinearityLayer,
+                     Conv1DLayer, Conv2DLayer, MaxPool1DLayer, MaxPool2DLayer,
+                     GlobalPoolLayer, FeaturePoolLayer, FlattenLayer,
+                     ReshapeLayer, DimshuffleLayer, PadLayer, ConcatLayer,
+                     ElemwiseSumLayer, LocalResponseNormalization2DLayer,
+                     DropoutLayer, GaussianNoiseLayer)
+from .layers.helper import _get_all_layers
+from .runtime import FORMAT_VERSION, Predictor
+
+
+__all__ = [
+    "export_network",
+]
+
+
+_NONLINEARITIES = {
+    nonlinearities.identity: 'identity',
+    nonlinearities.sigmoid: 'sigmoid',
+    nonlinearities.softmax: 'softmax',
+    nonlinearities.tanh: 'tanh',
+    nonlinearities.rectify: 'rectify',
+}
+
+_POOL_FUNCTIONS = {
+    T.max: 'max',
+    T.min: 'min',
+    T.mean: 'mean',
+    T.sum: 'sum',
+}
+
+
+def _export_nonlinearity(nonlinearity):
+    if nonlinearity is None:
+        return {'name': 'identity'}
+    elif isinstance(nonlinearity, nonlinearities.LeakyRectify):
+        return {'name': 'leaky_rectify',
+                'leakiness': float(nonlinearity.leakiness)}
+    elif nonlinearity in _NONLINEARITIES:
+        return {'name': _NONLINEARITIES[nonlinearity]}
+    raise NotImplementedError("Cannot export nonlinearity %r" % nonlinearity)
+
+
+def _export_pool_function(pool_function):
+    if pool_function not in _POOL_FUNCTIONS:
+        raise NotImplementedError("Cannot export pool function %r" %
+                                  pool_function)
+    return _POOL_FUNCTIONS[pool_function]
+
+
+def _export_dense(layer):
+    return ('dense',
+            {'nonlinearity': _export_nonlinearity(layer.nonlinearity)},
+            {'W': layer.W, 'b': layer.b})
+
+
+def _export_nin(layer):
+    return ('nin', {'nonlinearity': _export_nonlinearity(layer.nonlinearity)},
+            {'W': layer.W, 'b': layer.b})
+
+
+def _export_nonlinearity_layer(layer):
+    return ('nonlinearity',
+            {'nonlinearity': _export_nonlinearity(layer.nonlinearity)}, {})
+
+
+def _export_conv(layer):
+    # Theano convolves, the runtime correlates: flip the filters
+    W = layer.W.get_value()
+    ndim = W.ndim - 2
+    W = np.ascontiguousarray(W[(Ellipsis,) + (slice(None, None, -1),) * ndim])
+    if layer.border_mode == 'valid':
+        before = after = (0,) * ndim
+    elif layer.border_mode == 'full':
+        before = after = tuple(size - 1 for size in layer.filter_size)
+    elif layer.border_mode == 'same':
+        after = tuple((size - 1) // 2 for size in layer.filter_size)
+        before = tuple(size - 1 - a
+                       for size, a in zip(layer.filter_size, after))
+    else:
+        raise RuntimeError("Invalid border mode: '%s'" % layer.border_mode)
+    params = {'stride': list(layer.stride),
+              'pad_before': list(before),
+              'pad_after': list(after),
+              'nonlinearity': _export_nonlinearity(layer.nonlinearity)}
+    return 'conv', params, {'W': W, 'b': layer.b}
+
+
+def _export_max_pool(layer):
+    return ('max_pool', {'pool_size': list(layer.pool_size),
+                         'stride': list(layer.stride),
+                         'pad': list(layer.pad),
+                         'ignore_border': bool(layer.ignore_border)}, {})
+
+
+def _export_global_pool(layer):
+    return ('global_pool',
+            {'function': _export_pool_function(layer.pool_function)}, {})
+
+
+def _export_feature_pool(layer):
+    return ('feature_pool',
+            {'function': _export_pool_function(layer.pool_function),
+             'pool_size': layer.pool_size, 'axis': layer.axis}, {})
+
+
+def _export_reshape(layer):
+    return 'reshape', {'shape': list(layer.shape)}, {}
+
+
+def _export_dimshuffle(layer):
+    return 'dimshuffle', {'pattern': list(layer.pattern)}, {}
+
+
+def _export_pad(layer):
+    return ('pad', {'width': layer.width, 'val': layer.val,
+                    'batch_ndim': layer.batch_ndim}, {})
+
+
+def _export_concat(layer):
+    return 'concat', {'axis': layer.axis}, {}
+
+
+def _export_elemwise_sum(layer):
+    return ('elemwise_sum',
+            {'coeffs': [float(coeff) for coeff in layer.coeffs]}, {})
+
+
+def _export_lrn(layer):
+    return ('local_response_normalization',
+            {'alpha': layer.alpha, 'k': layer.k, 'beta': layer.beta,
+             'n': layer.n}, {})
+
+
+# Layer classes are matched exactly, since subclasses may compute a
+# different output.
+_EXPORTERS = {
+    DenseLayer: _export_dense,
+    NINLayer: _export_nin,
+    NonlinearityLayer: _export_nonlinearity_layer,
+    Conv1DLayer: _export_conv,
+    Conv2DLayer: _export_conv,
+    MaxPool1DLayer: _export_max_pool,
+    MaxPool2DLayer: _export_max_pool,
+    GlobalPoolLayer: _export_global_pool,
+    FeaturePoolLayer: _export_feature_pool,
+    FlattenLayer: lambda layer: ('flatten', {}, {}),
+    ReshapeLayer: _export_reshape,
+    DimshuffleLayer: _export_dimshuffle,
+    PadLayer: _export_pad,
+    ConcatLayer: _export_concat,
+    ElemwiseSumLayer: _export_elemwise_sum,
+    LocalResponseNormalization2DLayer: _export_lrn,
+}
+
+# layers whose deterministic output is their input
+_OMITTED = (DropoutLayer, GaussianNoiseLayer)
+
+
+def export_network(layer_or_layers, filename=None):
+    """
+    Exports the deterministic output of a network for prediction with NumPy.
+
+    The current parameter values are copied, so later changes to the
+    parameters do not affect the exported network.
+
+    Parameters
+    ----------
+    layer_or_layers : Layer or list of Layer
+        The layer(s) to export the output of. The inputs of the exported
+        network are the :class:`InputLayer` instances of the network, in
+        the order of :func:`lasagne.layers.get_all_layers()`.
+    filename : str, file or None
+        If given, the exported network is saved to this ``.npz`` file as
+        well, to be loaded with :func:`lasagne.runtime.load()`.
+
+    Returns
+    -------
+    Predictor
+        A :class:`lasagne.runtime.Predictor` computing the output of the
+        network.
+
+    Raises
+    ------
+    NotImplementedError
+        If the network contains a layer or a nonlinearity that cannot be
+        exported.
+    """
+    layers = _get_all_layers(layer_or_layers)
+    input_layers = [layer for layer in layers
+                    if isinstance(layer, InputLayer)]
+    inputs = [{'shape': list(layer.shape), 'dtype': layer.input_var.dtype}
+              for layer in input_layers]
+    indices = dict((layer, idx) for idx, layer in enumerate(input_layers))
+    steps = []
+    arrays = {}
+    for layer in layers:
+        if layer in indices:
+            continue
+        elif isinstance(layer, _OMITTED):
+            indices[layer] = indices[layer.input_layer]
+            continue
+        elif type(layer) not in _EXPORTERS:
+            raise NotImplementedError("Cannot export layer %r of type %s" %
+                                      (layer, type(layer).__name__))
+        op, params, values = _EXPORTERS[type(layer)](layer)
+        if hasattr(layer, 'input_layers'):
+            parents = layer.input_layers
+        else:
+            parents = [layer.input_layer]
+        names = {}
+        for key, value in values.items():
+            if value is not None:
+                names[key] = '%d.%s' % (len(steps), key)
+                if not isinstance(value, np.ndarray):
+                    value = value.get_value()
+                arrays[names[key]] = value
+        indices[layer] = len(input_layers) + len(steps)
+        steps.append({'op': op,
+                      'inputs': [indices[parent] for parent in parents],
+                      'params': params,
+                      'arrays': names})
+
+    single_output = not isinstance(layer_or_layers, (list, tuple))
+    if single_output:
+        layer_or_layers = [layer_or_layers]
+    plan = {'version': FORMAT_VERSION,
+            'inputs': inputs,
+            'steps': steps,
+            'outputs': [indices[layer] for layer in layer_or_layers],
+            'single_output': single_output}
+    predictor = Predictor(plan, arrays)
+    if filename is not None:
+        predictor.save(filename)
+    return predictor
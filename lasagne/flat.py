@@ -0,0 +1,197 @@
+"""
+Functions to keep the parameters of a network in a single flat buffer.
+
+By default, every parameter of a network is a separate shared variable, and
+the update functions in :mod:`lasagne.updates` create a separate update
+expression (and separate accumulators) for each of them. For deep networks,
+this results in hundreds of small operations per training step. A
+:class:`ParamBuffer` stores all parameters in one contiguous vector instead:
+
+ * ParamBuffer
+
+The compiled functions read the parameters as views into the buffer, and
+the update functions can be applied to the buffer as if it were a single
+parameter. This results in a single fused update over the whole vector, with
+a single flat accumulator per kind of optimizer state, and copying the whole
+model amounts to copying one array.
+
+Usage
+-----
+>>> import theano
+>>> import theano.tensor as T
+>>> from lasagne.layers import InputLayer, DenseLayer, get_all_params
+>>> from lasagne.updates import adagrad
+>>> from lasagne.flat import ParamBuffer
+>>> l_in = InputLayer((100, 20))
+>>> l1 = DenseLayer(l_in, num_units=3)
+>>> x = T.matrix('x')
+>>> loss = l1.get_output(x).mean()
+>>> buffer = ParamBuffer(get_all_params(l1))
+>>> updates = adagrad(buffer.get_grads(loss), [buffer.flat])
+>>> train_fn = theano.function([x], loss, updates=updates,
+...                            givens=buffer.givens)
+>>> buffer.flat.get_value().shape
+(63,)
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+import theano
+import theano.tensor as T
+
+
+__all__ = [
+    "ParamBuffer",
+]
+
+
+class ParamBuffer(object):
+    """
+    Stores a list of parameters in a single contiguous vector.
+
+    On construction, the current values of the parameters are copied into
+    the buffer, and the parameters are rebound to views of the buffer.
+
+    Parameters
+    ----------
+    params : list of shared variables
+        The parameters to store in the buffer, e.g. as returned by
+        :func:`lasagne.layers.get_all_params()`. They must all have the same
+        dtype.
+    storage : numpy array or None
+        A one-dimensional array to use as the storage of the buffer, e.g. an
+        array backed by shared memory. It must have the dtype of the
+        parameters and as many elements as they have in total. Its previous
+        content is overwritten. If None, a new array is allocated.
+    name : str
+        The name of the shared variable holding the buffer.
+
+    Attributes
+    ----------
+    flat : shared variable
+        The shared vector holding all parameters.
+    params : list of shared variables
+        The parameters stored in the buffer.
+
+    Notes
+    -----
+    Theano may replace the storage of the buffer when it is updated by a
+    compiled function, which leaves the parameters bound to the previous
+    storage. Call :meth:`scatter()` to rebind them before accessing the
+    parameters individually (e.g. to save them), and :meth:`gather()`
+    after setting their values individually.
+    """
+    def __init__(self, params, storage=None, name='params'):
+        self.params = list(params)
+        dtypes = set(param.dtype for param in self.params)
+        if len(dtypes) > 1:
+            raise ValueError("All parameters must have the same dtype, "
+                             "got %s" % ", ".join(sorted(dtypes)))
+        dtype = dtypes.pop() if dtypes else theano.config.floatX
+        self.shapes = [param.get_value(borrow=True).shape
+                       for param in self.params]
+        sizes = [int(np.prod(shape)) for shape in self.shapes]
+        self.offsets = np.cumsum([0] + sizes).tolist()
+        size = self.offsets[-1]
+
+        if storage is None:
+            storage = np.empty(size, dtype=dtype)
+        elif storage.shape != (size,) or storage.dtype != dtype:
+            raise ValueError("storage must be a %s vector of %d elements, "
+                             "got %s array of shape %r" %
+                             (dtype, size, storage.dtype, storage.shape))
+        self.flat = theano.shared(storage, name=name, borrow=True)
+        self.gather()
+
+    def __len__(self):
+        return self.offsets[-1]
+
+    def _slices(self):
+        return zip(self.params, self.shapes, self.offsets[:-1],
+                   self.offsets[1:])
+
+    @property
+    def givens(self):
+        """
+        An OrderedDict mapping each parameter to a symbolic view into the
+        buffer, to be passed as `givens` to :func:`theano.function`.
+        """
+        return OrderedDict(
+            (param, T.patternbroadcast(self.flat[start:stop].reshape(shape),
+                                       param.broadcastable))
+            for param, shape, start, stop in self._slices())
+
+    def flatten(self, tensors):
+        """
+        Concatenates one symbolic expression per parameter into a vector
+        laid out like the buffer.
+
+        Parameters
+        ----------
+        tensors : list of symbolic expressions
+            Expressions of the shapes of the parameters, in order.
+
+        Returns
+        -------
+        symbolic expression
+            A symbolic vector of the size of the buffer.
+        """
+        if len(tensors) != len(self.params):
+            raise ValueError("Got %d expressions for %d parameters" %
+                             (len(tensors), len(self.params)))
+        return T.concatenate([tensor.flatten() for tensor in tensors])
+
+    def get_grads(self, loss):
+        """
+        Returns the gradient of a loss expression with respect to the buffer.
+
+        Parameters
+        ----------
+        loss : symbolic expression
+            A scalar loss expression depending on the parameters.
+
+        Returns
+        -------
+        list of expressions
+            A list holding the flattened gradient, to be passed to any of the
+            update functions of :mod:`lasagne.updates` along with
+            ``[buffer.flat]``.
+        """
+        return [self.flatten(theano.grad(loss, self.params))]
+
+    def get_value(self):
+        """Returns a copy of the buffer."""
+        return self.flat.get_value()
+
+    def set_value(self, value):
+        """
+        Sets the buffer (and thus all parameters) to the given vector.
+        """
+        value = np.asarray(value, dtype=self.flat.dtype)
+        if value.shape != (len(self),):
+            raise ValueError("Expected a vector of %d elements, got shape %r" %
+                             (len(self), value.shape))
+        self.flat.get_value(borrow=True)[...] = value
+        self.scatter()
+
+    def gather(self):
+        """
+        Copies the current values of the parameters into the buffer and
+        rebinds the parameters to views of the buffer.
+        """
+        storage = self.flat.get_value(borrow=True)
+        for param, shape, start, stop in self._slices():
+            value = param.get_value(borrow=True)
+            storage[start:stop] = value.ravel()
+        self.scatter()
+
+    def scatter(self):
+        """
+        Rebinds the parameters to views of the current storage of the buffer.
+        This does not copy any data.
+        """
+        storage = self.flat.get_value(borrow=True)
+        for param, shape, start, stop in self._slices():
+            param.set_value(storage[start:stop].reshape(shape), borrow=True)
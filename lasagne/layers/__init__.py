@@ -8,3 +8,4 @@ from .pool import *
 from .shape import *
 from .merge import *
 from .normalization import *
+from .quantized import *
@@ -22,7 +22,9 @@ class Layer(object):
     network's output :class:`Layer` instance can double as a handle to the
     full network.
     """
-    def __init__(self, incoming, name=None):
+    storage_dtype = None
+
+    def __init__(self, incoming, name=None, storage_dtype=None):
         """
         Instantiates the layer.
 
@@ -31,6 +33,11 @@ class Layer(object):
                 the layer feeding into this layer, or the expected input shape
             - name : a string or None
                 an optional name to attach to this layer
+            - storage_dtype : a numpy data-type or None
+                the dtype to store the floating-point parameters of the layer
+                in, such as ``'float16'`` to halve their memory for
+                inference. They are upcast to ``floatX`` for computation.
+                Defaults to ``floatX``.
         """
         if isinstance(incoming, tuple):
             self.input_shape = incoming
@@ -39,6 +46,7 @@ class Layer(object):
             self.input_shape = incoming.get_output_shape()
             self.input_layer = incoming
         self.name = name
+        self.storage_dtype = storage_dtype
 
     def get_params(self):
         """
@@ -116,7 +124,11 @@ class Layer(object):
         :note:
             When implementing a new :class:`Layer` class, you will usually
             keep this unchanged and just override `get_output_for()`.
+
+            This is a shortcut for :func:`lasagne.layers.get_output`, which
+            computes the output of each layer below this one exactly once.
         """
+        from .helper import get_output
         if isinstance(input, dict) and (self in input):
             # this layer is mapped to an expression or numpy array
             return utils.as_theano_expression(input[self])
@@ -124,9 +136,8 @@ class Layer(object):
             raise RuntimeError("get_output() called on a free-floating layer; "
                                "there isn't anything to get its input from. "
                                "Did you mean get_output_for()?")
-        else:  # in all other cases, just pass the input on to the next layer.
-            layer_input = self.input_layer.get_output(input, **kwargs)
-            return self.get_output_for(layer_input, **kwargs)
+        else:  # in all other cases, propagate the input through the network.
+            return get_output(self, input, **kwargs)
 
     def get_output_shape_for(self, input_shape):
         """
@@ -210,6 +221,9 @@ class Layer(object):
             enables the layer to support initialization with numpy arrays,
             existing Theano shared variables, and callables for generating
             initial parameter values.
+
+            Floating-point parameters created from numpy arrays or callables
+            are stored in the layer's `storage_dtype`, if set.
         """
         if name is not None:
             if self.name is not None:
@@ -228,7 +242,7 @@ class Layer(object):
             if param.shape != shape:
                 raise RuntimeError("parameter array has shape %s, should be "
                                    "%s" % (param.shape, shape))
-            return theano.shared(param, name=name)
+            return theano.shared(self._to_storage_dtype(param), name=name)
 
         elif hasattr(param, '__call__'):
             arr = param(shape)
@@ -237,13 +251,19 @@ class Layer(object):
                                    "provided callable did not return a numpy "
                                    "array")
 
-            return theano.shared(utils.floatX(arr), name=name)
+            return theano.shared(self._to_storage_dtype(utils.floatX(arr)),
+                                 name=name)
 
         else:
             raise RuntimeError("cannot initialize parameters: 'param' is not "
                                "a numpy array, a Theano shared variable, or a "
                                "callable")
 
+    def _to_storage_dtype(self, arr):
+        if self.storage_dtype is None or arr.dtype.kind != 'f':
+            return arr
+        return arr.astype(self.storage_dtype)
+
 
 class MultipleInputsLayer(Layer):
     """
@@ -251,7 +271,7 @@ class MultipleInputsLayer(Layer):
     It should be subclassed when implementing new types of layers that
     obtain their input from multiple layers.
     """
-    def __init__(self, incomings, name=None):
+    def __init__(self, incomings, name=None, storage_dtype=None):
         """
         Instantiates the layer.
 
@@ -260,6 +280,9 @@ class MultipleInputsLayer(Layer):
                 the layers feeding into this layer, or expected input shapes
             - name : a string or None
                 an optional name to attach to this layer
+            - storage_dtype : a numpy data-type or None
+                the dtype to store the floating-point parameters of the layer
+                in, see :class:`Layer`
         """
         self.input_shapes = [incoming if isinstance(incoming, tuple)
                              else incoming.get_output_shape()
@@ -268,11 +291,13 @@ class MultipleInputsLayer(Layer):
                              else incoming
                              for incoming in incomings]
         self.name = name
+        self.storage_dtype = storage_dtype
 
     def get_output_shape(self):
         return self.get_output_shape_for(self.input_shapes)
 
     def get_output(self, input=None, **kwargs):
+        from .helper import get_output
         if isinstance(input, dict) and (self in input):
             # this layer is mapped to an expression or numpy array
             return utils.as_theano_expression(input[self])
@@ -280,11 +305,9 @@ class MultipleInputsLayer(Layer):
             raise RuntimeError("get_output() called on a free-floating layer; "
                                "there isn't anything to get its inputs from. "
                                "Did you mean get_output_for()?")
-        # In all other cases, just pass the network input on to the next layers
+        # In all other cases, propagate the network input through the network
         else:
-            layer_inputs = [input_layer.get_output(input, **kwargs) for
-                            input_layer in self.input_layers]
-            return self.get_output_for(layer_inputs, **kwargs)
+            return get_output(self, input, **kwargs)
 
     def get_output_shape_for(self, input_shapes):
         """
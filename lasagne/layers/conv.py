@@ -2,7 +2,7 @@ import theano.tensor as T
 
 from .. import init
 from .. import nonlinearities
-from ..utils import as_tuple
+from ..utils import as_tuple, upcast
 from ..theano_extensions import conv
 
 from .base import Layer
@@ -88,6 +88,51 @@ def conv_output_length(input_length, filter_size,
     return output_length
 
 
+def pad_same(input, input_shape, filter_size):
+    """Zero-pads an input for a 'same' convolution
+
+    Pads the trailing axes of the input such that a 'valid' convolution of
+    the padded input computes the 'same' convolution of the input: with
+    ``filter_size // 2`` zeros at the beginning and ``(filter_size - 1) //
+    2`` zeros at the end, which is the center of the 'full' convolution.
+
+    Parameters
+    ----------
+    input : Theano tensor
+        The input, with the axes to convolve over last.
+
+    input_shape : tuple of int or None
+        The shape of the input, with None for unknown sizes.
+
+    filter_size : tuple of int
+        The size of the filters along each of the trailing axes.
+
+    Returns
+    -------
+    Theano tensor
+        The padded input.
+
+    tuple of int or None
+        The shape of the padded input.
+    """
+    if all(size == 1 for size in filter_size):
+        return input, input_shape
+    ndim = len(filter_size)
+    before = [size // 2 for size in filter_size]
+    shape = tuple(input.shape[:-ndim]) + tuple(
+        input.shape[-ndim + axis] + size - 1
+        for axis, size in enumerate(filter_size))
+    padded = T.zeros(shape, dtype=input.dtype)
+    indices = (slice(None),) * (input.ndim - ndim) + tuple(
+        slice(b, b + input.shape[-ndim + axis])
+        for axis, b in enumerate(before))
+    padded = T.set_subtensor(padded[indices], input)
+    padded_shape = tuple(input_shape[:-ndim]) + tuple(
+        None if length is None else length + size - 1
+        for length, size in zip(input_shape[-ndim:], filter_size))
+    return padded, padded_shape
+
+
 class Conv1DLayer(Layer):
     """
     1D convolutional layer
@@ -160,7 +205,10 @@ class Conv1DLayer(Layer):
         `lasagne.theano_extensions.conv` module provides some alternative
         implementations for 1D convolutions, because the Theano API only
         features a 2D convolution implementation. Usually it should be fine
-        to leave this at the default value.
+        to leave this at the default value. Which implementation is fastest
+        depends on the shapes of the input and the filters:
+        `lasagne.theano_extensions.conv.conv1d_autotune` benchmarks them for
+        the layer's shapes once and uses the fastest.
 
     **kwargs
         Any additional keyword arguments are passed to the `Layer` superclass.
@@ -177,8 +225,8 @@ class Conv1DLayer(Layer):
     -----
     Theano's default convolution function (`theano.tensor.nnet.conv.conv2d`)
     does not support the 'same' border mode by default. This layer emulates
-    it by performing a 'full' convolution and then cropping the result, which
-    may negatively affect performance.
+    it by zero-padding the input and performing a 'valid' convolution, which
+    supports strides.
     """
     def __init__(self, incoming, num_filters, filter_size, stride=1,
                  border_mode="valid", untie_biases=False,
@@ -233,40 +281,43 @@ class Conv1DLayer(Layer):
 
         return (input_shape[0], self.num_filters, output_length)
 
-    def get_output_for(self, input, input_shape=None, **kwargs):
+    def get_output_for(self, input, input_shape=None, batch_size=None,
+                       **kwargs):
         # the optional input_shape argument is for when get_output_for is
         # called directly with a different shape than self.input_shape.
         if input_shape is None:
             input_shape = self.input_shape
+        # the optional batch_size argument specializes the convolution for
+        # a fixed batch size, e.g. when the input layer's is None.
+        if batch_size is not None:
+            input_shape = (batch_size,) + tuple(input_shape[1:])
 
         filter_shape = self.get_W_shape()
+        W = upcast(self.W)
 
         if self.border_mode in ['valid', 'full']:
-            conved = self.convolution(input, self.W, subsample=self.stride,
+            conved = self.convolution(input, W, subsample=self.stride,
                                       image_shape=input_shape,
                                       filter_shape=filter_shape,
                                       border_mode=self.border_mode)
         elif self.border_mode == 'same':
-            if self.stride[0] != 1:
-                raise NotImplementedError("Strided convolution with "
-                                          "border_mode 'same' is not "
-                                          "supported by this layer yet.")
-
-            conved = self.convolution(input, self.W, subsample=self.stride,
-                                      image_shape=input_shape,
+            # pad the input and compute a valid convolution, which supports
+            # strides and does not compute any output that is cropped off
+            padded, padded_shape = pad_same(input, input_shape,
+                                            self.filter_size)
+            conved = self.convolution(padded, W, subsample=self.stride,
+                                      image_shape=padded_shape,
                                       filter_shape=filter_shape,
-                                      border_mode='full')
-            shift = (self.filter_size[0] - 1) // 2
-            conved = conved[:, :, shift:input.shape[2] + shift]
+                                      border_mode='valid')
         else:
             raise RuntimeError("Invalid border mode: '%s'" % self.border_mode)
 
         if self.b is None:
             activation = conved
         elif self.untie_biases:
-            activation = conved + self.b.dimshuffle('x', 0, 1)
+            activation = conved + upcast(self.b).dimshuffle('x', 0, 1)
         else:
-            activation = conved + self.b.dimshuffle('x', 0, 'x')
+            activation = conved + upcast(self.b).dimshuffle('x', 0, 'x')
 
         return self.nonlinearity(activation)
 
@@ -340,7 +391,15 @@ class Conv2DLayer(Layer):
 
     convolution : callable
         The convolution implementation to use. Usually it should be fine to
-        leave this at the default value.
+        leave this at the default value. For large filters (such as 7x7 and
+        larger on large images), `lasagne.theano_extensions.conv.conv2d_fft`
+        computes the convolution by FFT on the CPU, falling back to the
+        default where that is not expected to be faster.
+        `lasagne.theano_extensions.conv.conv2d_mm` computes it by a single
+        matrix product (im2col), which makes good use of multithreaded BLAS
+        libraries on the CPU. For 3x3 filters with unit stride,
+        `lasagne.theano_extensions.conv.conv2d_winograd` needs up to 4 times
+        fewer multiplications, falling back to the default otherwise.
 
     **kwargs
         Any additional keyword arguments are passed to the `Layer` superclass.
@@ -357,8 +416,8 @@ class Conv2DLayer(Layer):
     -----
     Theano's default convolution function (`theano.tensor.nnet.conv.conv2d`)
     does not support the 'same' border mode by default. This layer emulates
-    it by performing a 'full' convolution and then cropping the result, which
-    may negatively affect performance.
+    it by zero-padding the input and performing a 'valid' convolution, which
+    supports strides.
     """
     def __init__(self, incoming, num_filters, filter_size, stride=(1, 1),
                  border_mode="valid", untie_biases=False,
@@ -419,43 +478,49 @@ class Conv2DLayer(Layer):
 
         return (input_shape[0], self.num_filters, output_rows, output_columns)
 
-    def get_output_for(self, input, input_shape=None, **kwargs):
+    def get_output_for(self, input, input_shape=None, batch_size=None,
+                       **kwargs):
+        conved = self._convolve(input, upcast(self.W), input_shape,
+                                batch_size)
+
+        if self.b is None:
+            activation = conved
+        elif self.untie_biases:
+            activation = conved + upcast(self.b).dimshuffle('x', 0, 1, 2)
+        else:
+            activation = conved + upcast(self.b).dimshuffle('x', 0, 'x', 'x')
+
+        return self.nonlinearity(activation)
+
+    def _convolve(self, input, W, input_shape=None, batch_size=None):
         # the optional input_shape argument is for when get_output_for is
         # called directly with a different shape than self.input_shape.
         if input_shape is None:
             input_shape = self.input_shape
+        # the optional batch_size argument specializes the convolution for
+        # a fixed batch size, e.g. when the input layer's is None.
+        if batch_size is not None:
+            input_shape = (batch_size,) + tuple(input_shape[1:])
 
         filter_shape = self.get_W_shape()
 
         if self.border_mode in ['valid', 'full']:
-            conved = self.convolution(input, self.W, subsample=self.stride,
+            conved = self.convolution(input, W, subsample=self.stride,
                                       image_shape=input_shape,
                                       filter_shape=filter_shape,
                                       border_mode=self.border_mode)
         elif self.border_mode == 'same':
-            if self.stride != (1, 1):
-                raise NotImplementedError("Strided convolution with "
-                                          "border_mode 'same' is not "
-                                          "supported by this layer yet.")
-
-            conved = self.convolution(input, self.W, subsample=self.stride,
-                                      image_shape=input_shape,
+            # pad the input and compute a valid convolution, which supports
+            # strides and does not compute any output that is cropped off
+            padded, padded_shape = pad_same(input, input_shape,
+                                            self.filter_size)
+            conved = self.convolution(padded, W, subsample=self.stride,
+                                      image_shape=padded_shape,
                                       filter_shape=filter_shape,
-                                      border_mode='full')
-            shift_x = (self.filter_size[0] - 1) // 2
-            shift_y = (self.filter_size[1] - 1) // 2
-            conved = conved[:, :, shift_x:input.shape[2] + shift_x,
-                            shift_y:input.shape[3] + shift_y]
+                                      border_mode='valid')
         else:
             raise RuntimeError("Invalid border mode: '%s'" % self.border_mode)
 
-        if self.b is None:
-            activation = conved
-        elif self.untie_biases:
-            activation = conved + self.b.dimshuffle('x', 0, 1, 2)
-        else:
-            activation = conved + self.b.dimshuffle('x', 0, 'x', 'x')
-
-        return self.nonlinearity(activation)
+        return conved
 
 # TODO: add Conv3DLayer
@@ -3,6 +3,7 @@ import theano.tensor as T
 
 from .. import init
 from .. import nonlinearities
+from ..utils import upcast
 
 from .base import Layer
 
@@ -82,9 +83,9 @@ class DenseLayer(Layer):
             # batch of feature vectors.
             input = input.flatten(2)
 
-        activation = T.dot(input, self.W)
+        activation = T.dot(input, upcast(self.W))
         if self.b is not None:
-            activation = activation + self.b.dimshuffle('x', 0)
+            activation = activation + upcast(self.b).dimshuffle('x', 0)
         return self.nonlinearity(activation)
 
 
@@ -151,7 +152,7 @@ class NINLayer(Layer):
 
     def get_output_for(self, input, **kwargs):
         # cf * bc01... = fb01...
-        out_r = T.tensordot(self.W, input, axes=[[0], [1]])
+        out_r = T.tensordot(upcast(self.W), input, axes=[[0], [1]])
         # input dims to broadcast over
         remaining_dims = range(2, input.ndim)
         # bf01...
@@ -165,7 +166,8 @@ class NINLayer(Layer):
                 remaining_dims_biases = range(1, input.ndim - 1)
             else:
                 remaining_dims_biases = ['x'] * (input.ndim - 2)  # broadcast
-            b_shuffled = self.b.dimshuffle('x', 0, *remaining_dims_biases)
+            b_shuffled = upcast(self.b).dimshuffle('x', 0,
+                                                   *remaining_dims_biases)
             activation = out + b_shuffled
 
         return self.nonlinearity(activation)
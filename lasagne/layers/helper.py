@@ -1,19 +1,26 @@
 from collections import deque
+from itertools import chain
 
 import numpy as np
+import theano
 
 from .. import utils
 
+from .base import Layer, MultipleInputsLayer
+
 
 __all__ = [
     "get_all_layers",
     "get_all_layers_old",
+    "get_output",
     "get_all_params",
     "get_all_bias_params",
     "get_all_non_bias_params",
     "count_params",
     "get_all_param_values",
     "set_all_param_values",
+    "set_storage_dtype",
+    "NetworkGraph",
 ]
 
 
@@ -38,9 +45,10 @@ def get_all_layers(layer):
         True
 
     :parameters:
-        - layer : Layer or list
+        - layer : Layer, list or NetworkGraph
             the :class:`Layer` instance for which to gather all layers feeding
-            into it, or a list of :class:`Layer` instances.
+            into it, or a list of :class:`Layer` instances, or a
+            :class:`NetworkGraph` indexing them.
 
     :returns:
         - layers : list
@@ -48,6 +56,9 @@ def get_all_layers(layer):
             instance(s) either directly or indirectly, and the given
             instance(s) themselves, in topological order.
     """
+    if isinstance(layer, NetworkGraph):
+        return layer.layers
+
     import warnings
     warnings.warn("get_all_layers() has been changed to return layers in "
                   "topological order. The former implementation is still "
@@ -56,6 +67,15 @@ def get_all_layers(layer):
                   "warning, use `warnings.filterwarnings('ignore', "
                   "'.*topo.*')`.")
 
+    return _get_all_layers(layer)
+
+
+def _get_all_layers(layer, treat_as_input=None):
+    """
+    Implementation of `get_all_layers()` without the deprecation warning.
+    Layers in `treat_as_input` are included in the result, but the layers
+    feeding into them are not traversed (unless reachable otherwise).
+    """
     # We perform a depth-first search. We add a layer to the result list only
     # after adding all its incoming layers (if any) or when detecting a cycle.
     # We use a LIFO stack to avoid ever running into recursion depth limits.
@@ -67,6 +87,11 @@ def get_all_layers(layer):
     done = set()
     result = []
 
+    # If treat_as_input is given, we pretend we've already collected all
+    # their incomings.
+    if treat_as_input is not None:
+        seen.update(treat_as_input)
+
     while queue:
         # Peek at the leftmost node in the queue.
         layer = queue[0]
@@ -76,11 +101,12 @@ def get_all_layers(layer):
         elif layer not in seen:
             # We haven't seen this node yet: Mark it and queue all incomings
             # to be processed first. If there are no incomings, the node will
-            # be appended to the result list in the next iteration.
+            # be appended to the result list in the next iteration. Objects
+            # that are not Layer instances are treated as leaves.
             seen.add(layer)
-            if hasattr(layer, 'input_layers'):
+            if isinstance(layer, MultipleInputsLayer):
                 queue.extendleft(reversed(layer.input_layers))
-            elif hasattr(layer, 'input_layer'):
+            elif isinstance(layer, Layer) and hasattr(layer, 'input_layer'):
                 queue.appendleft(layer.input_layer)
         else:
             # We've been here before: Either we've finished all its incomings,
@@ -126,6 +152,87 @@ def get_all_layers_old(layer):
     return layers
 
 
+def get_output(layer_or_layers, inputs=None, **kwargs):
+    """
+    Computes the output of the network at one or more given layers.
+    Optionally, you can define the input(s) to propagate through the network
+    instead of using the input variables associated with the network's input
+    layers.
+
+    The network is traversed only once, in topological order, and the output
+    of each layer is computed a single time per call. This keeps expression
+    building linear in the number of layers for networks in which a layer
+    feeds into several others (e.g., branches joined by a
+    :class:`ConcatLayer` or :class:`ElemwiseSumLayer`).
+
+    :usage:
+        >>> from lasagne.layers import InputLayer, DenseLayer, ElemwiseSumLayer
+        >>> l_in = InputLayer((100, 20))
+        >>> l1 = DenseLayer(l_in, num_units=50)
+        >>> l2 = DenseLayer(l1, num_units=50)
+        >>> l_sum = ElemwiseSumLayer([l1, l2])
+        >>> y = get_output(l_sum)
+        >>> y1, y2 = get_output([l1, l2])
+
+    :parameters:
+        - layer_or_layers : Layer or list
+            the :class:`Layer` instance for which to compute the output
+            expression, or a list of :class:`Layer` instances.
+        - inputs : None, Theano expression, numpy array, or dict
+            If None, uses the inputs of the :class:`InputLayer` instances.
+            If a Theano expression, this will replace the inputs of all
+            :class:`InputLayer` instances (useful if your network has a
+            single input layer).
+            If a numpy array, this will be wrapped as a Theano constant
+            and used just like a Theano expression.
+            If a dictionary, any :class:`Layer` instance (including the
+            input layers) can be mapped to a Theano expression or numpy
+            array to use instead of its regular output.
+        - kwargs
+            any additional keyword arguments are passed on to each layer's
+            `get_output_for()` method.
+
+    :returns:
+        - output : Theano expression or list
+            the output of the given layer(s) given the network input
+    """
+    treat_as_input = list(inputs.keys()) if isinstance(inputs, dict) else []
+    all_layers = _get_all_layers(layer_or_layers, treat_as_input)
+    # propagate the input(s) through the network in topological order, so
+    # every incoming output is available when a layer is reached.
+    all_outputs = {}
+    for layer in all_layers:
+        if isinstance(inputs, dict) and layer in inputs:
+            # this layer is mapped to an expression or numpy array
+            all_outputs[layer] = utils.as_theano_expression(inputs[layer])
+        elif isinstance(layer, MultipleInputsLayer):
+            if any(input_layer is None for input_layer in layer.input_layers):
+                raise RuntimeError("get_output() called on a free-floating "
+                                   "layer; there isn't anything to get its "
+                                   "inputs from. Did you mean "
+                                   "get_output_for()?")
+            layer_inputs = [all_outputs[input_layer]
+                            for input_layer in layer.input_layers]
+            all_outputs[layer] = layer.get_output_for(layer_inputs, **kwargs)
+        elif isinstance(layer, Layer) and hasattr(layer, 'input_layer'):
+            if layer.input_layer is None:
+                raise RuntimeError("get_output() called on a free-floating "
+                                   "layer; there isn't anything to get its "
+                                   "input from. Did you mean "
+                                   "get_output_for()?")
+            layer_input = all_outputs[layer.input_layer]
+            all_outputs[layer] = layer.get_output_for(layer_input, **kwargs)
+        else:
+            # input layers (and any other layer-like objects we do not
+            # traverse) know best how to produce their output themselves.
+            all_outputs[layer] = layer.get_output(inputs, **kwargs)
+
+    if isinstance(layer_or_layers, (list, tuple)):
+        return [all_outputs[layer] for layer in layer_or_layers]
+    else:
+        return all_outputs[layer_or_layers]
+
+
 def get_all_params(layer):
     """
     This function gathers all learnable parameters of all layers below one
@@ -142,16 +249,20 @@ def get_all_params(layer):
         True
 
     :parameters:
-        - layer : Layer or list
+        - layer : Layer, list or NetworkGraph
             the :class:`Layer` instance for which to gather all parameters,
-            or a list of :class:`Layer` instances.
+            or a list of :class:`Layer` instances, or a :class:`NetworkGraph`
+            indexing them.
 
     :returns:
         - params : list
             a list of Theano shared variables representing the parameters.
     """
+    if isinstance(layer, NetworkGraph):
+        return layer.params
+
     layers = get_all_layers(layer)
-    params = sum([l.get_params() for l in layers], [])
+    params = chain.from_iterable(l.get_params() for l in layers)
     return utils.unique(params)
 
 
@@ -182,8 +293,11 @@ def get_all_bias_params(layer):
             a list of Theano shared variables representing the bias parameters.
 
     """
+    if isinstance(layer, NetworkGraph):
+        return layer.bias_params
+
     layers = get_all_layers(layer)
-    params = sum([l.get_bias_params() for l in layers], [])
+    params = chain.from_iterable(l.get_bias_params() for l in layers)
     return utils.unique(params)
 
 
@@ -215,8 +329,11 @@ def get_all_non_bias_params(layer):
             parameters.
 
     """
+    if isinstance(layer, NetworkGraph):
+        return layer.non_bias_params
+
     all_params = get_all_params(layer)
-    all_bias_params = get_all_bias_params(layer)
+    all_bias_params = set(get_all_bias_params(layer))
     return [p for p in all_params if p not in all_bias_params]
 
 
@@ -250,7 +367,7 @@ def count_params(layer):
 
     """
     params = get_all_params(layer)
-    shapes = [p.get_value().shape for p in params]
+    shapes = [p.get_value(borrow=True).shape for p in params]
     counts = [np.prod(shape) for shape in shapes]
     return sum(counts)
 
@@ -306,16 +423,247 @@ def set_all_param_values(layer, values):
         >>> # the parameter values are restored.
 
     :parameters:
-        - layer : Layer or list
+        - layer : Layer, list or NetworkGraph
             the :class:`Layer` instance for which to set all parameter
-            values, or a list of :class:`Layer` instances.
+            values, or a list of :class:`Layer` instances, or a
+            :class:`NetworkGraph` indexing them.
         - values : list of numpy.array
             a list of numpy arrays representing the parameter values,
             must match the number of parameters
+
+    :note:
+        Values for parameters stored in the `storage_dtype` of their layer
+        are converted to it, so values saved from a network computing in
+        ``floatX`` can be restored. Other values must match the dtype of
+        their parameters.
     """
     params = get_all_params(layer)
     if len(params) != len(values):
         raise ValueError("mismatch: got %d values to set %d parameters" %
                          (len(values), len(params)))
+    stored = set()
+    for sublayer in get_all_layers(layer):
+        if sublayer.storage_dtype is not None:
+            stored.update(param for param in sublayer.get_params()
+                          if param.dtype == sublayer.storage_dtype)
     for p, v in zip(params, values):
+        if p in stored:
+            v = np.asarray(v, dtype=p.dtype)
         p.set_value(v)
+
+
+def set_storage_dtype(layer, dtype):
+    """
+    Changes the dtype the floating-point parameters of all layers below one
+    or more given :class:`Layer` instances (including the layer(s) itself)
+    are stored in.
+
+    The parameters are replaced by new shared variables holding their values
+    converted to `dtype`, and the `storage_dtype` of the layers is set, so
+    parameters created later follow the same choice. The layers upcast their
+    parameters to ``floatX`` for computation, so storing them as float16
+    halves the memory of a float32 network, and of the checkpoints saved by
+    :mod:`lasagne.checkpoint`, at the cost of precision. This is meant for
+    inference: previously compiled functions keep using the old variables,
+    and updates from :mod:`lasagne.updates` do not handle mixed dtypes.
+
+    :usage:
+        >>> from lasagne.layers import InputLayer, DenseLayer
+        >>> l_in = InputLayer((100, 20))
+        >>> l1 = DenseLayer(l_in, num_units=50)
+        >>> set_storage_dtype(l1, 'float16')
+        >>> l1.W.dtype
+        'float16'
+
+    :parameters:
+        - layer : Layer, list or NetworkGraph
+            the :class:`Layer` instance for which to convert all parameters,
+            or a list of :class:`Layer` instances, or a :class:`NetworkGraph`
+            indexing them.
+        - dtype : a numpy data-type or None
+            the dtype to store the parameters in, or None for ``floatX``.
+    """
+    if dtype is not None:
+        dtype = np.dtype(dtype).name
+    target = dtype or theano.config.floatX
+    replacements = {}
+    for sublayer in get_all_layers(layer):
+        params = set(sublayer.get_params())
+        for name, value in list(vars(sublayer).items()):
+            if (isinstance(value, theano.compile.SharedVariable) and
+                    value in params and value.dtype.startswith('float') and
+                    value.dtype != target):
+                if value not in replacements:
+                    replacements[value] = theano.shared(
+                        value.get_value().astype(target), name=value.name,
+                        broadcastable=value.broadcastable)
+                setattr(sublayer, name, replacements[value])
+        sublayer.storage_dtype = dtype
+    if isinstance(layer, NetworkGraph):
+        layer.invalidate()
+
+
+class NetworkGraph(object):
+    """
+    An index of all layers below one or more given :class:`Layer` instances.
+
+    The network is traversed once, when the index is first queried, and the
+    topological order of its layers, their connections and their parameters
+    are kept for all subsequent queries. A :class:`NetworkGraph` can be
+    passed instead of the output layer(s) to :func:`get_all_layers`,
+    :func:`get_all_params`, :func:`get_all_bias_params`,
+    :func:`get_all_non_bias_params`, :func:`count_params`,
+    :func:`get_all_param_values`, :func:`set_all_param_values` and the
+    functions in :mod:`lasagne.regularization`.
+
+    :usage:
+        >>> from lasagne.layers import InputLayer, DenseLayer
+        >>> l_in = InputLayer((100, 20))
+        >>> l1 = DenseLayer(l_in, num_units=50)
+        >>> graph = NetworkGraph(l1)
+        >>> graph.layers == [l_in, l1]
+        True
+        >>> graph.children(l_in) == [l1]
+        True
+        >>> count_params(graph)
+        1050
+        >>> l2 = DenseLayer(l1, num_units=10)
+        >>> graph.add(l2)
+        >>> graph.non_bias_params == [l1.W, l2.W]
+        True
+
+    :parameters:
+        - layer_or_layers : Layer or list
+            the :class:`Layer` instance to index the network for, or a list
+            of :class:`Layer` instances.
+
+    :note:
+        The index is not updated automatically when the network changes.
+        Call :meth:`add` to add new output layers, and :meth:`invalidate`
+        after changing the indexed layers, such as connecting a layer to
+        another input layer or replacing its parameters, to have the index
+        rebuilt on the next query. Functions of this module that change the
+        parameters of a graph passed to them, such as
+        :func:`set_storage_dtype`, invalidate it themselves.
+    """
+    def __init__(self, layer_or_layers):
+        if isinstance(layer_or_layers, (list, tuple)):
+            self.outputs = list(layer_or_layers)
+        else:
+            self.outputs = [layer_or_layers]
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Discards the index. It is rebuilt when the graph is queried next.
+        """
+        self._layers = None
+
+    def add(self, layer_or_layers):
+        """
+        Adds one or more output layers to the graph and invalidates the index.
+
+        :parameters:
+            - layer_or_layers : Layer or list
+                the :class:`Layer` instance to add, or a list of
+                :class:`Layer` instances.
+        """
+        if isinstance(layer_or_layers, (list, tuple)):
+            self.outputs.extend(layer_or_layers)
+        else:
+            self.outputs.append(layer_or_layers)
+        self.invalidate()
+
+    def _build(self):
+        if self._layers is not None:
+            return
+        layers = _get_all_layers(self.outputs)
+
+        parents = {}
+        children = dict((layer, []) for layer in layers)
+        for layer in layers:
+            if isinstance(layer, MultipleInputsLayer):
+                incomings = layer.input_layers
+            else:
+                incomings = [getattr(layer, 'input_layer', None)]
+            parents[layer] = [incoming for incoming in incomings
+                              if incoming is not None]
+            for incoming in utils.unique(parents[layer]):
+                children[incoming].append(layer)
+
+        param_layers = {}
+        params = []
+        for layer in layers:
+            for param in layer.get_params():
+                if param not in param_layers:
+                    param_layers[param] = []
+                    params.append(param)
+                param_layers[param].append(layer)
+        bias_params = utils.unique(chain.from_iterable(
+            layer.get_bias_params() for layer in layers))
+        bias_params_set = set(bias_params)
+
+        self._parents = parents
+        self._children = children
+        self._param_layers = param_layers
+        self._params = params
+        self._bias_params = bias_params
+        self._non_bias_params = [p for p in params
+                                 if p not in bias_params_set]
+        self._layers = layers
+
+    @property
+    def layers(self):
+        """
+        All layers of the network in topological order, as returned by
+        :func:`get_all_layers`.
+        """
+        self._build()
+        return list(self._layers)
+
+    @property
+    def params(self):
+        """
+        All parameters of the network, as returned by :func:`get_all_params`.
+        """
+        self._build()
+        return list(self._params)
+
+    @property
+    def bias_params(self):
+        """
+        All bias parameters of the network, as returned by
+        :func:`get_all_bias_params`.
+        """
+        self._build()
+        return list(self._bias_params)
+
+    @property
+    def non_bias_params(self):
+        """
+        All non-bias parameters of the network, as returned by
+        :func:`get_all_non_bias_params`.
+        """
+        self._build()
+        return list(self._non_bias_params)
+
+    def parents(self, layer):
+        """
+        Returns the list of layers feeding into the given layer.
+        """
+        self._build()
+        return list(self._parents[layer])
+
+    def children(self, layer):
+        """
+        Returns the list of layers of the graph the given layer feeds into.
+        """
+        self._build()
+        return list(self._children[layer])
+
+    def param_layers(self, param):
+        """
+        Returns the list of layers of the graph that use the given parameter.
+        """
+        self._build()
+        return list(self._param_layers[param])
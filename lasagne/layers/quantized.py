@@ -0,0 +1,296 @@
+import numpy as np
+import theano
+import theano.tensor as T
+
+from .. import nonlinearities
+from .base import Layer
+from .dense import DenseLayer, NINLayer
+from .conv import Conv2DLayer
+from ..utils import as_tuple, upcast
+
+
+__all__ = [
+    "quantize_weights",
+    "QuantizedLayer",
+    "QuantizedDenseLayer",
+    "QuantizedNINLayer",
+    "QuantizedConv2DLayer",
+]
+
+
+def quantize_weights(W, axis):
+    """
+    Quantizes a weight array to int8 with one scale per output channel.
+
+    The quantization is symmetric: each channel is scaled such that its
+    largest absolute value maps to 127.
+
+    Parameters
+    ----------
+    W : numpy array
+        The weights to quantize.
+    axis : int
+        The axis of the output channels.
+
+    Returns
+    -------
+    W_q : numpy array
+        The quantized weights, of dtype int8.
+    scale : numpy array
+        The scale of each output channel, a vector of the dtype of `W`, such
+        that `W` is approximated by `W_q` times `scale` along `axis`.
+    """
+    W = np.asarray(W)
+    axes = tuple(a for a in range(W.ndim) if a != axis % W.ndim)
+    scale = np.max(np.abs(W), axis=axes) / 127.
+    scale[scale == 0] = 1  # channels of zeros
+    shape = [1] * W.ndim
+    shape[axis] = -1
+    W_q = np.clip(np.round(W / scale.reshape(shape)), -127, 127)
+    return W_q.astype(np.int8), scale.astype(W.dtype)
+
+
+class QuantizedLayer(Layer):
+    """
+    Base class of the layers with int8 weights.
+
+    The weights are stored as an int8 array `W_q` along with a vector
+    `W_scale` of one scale per output channel, using a quarter of the
+    memory of float32 weights. The output is computed from the int8 weights
+    cast to ``floatX``, and scaled per output channel afterwards, which is
+    equivalent to the output of the corresponding float layer with the
+    dequantized weights. If an `input_scale` is given, the input is
+    quantized to int8 with it as well, so the output matches that of an
+    integer implementation.
+
+    The parameters of quantized layers are meant for inference only and
+    cannot be trained.
+
+    Notes
+    -----
+    Theano has no int8 matrix products or convolutions, so every forward
+    pass casts the full int8 weights to ``floatX`` before using them. Int8
+    storage reduces the memory held by the parameters and the size of
+    exported networks, but not the memory traffic of the computation,
+    which reads the weights in ``floatX`` like the corresponding float
+    layer does. Keeping a float copy of the weights to avoid the cast
+    would give up the memory savings.
+    """
+    W_axis = 1
+
+    def _create_quantized_params(self, W, W_scale, input_scale, b,
+                                 num_channels, bias_shape):
+        W = np.asarray(W)
+        if W.dtype != np.int8:
+            raise TypeError("W must be an int8 array, got %s" % W.dtype)
+        self.W_q = self.create_param(W, W.shape, name="W_q")
+        self.W_scale = self.create_param(np.asarray(W_scale), (num_channels,),
+                                         name="W_scale")
+        self.input_scale = input_scale
+        self.b = (self.create_param(b, bias_shape, name="b")
+                  if b is not None else None)
+
+    @property
+    def W(self):
+        """
+        The symbolic expression of the dequantized weights. It is not used to
+        compute the output, which is scaled instead.
+        """
+        pattern = ['x'] * self.W_q.ndim
+        pattern[self.W_axis] = 0
+        return (T.cast(self.W_q, theano.config.floatX) *
+                upcast(self.W_scale).dimshuffle(*pattern))
+
+    def get_params(self):
+        return [self.W_q, self.W_scale] + self.get_bias_params()
+
+    def get_bias_params(self):
+        return [self.b] if self.b is not None else []
+
+    def quantize_input(self, input):
+        """
+        Rounds the input to the int8 grid of `input_scale`, if any.
+        """
+        if self.input_scale is None:
+            return input
+        scale = np.asarray(self.input_scale, dtype=input.dtype)
+        return T.clip(T.round(input / scale), -127, 127) * scale
+
+    def _activation(self, output):
+        """
+        Scales the output computed from the int8 weights per channel, and
+        adds the biases and applies the nonlinearity.
+        """
+        pattern = ['x'] * output.ndim
+        pattern[1] = 0
+        activation = output * upcast(self.W_scale).dimshuffle(*pattern)
+        if self.b is not None:
+            if self.b.ndim == 1:  # tied biases
+                pattern = ['x'] + pattern[1:]
+            else:
+                pattern = ['x'] + list(range(self.b.ndim))
+            activation = activation + upcast(self.b).dimshuffle(*pattern)
+        return self.nonlinearity(activation)
+
+
+class QuantizedDenseLayer(QuantizedLayer, DenseLayer):
+    """
+    A fully connected layer with int8 weights.
+
+    Usually created by :func:`lasagne.quantization.quantize_network()`
+    rather than directly.
+
+    Parameters
+    ----------
+    incoming : a :class:`Layer` instance or a tuple
+        The layer feeding into this layer, or the expected input shape.
+    num_units : int
+        The number of units of the layer.
+    W : numpy array
+        The int8 weights, of shape ``(num_inputs, num_units)``.
+    W_scale : numpy array
+        The scale of the weights of each unit, of shape ``(num_units,)``.
+    input_scale : float or None
+        The scale to quantize the input with, or None to keep the input in
+        floating point.
+    b : Theano shared variable, numpy array, callable or None
+        An initializer for the biases, or None for no biases.
+    nonlinearity : callable or None
+        The nonlinearity that is applied to the layer activations.
+    """
+    def __init__(self, incoming, num_units, W, W_scale, input_scale=None,
+                 b=None, nonlinearity=None, **kwargs):
+        Layer.__init__(self, incoming, **kwargs)
+        self.nonlinearity = (nonlinearities.identity if nonlinearity is None
+                             else nonlinearity)
+        self.num_units = num_units
+        num_inputs = int(np.prod(self.input_shape[1:]))
+        if np.shape(W) != (num_inputs, num_units):
+            raise ValueError("W has shape %r, should be %r" %
+                             (np.shape(W), (num_inputs, num_units)))
+        self._create_quantized_params(W, W_scale, input_scale, b, num_units,
+                                      (num_units,))
+
+    def get_output_for(self, input, **kwargs):
+        input = self.quantize_input(input)
+        if input.ndim > 2:
+            input = input.flatten(2)
+        return self._activation(
+            T.dot(input, T.cast(self.W_q, theano.config.floatX)))
+
+
+class QuantizedNINLayer(QuantizedLayer, NINLayer):
+    """
+    A network-in-network layer with int8 weights.
+
+    Usually created by :func:`lasagne.quantization.quantize_network()`
+    rather than directly.
+
+    Parameters
+    ----------
+    incoming : a :class:`Layer` instance or a tuple
+        The layer feeding into this layer, or the expected input shape.
+    num_units : int
+        The number of units of the layer.
+    W : numpy array
+        The int8 weights, of shape ``(num_input_channels, num_units)``.
+    W_scale : numpy array
+        The scale of the weights of each unit, of shape ``(num_units,)``.
+    input_scale : float or None
+        The scale to quantize the input with, or None to keep the input in
+        floating point.
+    untie_biases : bool
+        Whether the biases are separate for each position, see
+        :class:`NINLayer`.
+    b : Theano shared variable, numpy array, callable or None
+        An initializer for the biases, or None for no biases.
+    nonlinearity : callable or None
+        The nonlinearity that is applied to the layer activations.
+    """
+    def __init__(self, incoming, num_units, W, W_scale, input_scale=None,
+                 untie_biases=False, b=None, nonlinearity=None, **kwargs):
+        Layer.__init__(self, incoming, **kwargs)
+        self.nonlinearity = (nonlinearities.identity if nonlinearity is None
+                             else nonlinearity)
+        self.num_units = num_units
+        self.untie_biases = untie_biases
+        if np.shape(W) != (self.input_shape[1], num_units):
+            raise ValueError("W has shape %r, should be %r" %
+                             (np.shape(W), (self.input_shape[1], num_units)))
+        if untie_biases:
+            bias_shape = (num_units,) + self.get_output_shape()[2:]
+        else:
+            bias_shape = (num_units,)
+        self._create_quantized_params(W, W_scale, input_scale, b, num_units,
+                                      bias_shape)
+
+    def get_output_for(self, input, **kwargs):
+        input = self.quantize_input(input)
+        # cf * bc01... = fb01...
+        out_r = T.tensordot(T.cast(self.W_q, theano.config.floatX), input,
+                            axes=[[0], [1]])
+        return self._activation(
+            out_r.dimshuffle(1, 0, *range(2, input.ndim)))
+
+
+class QuantizedConv2DLayer(QuantizedLayer, Conv2DLayer):
+    """
+    A 2D convolutional layer with int8 weights.
+
+    Usually created by :func:`lasagne.quantization.quantize_network()`
+    rather than directly.
+
+    Parameters
+    ----------
+    incoming : a :class:`Layer` instance or a tuple
+        The layer feeding into this layer, or the expected input shape.
+    num_filters : int
+        The number of filters of the layer.
+    filter_size : int or tuple of int
+        The size of the filters.
+    W : numpy array
+        The int8 filters, of shape
+        ``(num_filters, num_input_channels, filter_rows, filter_columns)``.
+    W_scale : numpy array
+        The scale of each filter, of shape ``(num_filters,)``.
+    input_scale : float or None
+        The scale to quantize the input with, or None to keep the input in
+        floating point.
+    stride, border_mode, untie_biases, convolution
+        See :class:`Conv2DLayer`.
+    b : Theano shared variable, numpy array, callable or None
+        An initializer for the biases, or None for no biases.
+    nonlinearity : callable or None
+        The nonlinearity that is applied to the layer activations.
+    """
+    W_axis = 0
+
+    def __init__(self, incoming, num_filters, filter_size, W, W_scale,
+                 input_scale=None, stride=(1, 1), border_mode="valid",
+                 untie_biases=False, b=None, nonlinearity=None,
+                 convolution=T.nnet.conv2d, **kwargs):
+        Layer.__init__(self, incoming, **kwargs)
+        self.nonlinearity = (nonlinearities.identity if nonlinearity is None
+                             else nonlinearity)
+        self.num_filters = num_filters
+        self.filter_size = as_tuple(filter_size, 2)
+        self.stride = as_tuple(stride, 2)
+        self.border_mode = border_mode
+        self.untie_biases = untie_biases
+        self.convolution = convolution
+        if np.shape(W) != self.get_W_shape():
+            raise ValueError("W has shape %r, should be %r" %
+                             (np.shape(W), self.get_W_shape()))
+        if untie_biases:
+            bias_shape = (num_filters,) + self.get_output_shape()[2:]
+        else:
+            bias_shape = (num_filters,)
+        self._create_quantized_params(W, W_scale, input_scale, b, num_filters,
+                                      bias_shape)
+
+    def get_output_for(self, input, input_shape=None, batch_size=None,
+                       **kwargs):
+        return self._activation(
+            self._convolve(self.quantize_input(input),
+                           T.cast(self.W_q, theano.config.floatX),
+                           input_shape, batch_size))
@@ -0,0 +1,458 @@
+"""
+Classes to train networks with multiple processes on a single machine.
+
+Theano executes most operations of a training step on a single CPU core.
+The trainers in this module distribute the work over multiple worker
+processes that share the network parameters through shared memory:
+
+ * DataParallelTrainer
+ * HogwildTrainer
+
+Usage
+-----
+>>> import numpy as np
+>>> import theano
+>>> import theano.tensor as T
+>>> from lasagne.layers import InputLayer, DenseLayer, get_all_params
+>>> from lasagne.updates import sgd
+>>> from lasagne.parallel import DataParallelTrainer
+>>> l_in = InputLayer((None, 20))
+>>> l1 = DenseLayer(l_in, num_units=3)
+>>> x = T.matrix('x')
+>>> loss = l1.get_output(x).mean()
+>>> trainer = DataParallelTrainer([x], loss, get_all_params(l1), sgd,
+...                               num_workers=2, learning_rate=0.01)
+>>> X = np.ones((100, 20), dtype=theano.config.floatX)
+>>> loss_value = trainer.train(X)
+>>> trainer.close()
+"""
+
+import ctypes
+import multiprocessing
+import time
+import traceback
+
+import numpy as np
+
+import theano
+
+from .flat import ParamBuffer
+
+
+__all__ = [
+    "DataParallelTrainer",
+    "HogwildTrainer",
+]
+
+
+def _get_context():
+    """
+    Returns a multiprocessing context forking the current process, so the
+    workers inherit the compiled functions and the shared memory.
+    """
+    if hasattr(multiprocessing, 'get_context'):
+        return multiprocessing.get_context('fork')
+    return multiprocessing
+
+
+def _shared_array(shape, dtype, ctx):
+    """
+    Allocates a zero-initialized numpy array in shared memory.
+    """
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape)) * dtype.itemsize
+    raw = ctx.RawArray(ctypes.c_char, max(size, 1))
+    return np.frombuffer(raw, dtype=dtype, count=int(np.prod(shape))
+                         ).reshape(shape)
+
+
+def _compile_segment_update(segment, update_fn, kwargs):
+    """
+    Compiles a function applying an update rule to a segment of the flat
+    parameter vector stored in shared memory, given the gradient of the
+    segment. The optimizer state of the segment is local to the caller.
+    """
+    param = theano.shared(segment, borrow=True)
+    grad = theano.tensor.vector('grad', dtype=segment.dtype)
+    updates = update_fn([grad], [param], **kwargs)
+    fn = theano.function([grad], [], updates=updates)
+
+    def apply(grad_value):
+        fn(grad_value)
+        # Theano may have replaced the storage of the segment
+        value = param.get_value(borrow=True)
+        if value is not segment:
+            segment[...] = value
+            param.set_value(segment, borrow=True)
+    return apply
+
+
+class _WorkerPool(object):
+    """
+    Base class managing a pool of forked worker processes, each connected
+    to the parent process by a pipe.
+
+    Subclasses implement :meth:`_setup()`, which is called in each worker
+    and returns a function handling the commands sent to the worker.
+    """
+    def _share_params(self, inputs, params, num_workers):
+        """
+        Moves the parameters into a flat buffer in shared memory.
+        """
+        ctx = _get_context()
+        if num_workers is None:
+            num_workers = ctx.cpu_count()
+        elif int(num_workers) != num_workers or num_workers < 1:
+            raise ValueError("num_workers must be a positive integer, got "
+                             "%r" % (num_workers,))
+        self.num_workers = int(num_workers)
+        self.inputs = list(inputs)
+        params = list(params)
+        dtype = params[0].dtype if params else theano.config.floatX
+        size = sum(param.get_value(borrow=True).size for param in params)
+        self.buffer = ParamBuffer(params, _shared_array(size, dtype, ctx))
+
+    def _start_workers(self):
+        ctx = _get_context()
+        self._connections = []
+        self._processes = []
+        for idx in range(self.num_workers):
+            conn, child_conn = ctx.Pipe()
+            process = ctx.Process(target=self._run, args=(child_conn, idx))
+            process.daemon = True
+            process.start()
+            child_conn.close()
+            self._connections.append(conn)
+            self._processes.append(process)
+        # wait until all workers are ready
+        try:
+            self._receive(self._connections)
+        except RuntimeError:
+            self.close()
+            raise
+
+    def _setup(self, idx):
+        raise NotImplementedError
+
+    def _run(self, conn, idx):
+        """The loop run by each worker process."""
+        try:
+            handle = self._setup(idx)
+            conn.send(('ok', None))
+        except Exception:
+            conn.send(('error', traceback.format_exc()))
+            return
+        while True:
+            try:
+                command, data = conn.recv()
+            except EOFError:
+                return
+            if command == 'stop':
+                return
+            try:
+                conn.send(('ok', handle(command, data)))
+            except Exception:
+                conn.send(('error', traceback.format_exc()))
+
+    def _receive(self, connections):
+        """Collects the replies of the given workers, raising any error."""
+        results, errors = [], []
+        for conn in connections:
+            status, result = conn.recv()
+            if status == 'error':
+                errors.append(result)
+            results.append(result)
+        if errors:
+            raise RuntimeError("Error in worker process:\n%s" % errors[0])
+        return results
+
+    def _check_inputs(self, inputs):
+        if self._connections is None:
+            raise RuntimeError("The trainer has been closed")
+        if len(inputs) != len(self.inputs):
+            raise ValueError("Expected %d inputs, got %d" %
+                             (len(self.inputs), len(inputs)))
+
+    def close(self):
+        """Stops the worker processes."""
+        if self._connections is None:
+            return
+        for conn in self._connections:
+            try:
+                conn.send(('stop', None))
+            except (IOError, OSError):
+                pass
+            conn.close()
+        for process in self._processes:
+            process.join()
+        self._connections = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class DataParallelTrainer(_WorkerPool):
+    """
+    Trains a network by averaging gradients over multiple processes.
+
+    On construction, the parameters are moved into a flat buffer in shared
+    memory (see :class:`lasagne.flat.ParamBuffer`), and the given number of
+    worker processes is forked. Each training step proceeds as follows:
+
+    1. The minibatch is split along its first axis into one shard per
+       worker.
+    2. Each worker computes the gradient of the loss on its shard and
+       writes it into a shared gradient buffer.
+    3. Each worker averages the gradients of all workers for its own
+       segment of the parameter vector and applies the update rule to this
+       segment in place.
+
+    The reduction and the update are thus distributed as well, and no data
+    besides the minibatch shards is copied between processes.
+
+    Parameters
+    ----------
+    inputs : list of symbolic variables
+        The inputs of the loss expression. The values passed to
+        :meth:`train()` are split along their first axis.
+    loss : symbolic expression
+        A scalar loss expression, averaged over the examples of the batch.
+    params : list of shared variables
+        The parameters to train, e.g. as returned by
+        :func:`lasagne.layers.get_all_params()`. They must all have the same
+        dtype. They remain usable in the parent process and always reflect
+        the current state of training.
+    update_fn : callable
+        An update function of :mod:`lasagne.updates` taking a list of
+        gradients and a list of parameters as its first two arguments.
+    num_workers : int or None
+        The number of worker processes. Defaults to the number of CPUs.
+    **kwargs
+        Any additional keyword arguments are passed on to `update_fn`.
+
+    Notes
+    -----
+    The gradients of the shards are weighted by the shard sizes, so the
+    update equals the update computed on the whole batch, up to rounding.
+
+    The workers are created by forking, which is only available on Unix.
+    The hyperparameters passed to `update_fn` and any shared variables
+    other than the parameters (e.g., random number generator states) are
+    copied into the workers at construction; later changes in the parent
+    process are not seen by the workers. For the best throughput, restrict
+    each worker to a single BLAS thread (e.g., ``OMP_NUM_THREADS=1``).
+    """
+    def __init__(self, inputs, loss, params, update_fn, num_workers=None,
+                 **kwargs):
+        self._share_params(inputs, params, num_workers)
+        size = len(self.buffer)
+        self._grads = _shared_array((self.num_workers, size),
+                                    self.buffer.flat.dtype, _get_context())
+
+        self._grad_fn = theano.function(self.inputs,
+                                        [loss] + self.buffer.get_grads(loss),
+                                        givens=self.buffer.givens)
+        self._update_fn = update_fn
+        self._update_kwargs = kwargs
+        self._bounds = np.linspace(0, size, self.num_workers + 1).astype(int)
+        self._start_workers()
+
+    def _setup(self, idx):
+        storage = self.buffer.flat.get_value(borrow=True)
+        start, stop = self._bounds[idx], self._bounds[idx + 1]
+        apply = _compile_segment_update(storage[start:stop], self._update_fn,
+                                        self._update_kwargs)
+
+        def handle(command, data):
+            if command == 'grad':
+                loss, grad = self._grad_fn(*data)
+                self._grads[idx] = grad
+                return float(loss)
+            elif command == 'apply':
+                workers, weights = data
+                grad = np.dot(weights, self._grads[workers, start:stop])
+                apply(grad.astype(storage.dtype))
+        return handle
+
+    def train(self, *inputs):
+        """
+        Performs a training step on a minibatch.
+
+        Parameters
+        ----------
+        *inputs : numpy arrays
+            The values of the `inputs` given on construction. They must all
+            have the same size along the first axis.
+
+        Returns
+        -------
+        float
+            The loss on the minibatch, averaged over the shards.
+        """
+        self._check_inputs(inputs)
+        num_examples = len(inputs[0])
+        if not num_examples:
+            raise ValueError("Got no examples to train on")
+        bounds = np.linspace(0, num_examples,
+                             self.num_workers + 1).astype(int)
+        workers = [idx for idx in range(self.num_workers)
+                   if bounds[idx + 1] > bounds[idx]]
+        for idx in workers:
+            shard = [value[bounds[idx]:bounds[idx + 1]] for value in inputs]
+            self._connections[idx].send(('grad', shard))
+        losses = self._receive([self._connections[idx] for idx in workers])
+
+        weights = np.diff(bounds)[workers] / float(num_examples)
+        for conn in self._connections:
+            conn.send(('apply', (workers, weights)))
+        self._receive(self._connections)
+        return float(np.dot(weights, losses))
+
+
+class HogwildTrainer(_WorkerPool):
+    """
+    Trains a network asynchronously with multiple processes, without
+    locking (Hogwild!).
+
+    On construction, the parameters are moved into a flat buffer in shared
+    memory (see :class:`lasagne.flat.ParamBuffer`), and the given number of
+    worker processes is forked. For each call to :meth:`train()`, the data
+    is split into one shard per worker, and each worker iterates over its
+    shard in minibatches. For each minibatch, a worker computes the update
+    of the given update rule from the current parameters and adds it to the
+    shared parameters in place, regardless of the updates of other workers
+    that happened in the meantime [1]_.
+
+    Parameters
+    ----------
+    inputs : list of symbolic variables
+        The inputs of the loss expression. The values passed to
+        :meth:`train()` are split along their first axis.
+    loss : symbolic expression
+        A scalar loss expression.
+    params : list of shared variables
+        The parameters to train, e.g. as returned by
+        :func:`lasagne.layers.get_all_params()`. They must all have the same
+        dtype. They remain usable in the parent process and always reflect
+        the current state of training.
+    update_fn : callable
+        An update function of :mod:`lasagne.updates` taking a list of
+        gradients and a list of parameters as its first two arguments.
+    num_workers : int or None
+        The number of worker processes. Defaults to the number of CPUs.
+    **kwargs
+        Any additional keyword arguments are passed on to `update_fn`.
+
+    Notes
+    -----
+    Each worker keeps its own optimizer state (e.g., the velocities of
+    :func:`lasagne.updates.momentum`), so only the parameters are shared.
+    Reads and writes of the parameters are not synchronized: a worker may
+    compute its update from parameters that other workers are modifying.
+    This works well when the updates are sparse, e.g. for wide
+    :class:`lasagne.layers.DenseLayer` models on sparse inputs [1]_.
+
+    The workers are created by forking, which is only available on Unix.
+    Later changes to the hyperparameters or to other shared variables in
+    the parent process are not seen by the workers.
+
+    References
+    ----------
+    .. [1] Niu, F., Recht, B., Re, C., & Wright, S. J. (2011). Hogwild!: A
+           Lock-Free Approach to Parallelizing Stochastic Gradient Descent.
+           Advances in Neural Information Processing Systems.
+    """
+    def __init__(self, inputs, loss, params, update_fn, num_workers=None,
+                 **kwargs):
+        self._share_params(inputs, params, num_workers)
+        # each worker counts its updates, so staleness can be measured
+        # without locking: the sum over all counters only ever grows
+        self._counters = _shared_array(self.num_workers, np.int64,
+                                       _get_context())
+
+        flat = self.buffer.flat
+        updates = update_fn(self.buffer.get_grads(loss), [flat], **kwargs)
+        delta = updates.pop(flat) - flat
+        self._step_fn = theano.function(self.inputs, [loss, delta],
+                                        updates=updates,
+                                        givens=self.buffer.givens)
+        self._start_workers()
+
+    def _setup(self, idx):
+        storage = self.buffer.flat.get_value(borrow=True)
+        counters = self._counters
+
+        def handle(command, data):
+            inputs, batch_size, num_epochs = data
+            num_examples = len(inputs[0])
+            losses = []
+            staleness = []
+            for epoch in range(num_epochs):
+                for start in range(0, num_examples, batch_size):
+                    version = counters.sum()
+                    loss, delta = self._step_fn(
+                        *[value[start:start + batch_size] for value in inputs])
+                    np.add(storage, delta, out=storage)
+                    staleness.append(counters.sum() - version)
+                    counters[idx] += 1
+                    losses.append(float(loss))
+            return losses, staleness
+        return handle
+
+    def train(self, inputs, batch_size, num_epochs=1):
+        """
+        Trains on a dataset, one shard per worker.
+
+        Parameters
+        ----------
+        inputs : list of numpy arrays
+            The values of the `inputs` given on construction. They must all
+            have the same size along the first axis.
+        batch_size : int
+            The number of examples per update of each worker.
+        num_epochs : int
+            The number of passes of each worker over its shard.
+
+        Returns
+        -------
+        dict
+            Statistics of the training run:
+
+            ``loss``
+                The mean loss over all minibatches of all workers.
+            ``updates``
+                The total number of updates of all workers.
+            ``examples_per_second``
+                The throughput over all workers.
+            ``mean_staleness``, ``max_staleness``
+                The mean and maximum number of updates that other workers
+                applied while a worker computed its update.
+        """
+        self._check_inputs(inputs)
+        num_examples = len(inputs[0])
+        bounds = np.linspace(0, num_examples,
+                             self.num_workers + 1).astype(int)
+        workers = [idx for idx in range(self.num_workers)
+                   if bounds[idx + 1] > bounds[idx]]
+        if not workers:
+            raise ValueError("Got no examples to train on")
+        start_time = time.time()
+        for idx in workers:
+            shard = [value[bounds[idx]:bounds[idx + 1]] for value in inputs]
+            self._connections[idx].send(
+                ('train', (shard, batch_size, num_epochs)))
+        results = self._receive([self._connections[idx] for idx in workers])
+        elapsed = time.time() - start_time
+
+        losses = [loss for result in results for loss in result[0]]
+        staleness = [s for result in results for s in result[1]]
+        return {
+            'loss': float(np.mean(losses)),
+            'updates': len(losses),
+            'examples_per_second': num_examples * num_epochs / elapsed,
+            'mean_staleness': float(np.mean(staleness)),
+            'max_staleness': int(np.max(staleness)),
+        }
@@ -0,0 +1,288 @@
+"""
+Functions to quantize trained networks to int8 weights for inference.
+
+Inference on CPUs is often bound by the memory bandwidth needed to read large
+weight matrices. Post-training quantization stores the weights of the
+:class:`DenseLayer`, :class:`NINLayer` and :class:`Conv2DLayer` instances of
+a trained network as int8 values with one float scale per output channel,
+which takes a quarter of the memory of float32 weights:
+
+ * calibrate()
+ * quantize_network()
+ * evaluate_quantization()
+
+:func:`calibrate` runs sample data through the network to determine the
+range of the inputs of each quantized layer, so their activations can be
+quantized to int8 as well. :func:`quantize_network` returns a copy of the
+network using the quantized layers of :mod:`lasagne.layers.quantized`, and
+:func:`evaluate_quantization` reports the accuracy of the quantized network
+compared to the original one.
+
+As Theano has no int8 matrix products, the quantized layers cast their
+weights to ``floatX`` in every forward pass: they reduce the memory held by
+the weights, but not the bandwidth used to compute with them, see
+:class:`lasagne.layers.quantized.QuantizedLayer`.
+
+Usage
+-----
+>>> import numpy as np
+>>> import theano
+>>> from lasagne.layers import InputLayer, DenseLayer
+>>> from lasagne.quantization import calibrate, quantize_network
+>>> from lasagne.quantization import evaluate_quantization
+>>> l_in = InputLayer((None, 20))
+>>> l1 = DenseLayer(l_in, num_units=50)
+>>> l2 = DenseLayer(l1, num_units=10)
+>>> X = np.random.randn(100, 20).astype(theano.config.floatX)
+>>> scales = calibrate(l2, X)
+>>> l2_q = quantize_network(l2, scales)
+>>> report = evaluate_quantization(l2, l2_q, X)
+>>> report['relative_error'] < 0.05
+True
+>>> report['quantized_weight_bytes'] < report['weight_bytes'] / 4
+True
+"""
+
+from collections import OrderedDict
+import copy
+
+import numpy as np
+
+import theano
+
+from .data import iterate_minibatches
+from .layers import (InputLayer, DenseLayer, NINLayer, Conv2DLayer,
+                     QuantizedLayer, QuantizedDenseLayer, QuantizedNINLayer,
+                     QuantizedConv2DLayer, quantize_weights, get_output)
+from .layers.helper import _get_all_layers
+
+
+__all__ = [
+    "calibrate",
+    "quantize_network",
+    "evaluate_quantization",
+]
+
+
+def _quantize_dense(layer, incoming, input_scale):
+    W_q, scale = quantize_weights(layer.W.get_value(), axis=1)
+    return QuantizedDenseLayer(
+        incoming, layer.num_units, W_q, scale, input_scale=input_scale,
+        b=layer.b.get_value() if layer.b is not None else None,
+        nonlinearity=layer.nonlinearity, name=layer.name)
+
+
+def _quantize_nin(layer, incoming, input_scale):
+    W_q, scale = quantize_weights(layer.W.get_value(), axis=1)
+    return QuantizedNINLayer(
+        incoming, layer.num_units, W_q, scale, input_scale=input_scale,
+        untie_biases=layer.untie_biases,
+        b=layer.b.get_value() if layer.b is not None else None,
+        nonlinearity=layer.nonlinearity, name=layer.name)
+
+
+def _quantize_conv2d(layer, incoming, input_scale):
+    W_q, scale = quantize_weights(layer.W.get_value(), axis=0)
+    return QuantizedConv2DLayer(
+        incoming, layer.num_filters, layer.filter_size, W_q, scale,
+        input_scale=input_scale, stride=layer.stride,
+        border_mode=layer.border_mode, untie_biases=layer.untie_biases,
+        b=layer.b.get_value() if layer.b is not None else None,
+        nonlinearity=layer.nonlinearity, convolution=layer.convolution,
+        name=layer.name)
+
+
+# Layer classes are matched exactly, since subclasses may compute a
+# different output.
+_QUANTIZERS = {
+    DenseLayer: _quantize_dense,
+    NINLayer: _quantize_nin,
+    Conv2DLayer: _quantize_conv2d,
+}
+
+
+def _quantizable_layers(layer_or_layers):
+    return [layer for layer in _get_all_layers(layer_or_layers)
+            if type(layer) in _QUANTIZERS]
+
+
+def _outputs(layer_or_layers, inputs, batch_size):
+    """
+    Computes the deterministic output of a network in minibatches.
+    """
+    input_layers = [layer for layer in _get_all_layers(layer_or_layers)
+                    if isinstance(layer, InputLayer)]
+    fn = theano.function([layer.input_var for layer in input_layers],
+                         get_output(layer_or_layers, deterministic=True))
+    if not isinstance(inputs, (list, tuple)):
+        inputs = [inputs]
+    for batch in iterate_minibatches(inputs, batch_size):
+        yield fn(*batch)
+
+
+def calibrate(layer_or_layers, inputs, batch_size=128, percentile=None):
+    """
+    Determines the scales to quantize the inputs of a network's layers with.
+
+    Parameters
+    ----------
+    layer_or_layers : Layer or list of Layer
+        The output layer(s) of the network.
+    inputs : numpy array or list of numpy arrays
+        Sample data for the input layer(s) of the network, in the order of
+        :func:`lasagne.layers.get_all_layers()`. It should be representative
+        of the data the quantized network will be used on.
+    batch_size : int
+        The number of examples to process at once.
+    percentile : float or None
+        If given, the range of each input is determined by this percentile
+        of its absolute values in each minibatch (e.g., 99.99) instead of the
+        maximum, which ignores outliers.
+
+    Returns
+    -------
+    OrderedDict
+        Maps each :class:`DenseLayer`, :class:`NINLayer` and
+        :class:`Conv2DLayer` of the network to the scale that maps the range
+        of its input to the range of int8, to be passed to
+        :func:`quantize_network`.
+    """
+    layers = _quantizable_layers(layer_or_layers)
+    ranges = np.zeros(len(layers))
+    if layers:
+        for values in _outputs([layer.input_layer for layer in layers],
+                               inputs, batch_size):
+            for idx, value in enumerate(values):
+                value = np.abs(value)
+                if percentile is None:
+                    value_range = value.max()
+                else:
+                    value_range = np.percentile(value, percentile)
+                ranges[idx] = max(ranges[idx], value_range)
+    ranges[ranges == 0] = 127.  # inputs of zeros
+    return OrderedDict((layer, float(value_range / 127.))
+                       for layer, value_range in zip(layers, ranges))
+
+
+def quantize_network(layer_or_layers, input_scales=None):
+    """
+    Returns a copy of a network with int8 weights.
+
+    Each :class:`DenseLayer`, :class:`NINLayer` and :class:`Conv2DLayer` is
+    replaced by the corresponding layer of :mod:`lasagne.layers.quantized`,
+    with per-output-channel scales. The other layers are copied, sharing
+    their parameters with the original network, and the input layers are
+    kept.
+
+    Parameters
+    ----------
+    layer_or_layers : Layer or list of Layer
+        The output layer(s) of the network.
+    input_scales : dict or None
+        Maps layers to the scales to quantize their inputs with, as returned
+        by :func:`calibrate`. The inputs of layers not in the dict are not
+        quantized. If None, only the weights are quantized.
+
+    Returns
+    -------
+    Layer or list of Layer
+        The layer(s) of the quantized network corresponding to
+        `layer_or_layers`.
+    """
+    input_scales = input_scales or {}
+    copies = {}
+    for layer in _get_all_layers(layer_or_layers):
+        if isinstance(layer, InputLayer):
+            copies[layer] = layer
+        elif type(layer) in _QUANTIZERS:
+            copies[layer] = _QUANTIZERS[type(layer)](
+                layer, copies[layer.input_layer], input_scales.get(layer))
+        else:
+            copies[layer] = copy.copy(layer)
+            if hasattr(layer, 'input_layers'):
+                copies[layer].input_layers = [copies[incoming] for incoming
+                                              in layer.input_layers]
+            else:
+                copies[layer].input_layer = copies[layer.input_layer]
+    if isinstance(layer_or_layers, (list, tuple)):
+        return [copies[layer] for layer in layer_or_layers]
+    return copies[layer_or_layers]
+
+
+def _weight_bytes(layer_or_layers):
+    total = 0
+    for layer in _get_all_layers(layer_or_layers):
+        if isinstance(layer, QuantizedLayer):
+            total += (layer.W_q.get_value(borrow=True).nbytes +
+                      layer.W_scale.get_value(borrow=True).nbytes)
+        elif type(layer) in _QUANTIZERS:
+            total += layer.W.get_value(borrow=True).nbytes
+    return total
+
+
+def evaluate_quantization(layer, quantized_layer, inputs, targets=None,
+                          batch_size=128):
+    """
+    Compares the output of a quantized network to that of the original.
+
+    Parameters
+    ----------
+    layer : Layer
+        The output layer of the original network.
+    quantized_layer : Layer
+        The output layer of the quantized network.
+    inputs : numpy array or list of numpy arrays
+        Data for the input layer(s) of the networks.
+    targets : numpy array or None
+        If given, the class labels (or one-hot encoded targets) of the data,
+        to compute the classification accuracy of both networks. The output
+        of the networks must be of shape ``(num_examples, num_classes)``.
+    batch_size : int
+        The number of examples to process at once.
+
+    Returns
+    -------
+    dict
+        A dictionary with the following entries:
+
+        * ``'max_abs_error'``, ``'mean_abs_error'``: The maximum and mean
+          absolute difference of the outputs.
+        * ``'relative_error'``: The norm of the difference of the outputs,
+          relative to the norm of the original output.
+        * ``'agreement'``: For outputs of shape ``(num_examples,
+          num_classes)``, the fraction of examples both networks predict the
+          same class for.
+        * ``'accuracy'``, ``'quantized_accuracy'``, ``'accuracy_delta'``: If
+          `targets` are given, the classification accuracy of both networks
+          and its change by the quantization.
+        * ``'weight_bytes'``, ``'quantized_weight_bytes'``: The memory used
+          by the weights (and scales) of the layers that can be quantized,
+          in both networks.
+    """
+    outputs = np.concatenate(list(_outputs(layer, inputs, batch_size)))
+    quantized = np.concatenate(list(_outputs(quantized_layer, inputs,
+                                             batch_size)))
+    error = np.abs(quantized - outputs)
+    report = {
+        'max_abs_error': float(error.max()),
+        'mean_abs_error': float(error.mean()),
+        'relative_error': float(np.linalg.norm(quantized - outputs) /
+                                max(np.linalg.norm(outputs), 1e-12)),
+        'weight_bytes': _weight_bytes(layer),
+        'quantized_weight_bytes': _weight_bytes(quantized_layer),
+    }
+    if outputs.ndim == 2:
+        predictions = outputs.argmax(axis=1)
+        quantized_predictions = quantized.argmax(axis=1)
+        report['agreement'] = float(np.mean(predictions ==
+                                            quantized_predictions))
+        if targets is not None:
+            targets = np.asarray(targets)
+            if targets.ndim == 2:
+                targets = targets.argmax(axis=1)
+            report['accuracy'] = float(np.mean(predictions == targets))
+            report['quantized_accuracy'] = float(
+                np.mean(quantized_predictions == targets))
+            report['accuracy_delta'] = (report['quantized_accuracy'] -
+                                        report['accuracy'])
+    return report
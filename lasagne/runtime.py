@@ -0,0 +1,596 @@
+"""
+Functions to compute the output of exported networks with NumPy only.
+
+Starting a predictor based on Theano requires importing Theano and compiling
+the prediction function, which takes several seconds and a C compiler on
+every host. Networks exported with :func:`lasagne.export.export_network`
+can instead be run by a :class:`Predictor`, which executes the exported plan
+with NumPy operations:
+
+ * Predictor
+ * load()
+
+Matrix products, including the convolutions (computed as an im2col
+transform followed by a matrix product), are performed by the BLAS library
+NumPy is linked against. The buffers for all intermediate results are
+allocated on the first call for a given input shape and reused afterwards.
+
+This module only depends on NumPy and the standard library, and importing it
+does not import Theano, so it can be used on hosts without Theano.
+
+Usage
+-----
+>>> import io
+>>> import numpy as np
+>>> from lasagne.layers import InputLayer, DenseLayer
+>>> from lasagne.export import export_network
+>>> from lasagne.runtime import load
+>>> l_in = InputLayer((None, 20))
+>>> l1 = DenseLayer(l_in, num_units=3)
+>>> f = io.BytesIO()  # usually a filename
+>>> _ = export_network(l1, f)
+>>> _ = f.seek(0)
+>>> predictor = load(f)
+>>> predictor.predict(np.ones((5, 20))).shape
+(5, 3)
+"""
+
+import json
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+
+__all__ = [
+    "Predictor",
+    "load",
+]
+
+
+FORMAT_VERSION = 1
+
+
+# nonlinearities, applied in place
+
+def _sigmoid(x):
+    np.negative(x, out=x)
+    np.exp(x, out=x)
+    x += 1
+    np.reciprocal(x, out=x)
+
+
+def _softmax(x):
+    x -= x.max(axis=1, keepdims=True)
+    np.exp(x, out=x)
+    x /= x.sum(axis=1, keepdims=True)
+
+
+def _rectify(x):
+    np.maximum(x, 0, out=x)
+
+
+def _nonlinearity(spec):
+    if spec is None or spec['name'] == 'identity':
+        return lambda x: None
+    elif spec['name'] == 'sigmoid':
+        return _sigmoid
+    elif spec['name'] == 'softmax':
+        return _softmax
+    elif spec['name'] == 'tanh':
+        return lambda x: np.tanh(x, out=x)
+    elif spec['name'] == 'rectify':
+        return _rectify
+    elif spec['name'] == 'leaky_rectify':
+        leakiness = spec['leakiness']
+        return lambda x: np.multiply(x, leakiness, out=x, where=x < 0)
+    raise ValueError("Unknown nonlinearity: %r" % spec['name'])
+
+
+def _min_value(dtype):
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'f':
+        return -np.inf
+    return np.iinfo(dtype).min
+
+
+def _windows(x, window, stride, ndim):
+    """
+    Returns a view of the sliding windows over the last `ndim` axes of `x`,
+    of shape ``x.shape[:-ndim] + window + output_shape``.
+    """
+    spatial = x.shape[-ndim:]
+    output = tuple((size - w) // s + 1
+                   for size, w, s in zip(spatial, window, stride))
+    strides = x.strides[-ndim:]
+    return as_strided(
+        x, shape=x.shape[:-ndim] + tuple(window) + output,
+        strides=(x.strides[:-ndim] + strides +
+                 tuple(st * s for st, s in zip(strides, stride))))
+
+
+class _Padding(object):
+    """
+    Pads the last `ndim` axes of its input into a preallocated buffer whose
+    borders keep the given fill value.
+    """
+    def __init__(self, before, after, value=0):
+        self.before = tuple(before)
+        self.after = tuple(after)
+        self.value = value
+
+    def __bool__(self):
+        return any(self.before) or any(self.after)
+    __nonzero__ = __bool__  # Python 2
+
+    def shape(self, shape):
+        ndim = len(self.before)
+        return shape[:-ndim] + tuple(
+            size + b + a for size, b, a in zip(shape[-ndim:], self.before,
+                                               self.after))
+
+    def __call__(self, x, buffer):
+        ndim = len(self.before)
+        interior = (Ellipsis,) + tuple(
+            slice(b, b + size) for b, size in zip(self.before,
+                                                  x.shape[-ndim:]))
+        buffer[interior] = x
+        return buffer
+
+
+# operations; each computes the output of one exported layer
+
+class _Op(object):
+    """
+    Base class of the operations of an exported plan. `buffers()` returns
+    the shapes and dtypes (and optionally, initial values) of the arrays to
+    allocate for given input shapes, `__call__()` computes the output into
+    them and returns it.
+    """
+    def __init__(self, arrays, nonlinearity=None, **params):
+        self.arrays = arrays
+        self.nonlinearity = _nonlinearity(nonlinearity)
+        self.params = params
+
+    def buffers(self, shapes, dtype):
+        return {}
+
+    def __call__(self, inputs, buffers):
+        raise NotImplementedError
+
+
+class _Identity(_Op):
+    def __call__(self, inputs, buffers):
+        return inputs[0]
+
+
+class _Nonlinearity(_Op):
+    def buffers(self, shapes, dtype):
+        return {'out': (shapes[0], dtype)}
+
+    def __call__(self, inputs, buffers):
+        out = buffers['out']
+        np.copyto(out, inputs[0])
+        self.nonlinearity(out)
+        return out
+
+
+class _Dense(_Op):
+    def buffers(self, shapes, dtype):
+        return {'out': ((shapes[0][0], self.arrays['W'].shape[1]), dtype)}
+
+    def __call__(self, inputs, buffers):
+        out = buffers['out']
+        x = inputs[0].reshape(len(out), -1)
+        np.dot(x, self.arrays['W'], out=out)
+        if 'b' in self.arrays:
+            out += self.arrays['b']
+        self.nonlinearity(out)
+        return out
+
+
+class _NIN(_Op):
+    def __init__(self, arrays, **kwargs):
+        super(_NIN, self).__init__(arrays, **kwargs)
+        # (channels, units) to (units, channels) for a batched matmul
+        self.W = np.ascontiguousarray(arrays['W'].T)
+
+    def buffers(self, shapes, dtype):
+        shape = shapes[0]
+        return {'out': ((shape[0], len(self.W)) + shape[2:], dtype)}
+
+    def __call__(self, inputs, buffers):
+        x, out = inputs[0], buffers['out']
+        np.matmul(self.W, x.reshape(x.shape[0], x.shape[1], -1),
+                  out=out.reshape(out.shape[0], out.shape[1], -1))
+        if 'b' in self.arrays:
+            b = self.arrays['b']
+            out += b.reshape(b.shape + (1,) * (out.ndim - b.ndim - 1))
+        self.nonlinearity(out)
+        return out
+
+
+class _Conv(_Op):
+    """
+    N-dimensional convolution of the last axes, computed as an im2col
+    transform followed by a single matrix product for the whole batch. The
+    filters are stored flipped, so this is a correlation.
+    """
+    def __init__(self, arrays, stride, pad_before, pad_after, **kwargs):
+        super(_Conv, self).__init__(arrays, **kwargs)
+        W = arrays['W']
+        self.ndim = W.ndim - 2
+        self.window = W.shape[2:]
+        self.stride = tuple(stride)
+        self.padding = _Padding(pad_before, pad_after)
+        # filters as columns, to multiply the rows of the im2col matrix
+        self.W = np.ascontiguousarray(W.reshape(len(W), -1).T)
+        # (batch, channels, window, output) to (batch, output, channels,
+        # window), so each row holds the inputs of one output position
+        self.order = ((0,) + tuple(range(2 + self.ndim, 2 + 2 * self.ndim)) +
+                      (1,) + tuple(range(2, 2 + self.ndim)))
+
+    def buffers(self, shapes, dtype):
+        shape = shapes[0]
+        padded = self.padding.shape(shape)
+        output = tuple((size - w) // s + 1 for size, w, s in
+                       zip(padded[2:], self.window, self.stride))
+        num_filters = self.W.shape[1]
+        buffers = {'out': ((shape[0], num_filters) + output, dtype),
+                   'cols': ((shape[0],) + output + (shape[1],) + self.window,
+                            dtype),
+                   'product': ((shape[0],) + output + (num_filters,), dtype)}
+        if self.padding:
+            buffers['padded'] = (padded, dtype)
+        return buffers
+
+    def __call__(self, inputs, buffers):
+        x, out = inputs[0], buffers['out']
+        cols, product = buffers['cols'], buffers['product']
+        if self.padding:
+            x = self.padding(x, buffers['padded'])
+        windows = _windows(x, self.window, self.stride, self.ndim)
+        np.copyto(cols, windows.transpose(self.order))
+        np.dot(cols.reshape(-1, len(self.W)), self.W,
+               out=product.reshape(-1, self.W.shape[1]))
+        np.copyto(out, np.moveaxis(product, -1, 1))
+        if 'b' in self.arrays:
+            b = self.arrays['b']
+            out += b.reshape(b.shape + (1,) * (out.ndim - b.ndim - 1))
+        self.nonlinearity(out)
+        return out
+
+
+class _MaxPool(_Op):
+    """
+    Max-pooling over the last axes. Padding and partial windows at the
+    border do not contribute to the maximum.
+    """
+    def __init__(self, arrays, pool_size, stride, pad, ignore_border,
+                 **kwargs):
+        super(_MaxPool, self).__init__(arrays, **kwargs)
+        self.pool_size = tuple(pool_size)
+        self.stride = tuple(stride)
+        self.pad = tuple(pad)
+        self.ignore_border = ignore_border
+        self.ndim = len(self.pool_size)
+
+    def _output_length(self, size, pool_size, stride, pad):
+        if self.ignore_border:
+            return (size + 2 * pad - pool_size + stride) // stride
+        elif stride >= pool_size:
+            return (size + stride - 1) // stride
+        return max(0, (size - pool_size + stride - 1) // stride) + 1
+
+    def buffers(self, shapes, dtype):
+        shape = shapes[0]
+        spatial = shape[-self.ndim:]
+        output = tuple(self._output_length(*args) for args in
+                       zip(spatial, self.pool_size, self.stride, self.pad))
+        # pad on the right for partial windows
+        after = tuple(max(p, (o - 1) * s + w - size - p)
+                      for o, s, w, size, p in zip(output, self.stride,
+                                                  self.pool_size, spatial,
+                                                  self.pad))
+        self.padding = _Padding(self.pad, after, _min_value(dtype))
+        buffers = {'out': (shape[:-self.ndim] + output, dtype)}
+        if self.padding:
+            buffers['padded'] = (self.padding.shape(shape), dtype,
+                                 self.padding.value)
+        return buffers
+
+    def __call__(self, inputs, buffers):
+        x, out = inputs[0], buffers['out']
+        if self.padding:
+            x = self.padding(x, buffers['padded'])
+        # take the maximum over the offsets within the windows, which is
+        # faster than reducing a view of all windows
+        output = out.shape[-self.ndim:]
+        offsets = [()]
+        for size in self.pool_size:
+            offsets = [offset + (i,) for offset in offsets
+                       for i in range(size)]
+        for idx, offset in enumerate(offsets):
+            view = x[(Ellipsis,) + tuple(
+                slice(o, o + s * (n - 1) + 1, s)
+                for o, s, n in zip(offset, self.stride, output))]
+            if idx == 0:
+                np.copyto(out, view)
+            else:
+                np.maximum(out, view, out=out)
+        return out
+
+
+_REDUCTIONS = {
+    'max': np.max,
+    'min': np.min,
+    'mean': np.mean,
+    'sum': np.sum,
+}
+
+
+class _GlobalPool(_Op):
+    def buffers(self, shapes, dtype):
+        return {'out': (shapes[0][:2], dtype)}
+
+    def __call__(self, inputs, buffers):
+        x, out = inputs[0], buffers['out']
+        _REDUCTIONS[self.params['function']](
+            x.reshape(x.shape[0], x.shape[1], -1), axis=2, out=out)
+        return out
+
+
+class _FeaturePool(_Op):
+    def buffers(self, shapes, dtype):
+        shape = list(shapes[0])
+        shape[self.params['axis']] //= self.params['pool_size']
+        return {'out': (tuple(shape), dtype)}
+
+    def __call__(self, inputs, buffers):
+        x, out = inputs[0], buffers['out']
+        axis = self.params['axis']
+        shape = (x.shape[:axis] + (out.shape[axis],
+                                   self.params['pool_size']) +
+                 x.shape[axis + 1:])
+        _REDUCTIONS[self.params['function']](x.reshape(shape),
+                                             axis=axis + 1, out=out)
+        return out
+
+
+class _Flatten(_Op):
+    def __call__(self, inputs, buffers):
+        return inputs[0].reshape(len(inputs[0]), -1)
+
+
+class _Reshape(_Op):
+    def __call__(self, inputs, buffers):
+        x = inputs[0]
+        shape = [x.shape[s[0]] if isinstance(s, list) else s
+                 for s in self.params['shape']]
+        return x.reshape(shape)
+
+
+class _Dimshuffle(_Op):
+    def __call__(self, inputs, buffers):
+        x = inputs[0]
+        pattern = self.params['pattern']
+        used = [p for p in pattern if p != 'x']
+        kept = sorted(used)
+        # drop the broadcastable axes not in the pattern
+        x = x.reshape([x.shape[axis] for axis in kept])
+        x = x.transpose([kept.index(p) for p in used])
+        return x[tuple(None if p == 'x' else slice(None) for p in pattern)]
+
+
+class _Pad(_Op):
+    def buffers(self, shapes, dtype):
+        shape = shapes[0]
+        ndim = len(shape) - self.params['batch_ndim']
+        width = (self.params['width'],) * ndim
+        self.padding = _Padding(width, width, self.params['val'])
+        return {'out': (self.padding.shape(shape), dtype,
+                        self.padding.value)}
+
+    def __call__(self, inputs, buffers):
+        return self.padding(inputs[0], buffers['out'])
+
+
+class _Concat(_Op):
+    def buffers(self, shapes, dtype):
+        axis = self.params['axis']
+        shape = list(shapes[0])
+        shape[axis] = sum(s[axis] for s in shapes)
+        return {'out': (tuple(shape), dtype)}
+
+    def __call__(self, inputs, buffers):
+        return np.concatenate(inputs, axis=self.params['axis'],
+                              out=buffers['out'])
+
+
+class _ElemwiseSum(_Op):
+    def buffers(self, shapes, dtype):
+        return {'out': (shapes[0], dtype), 'scaled': (shapes[0], dtype)}
+
+    def __call__(self, inputs, buffers):
+        out, scaled = buffers['out'], buffers['scaled']
+        coeffs = self.params['coeffs']
+        np.multiply(inputs[0], coeffs[0], out=out)
+        for coeff, x in zip(coeffs[1:], inputs[1:]):
+            if coeff != 1:
+                x = np.multiply(x, coeff, out=scaled)
+            np.add(out, x, out=out)
+        return out
+
+
+class _LocalResponseNormalization(_Op):
+    def buffers(self, shapes, dtype):
+        shape = shapes[0]
+        half_n = self.params['n'] // 2
+        squares = (shape[0], shape[1] + 2 * half_n) + shape[2:]
+        return {'out': (shape, dtype), 'squares': (squares, dtype)}
+
+    def __call__(self, inputs, buffers):
+        x, out, squares = inputs[0], buffers['out'], buffers['squares']
+        n, channels = self.params['n'], x.shape[1]
+        half_n = n // 2
+        np.square(x, out=squares[:, half_n:half_n + channels])
+        np.copyto(out, squares[:, :channels])
+        for i in range(1, n):
+            np.add(out, squares[:, i:i + channels], out=out)
+        out *= self.params['alpha']
+        out += self.params['k']
+        np.power(out, self.params['beta'], out=out)
+        np.divide(x, out, out=out)
+        return out
+
+
+_OPS = {
+    'identity': _Identity,
+    'nonlinearity': _Nonlinearity,
+    'dense': _Dense,
+    'nin': _NIN,
+    'conv': _Conv,
+    'max_pool': _MaxPool,
+    'global_pool': _GlobalPool,
+    'feature_pool': _FeaturePool,
+    'flatten': _Flatten,
+    'reshape': _Reshape,
+    'dimshuffle': _Dimshuffle,
+    'pad': _Pad,
+    'concat': _Concat,
+    'elemwise_sum': _ElemwiseSum,
+    'local_response_normalization': _LocalResponseNormalization,
+}
+
+
+class Predictor(object):
+    """
+    Computes the output of an exported network with NumPy.
+
+    Predictors are usually obtained from :func:`load()` or
+    :func:`lasagne.export.export_network()` rather than instantiated
+    directly.
+
+    Parameters
+    ----------
+    plan : dict
+        The execution plan: a dict with the keys ``'inputs'`` (a list of
+        dicts with the ``'shape'`` and ``'dtype'`` of each input),
+        ``'steps'`` (a list of dicts with the ``'op'``, ``'inputs'`` (indices
+        of earlier steps or network inputs), ``'params'`` and ``'arrays'`` of
+        each operation) and ``'outputs'`` (indices of the output steps).
+        Indices below the number of inputs refer to the inputs.
+    arrays : dict
+        Maps the array names referred to by the steps to numpy arrays.
+
+    Notes
+    -----
+    The intermediate results are kept in buffers allocated for the input
+    shapes of the last call, so a predictor must not be used from several
+    threads at once. Create one predictor per thread instead.
+    """
+    def __init__(self, plan, arrays):
+        if plan.get('version', FORMAT_VERSION) > FORMAT_VERSION:
+            raise ValueError("Unsupported plan format version %r" %
+                             plan['version'])
+        self.plan = plan
+        self.arrays = arrays
+        self.inputs = plan['inputs']
+        self.outputs = plan['outputs']
+        self._steps = []
+        for step in plan['steps']:
+            op = _OPS[step['op']](
+                dict((key, arrays[name])
+                     for key, name in step.get('arrays', {}).items()),
+                **step.get('params', {}))
+            self._steps.append((op, step['inputs']))
+        self._shapes = None
+        self._buffers = None
+
+    @staticmethod
+    def _allocate(op, inputs):
+        """
+        Allocates the buffers of an operation for the given input values.
+        """
+        dtype = np.result_type(*(inputs + list(op.arrays.values())))
+        buffers = op.buffers([x.shape for x in inputs], dtype)
+        return dict((key, np.full(spec[0], spec[2] if len(spec) > 2 else 0,
+                                  dtype=spec[1]))
+                    for key, spec in buffers.items())
+
+    def predict(self, *inputs):
+        """
+        Computes the output of the network.
+
+        Parameters
+        ----------
+        *inputs : array_like
+            One value per input of the network, including the batch axis.
+
+        Returns
+        -------
+        numpy array or list of numpy arrays
+            The output of the network, or a list of outputs if it was exported
+            for a list of layers.
+        """
+        if len(inputs) != len(self.inputs):
+            raise ValueError("Expected %d inputs, got %d" %
+                             (len(self.inputs), len(inputs)))
+        values = []
+        for value, spec in zip(inputs, self.inputs):
+            value = np.ascontiguousarray(value, dtype=spec['dtype'])
+            if value.ndim != len(spec['shape']) or any(
+                    expected is not None and size != expected
+                    for size, expected in zip(value.shape, spec['shape'])):
+                raise ValueError("Expected an input of shape %r, got %r" %
+                                 (tuple(spec['shape']), value.shape))
+            values.append(value)
+        shapes = [value.shape for value in values]
+        if self._shapes != shapes:
+            # allocate the buffers for the new shapes on the way
+            self._shapes, self._buffers = None, []
+        for step, (op, indices) in enumerate(self._steps):
+            args = [values[idx] for idx in indices]
+            if self._shapes is None:
+                self._buffers.append(self._allocate(op, args))
+            values.append(op(args, self._buffers[step]))
+        self._shapes = shapes
+        # copy the outputs, the buffers are reused by the next call
+        outputs = [np.array(values[idx]) for idx in self.outputs]
+        if self.plan.get('single_output', len(outputs) == 1):
+            return outputs[0]
+        return outputs
+
+    __call__ = predict
+
+    def save(self, filename):
+        """
+        Saves the plan and arrays of the predictor to an ``.npz`` file, to be
+        loaded with :func:`load()`.
+        """
+        plan = json.dumps(self.plan).encode('utf-8')
+        arrays = dict(('array.' + name, array)
+                      for name, array in self.arrays.items())
+        arrays['plan'] = np.frombuffer(plan, dtype=np.uint8)
+        np.savez(filename, **arrays)
+
+
+def load(filename):
+    """
+    Loads a predictor saved with :meth:`Predictor.save()` or
+    :func:`lasagne.export.export_network()`.
+
+    Parameters
+    ----------
+    filename : str or file
+        The ``.npz`` file to load.
+
+    Returns
+    -------
+    Predictor
+        The predictor computing the output of the exported network.
+    """
+    with np.load(filename, allow_pickle=False) as data:
+        plan = json.loads(data['plan'].tobytes().decode('utf-8'))
+        arrays = dict((name[len('array.'):], data[name])
+                      for name in data.files if name.startswith('array.'))
+    return Predictor(plan, arrays)
@@ -0,0 +1,385 @@
+"""
+Functions to serve predictions of a network to concurrent callers.
+
+Calling a compiled prediction function once per example spends most of its
+time in the per-call overhead of Theano and in operations too small to use
+the hardware efficiently. When requests for single examples arrive
+concurrently, e.g. from the threads of an RPC server, an
+:class:`InferenceEngine` queues them and coalesces them into batches:
+
+ * InferenceEngine
+
+A background thread collects requests until either the maximum batch size
+is reached or the oldest request has waited for the maximum latency, runs a
+single compiled call on the whole batch and hands each caller its share of
+the outputs. Callers can wait for their result synchronously or await it
+from an :mod:`asyncio` event loop.
+
+Usage
+-----
+>>> import numpy as np
+>>> import theano
+>>> from lasagne.layers import InputLayer, DenseLayer
+>>> from lasagne.serving import InferenceEngine
+>>> l_in = InputLayer((None, 20))
+>>> l1 = DenseLayer(l_in, num_units=3)
+>>> with InferenceEngine(l1, max_batch_size=16) as engine:
+...     engine.predict(np.ones(20, dtype=theano.config.floatX)).shape
+(3,)
+"""
+
+import logging
+import threading
+import time
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+import numpy as np
+
+from .compile import BucketedFunction
+from .layers import InputLayer, get_all_layers, get_output
+
+
+__all__ = [
+    "InferenceEngine",
+]
+
+
+_logger = logging.getLogger(__name__)
+
+
+class _Request(object):
+    """
+    A single example waiting to be processed, along with the callback to
+    pass its result or error to, and the event loop to call it in (if any).
+    """
+    def __init__(self, values, callback, loop=None):
+        self.values = values
+        self.callback = callback
+        self.loop = loop
+
+
+def _call(callback, result, error):
+    """
+    Calls a callback of a request, logging any exception it raises instead
+    of passing it on, so a faulty callback cannot affect other requests.
+    """
+    try:
+        callback(result, error)
+    except Exception:
+        _logger.exception("Exception in callback of request")
+
+
+def _call_all(calls):
+    for callback, result, error in calls:
+        _call(callback, result, error)
+
+
+_STOP = object()
+
+
+class InferenceEngine(object):
+    """
+    Computes the deterministic output of a network for single examples,
+    processing concurrent requests in batches.
+
+    Parameters
+    ----------
+    layer_or_layers : Layer or list of Layer
+        The layer(s) to compute the output of. The input variables of the
+        :class:`InputLayer` instances of the network are the inputs of the
+        engine, in the order of :func:`lasagne.layers.get_all_layers()`.
+    max_batch_size : int
+        The maximum number of requests to process in a single call.
+    max_latency : float
+        The maximum time in seconds to wait for more requests after the
+        first request of a batch arrived. Lower values reduce the latency
+        under low load, higher values result in larger batches.
+    buckets : sequence of int or None
+        The batch sizes to compile specialized variants for, see
+        :class:`lasagne.compile.BucketedFunction`. Defaults to the powers of
+        two up to `max_batch_size`, and `max_batch_size` itself.
+    cache : FunctionCache or None
+        The cache to compile the variants with, see
+        :func:`lasagne.compile.function`.
+    **kwargs
+        Any additional keyword arguments are passed to
+        :func:`lasagne.layers.get_output`.
+
+    Attributes
+    ----------
+    num_requests : int
+        The number of requests processed so far.
+    num_batches : int
+        The number of compiled calls made so far.
+
+    Notes
+    -----
+    The output must be computed independently for each example, which holds
+    for the deterministic output of the layers included with Lasagne.
+    Batches are padded up to the next bucket size, so no recompilation takes
+    place for varying load once all buckets have been compiled.
+    """
+    def __init__(self, layer_or_layers, max_batch_size=32, max_latency=0.002,
+                 buckets=None, cache=None, **kwargs):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be positive, got %r" %
+                             max_batch_size)
+        if buckets is None:
+            buckets = [2 ** i for i in range(max_batch_size.bit_length())]
+            buckets.append(max_batch_size)
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.input_layers = [layer for layer in get_all_layers(layer_or_layers)
+                             if isinstance(layer, InputLayer)]
+        inputs = [layer.input_var for layer in self.input_layers]
+        kwargs.setdefault('deterministic', True)
+
+        def build_outputs(batch_size):
+            return get_output(layer_or_layers, batch_size=batch_size,
+                              **kwargs)
+        self.function = BucketedFunction(inputs, build_outputs,
+                                         buckets=buckets, cache=cache)
+        self.num_requests = 0
+        self.num_batches = 0
+        self._requests = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _collect(self):
+        """
+        Blocks until a request arrives, then collects more requests until the
+        batch is full or the deadline has passed.
+        """
+        first = self._requests.get()
+        if first is _STOP:
+            return None
+        batch = [first]
+        deadline = time.time() + self.max_latency
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.time()
+            try:
+                if timeout > 0:
+                    request = self._requests.get(timeout=timeout)
+                else:
+                    request = self._requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is _STOP:
+                # process what we have, then stop
+                self._requests.put(_STOP)
+                break
+            batch.append(request)
+        return batch
+
+    def _serve(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            try:
+                results = self._compute(batch)
+            except Exception as e:
+                if len(batch) == 1:
+                    self._respond(batch, [None], e)
+                    continue
+                # compute the requests one by one, so only the ones causing
+                # the error are answered with it
+                for request in batch:
+                    try:
+                        results = self._compute([request])
+                    except Exception as e:
+                        self._respond([request], [None], e)
+                    else:
+                        self._respond([request], results, None)
+                continue
+            self._respond(batch, results, None)
+
+    def _compute(self, batch):
+        """
+        Returns the results of a batch of requests, computed in one call.
+        """
+        values = [np.asarray([request.values[idx] for request in batch],
+                             dtype=layer.input_var.dtype)
+                  for idx, layer in enumerate(self.input_layers)]
+        outputs = self.function(*values)
+        self.num_batches += 1
+        self.num_requests += len(batch)
+        if isinstance(outputs, list):
+            return [[output[idx] for output in outputs]
+                    for idx in range(len(batch))]
+        return list(outputs[:len(batch)])
+
+    def _respond(self, batch, results, error):
+        """
+        Passes the results to the callbacks of a batch of requests. Callbacks
+        of an event loop are scheduled with a single thread-safe call per
+        loop rather than one per request, which would wake up the loop for
+        every single request.
+        """
+        loops = {}
+        for request, result in zip(batch, results):
+            if request.loop is None:
+                _call(request.callback, result, error)
+            else:
+                loops.setdefault(request.loop, []).append(
+                    (request.callback, result, error))
+        for loop, calls in loops.items():
+            loop.call_soon_threadsafe(_call_all, calls)
+
+    def submit(self, values, callback, loop=None):
+        """
+        Queues a single example without waiting for the result.
+
+        Parameters
+        ----------
+        values : sequence of array_like
+            One value per input of the network, without the batch axis.
+        callback : callable
+            Called from the background thread as ``callback(result, error)``
+            when the example has been processed. `result` is the output
+            for the example (a list of outputs for a list of layers), or
+            None if `error` is not None.
+        loop : event loop or None
+            If given, `callback` is called in this :mod:`asyncio` event loop
+            instead of the background thread.
+
+        Raises
+        ------
+        TypeError, ValueError
+            If the values do not match the dtypes or shapes of the inputs.
+        RuntimeError
+            If the engine has been closed.
+
+        Notes
+        -----
+        Exceptions raised by `callback` are logged and do not affect the
+        processing of other requests.
+        """
+        if len(values) != len(self.input_layers):
+            raise ValueError("Expected %d inputs, got %d" %
+                             (len(self.input_layers), len(values)))
+        values = [self._check_value(value, layer)
+                  for value, layer in zip(values, self.input_layers)]
+        with self._lock:
+            if self._closed or not self._thread.is_alive():
+                raise RuntimeError("The engine has been closed")
+            self._requests.put(_Request(values, callback, loop))
+
+    def _check_value(self, value, layer):
+        """
+        Converts the value of a single example for an input layer, so that
+        a request of the wrong shape or dtype is rejected before it is
+        batched with others.
+        """
+        value = np.asarray(value)
+        if not np.can_cast(value.dtype, layer.input_var.dtype,
+                           casting='same_kind'):
+            raise TypeError("Expected a value of dtype %s, got %s" %
+                            (layer.input_var.dtype, value.dtype))
+        value = value.astype(layer.input_var.dtype, copy=False)
+        shape = tuple(layer.shape[1:])
+        if value.ndim != len(shape) or any(
+                expected not in (None, actual)
+                for expected, actual in zip(shape, value.shape)):
+            raise ValueError("Expected a value of shape %s, got %s" %
+                             (shape, value.shape))
+        return value
+
+    def predict(self, *values):
+        """
+        Computes the output for a single example, blocking until it has been
+        processed as part of a batch.
+
+        Parameters
+        ----------
+        *values : array_like
+            One value per input of the network, without the batch axis.
+
+        Returns
+        -------
+        numpy array or list of numpy arrays
+            The output for the example, without the batch axis.
+        """
+        done = threading.Event()
+        response = []
+
+        def callback(result, error):
+            response.extend((result, error))
+            done.set()
+        self.submit(values, callback)
+        done.wait()
+        result, error = response
+        if error is not None:
+            raise error
+        return result
+
+    def predict_async(self, *values, **kwargs):
+        """
+        Computes the output for a single example from an :mod:`asyncio`
+        event loop.
+
+        Parameters
+        ----------
+        *values : array_like
+            One value per input of the network, without the batch axis.
+        loop : event loop or None
+            The event loop to resolve the future in. Defaults to
+            :func:`asyncio.get_event_loop()`.
+
+        Returns
+        -------
+        asyncio.Future
+            A future resolved with the output for the example, to be
+            awaited by a coroutine.
+        """
+        import asyncio
+        loop = kwargs.pop('loop', None) or asyncio.get_event_loop()
+        if kwargs:
+            raise TypeError("Unexpected keyword arguments: %s" %
+                            ", ".join(sorted(kwargs)))
+        future = loop.create_future()
+
+        def resolve(result, error):
+            if future.cancelled():
+                return
+            elif error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        try:
+            self.submit(values, resolve, loop)
+        except (TypeError, ValueError) as e:
+            future.set_exception(e)
+        return future
+
+    def close(self):
+        """
+        Processes the pending requests and stops the background thread.
+        Requests submitted afterwards are rejected.
+        """
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._requests.put(_STOP)
+        self._thread.join()
+        # answer any requests the background thread did not get to
+        while True:
+            try:
+                request = self._requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is not _STOP:
+                self._respond([request], [None],
+                              RuntimeError("The engine has been closed"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
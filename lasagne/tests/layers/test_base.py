@@ -111,6 +111,17 @@ class TestLayer:
         l = Layer(Mock(), name="foo")
         assert l.name == "foo"
 
+    def test_create_param_storage_dtype(self):
+        from lasagne.layers.base import Layer
+        layer = Layer(Mock(), storage_dtype='float16')
+        result = layer.create_param(numpy.ones((2, 3)), (2, 3))
+        assert result.dtype == 'float16'
+        result = layer.create_param(lambda shape: numpy.ones(shape), (2, 3))
+        assert result.dtype == 'float16'
+        # integer parameters are kept
+        result = layer.create_param(numpy.ones((2, 3), 'int8'), (2, 3))
+        assert result.dtype == 'int8'
+
 
 class TestMultipleInputsLayer:
     @pytest.fixture
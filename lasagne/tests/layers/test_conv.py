@@ -6,6 +6,17 @@ import theano
 from theano.tensor.nnet import conv2d
 
 from lasagne.utils import floatX
+from lasagne.theano_extensions import conv
+
+
+def conv2d_fft(*args, **kwargs):
+    # always use the FFT, even where it is not expected to be faster
+    return conv.conv2d_fft(*args, fallback=None, **kwargs)
+
+
+def conv2d_winograd(*args, **kwargs):
+    # always use Winograd's algorithm, even for strided convolutions
+    return conv.conv2d_winograd(*args, fallback=None, **kwargs)
 
 
 def conv2d_test_sets():
@@ -110,11 +121,46 @@ class TestConv1DLayer:
             pass
 
 
+def test_same_strided_even_filters():
+    from scipy.signal import convolve2d
+    from lasagne.layers import InputLayer, Conv2DLayer, get_output
+    l_in = InputLayer((None, 2, 11, 10))
+    input = floatX(np.random.randn(3, 2, 11, 10))
+    layer = Conv2DLayer(l_in, num_filters=3, filter_size=(4, 2),
+                        stride=(2, 3), border_mode='same', nonlinearity=None)
+    # the center of the full convolution, shifted by (filter_size - 1) // 2
+    expected = np.array([[sum(convolve2d(image, kernel)[1:12, 0:10]
+                              for image, kernel in zip(example, filters))
+                          for filters in layer.W.get_value()]
+                         for example in input])[:, :, ::2, ::3]
+    actual = get_output(layer, input).eval()
+    assert layer.get_output_shape() == (None, 3, 6, 4)
+    assert actual.shape == expected.shape
+    assert np.allclose(actual, expected)
+
+
+def test_pad_same():
+    from lasagne.layers.conv import pad_same
+    import theano.tensor as T
+    input = T.tensor3()
+    padded, shape = pad_same(input, (None, 2, 5), (4,))
+    assert shape == (None, 2, 8)
+    value = floatX(np.ones((1, 2, 5)))
+    assert np.all(padded.eval({input: value})[0, 0] ==
+                  [0, 0, 1, 1, 1, 1, 1, 0])
+    assert pad_same(input, (None, 2, 5), (1,)) == (input, (None, 2, 5))
+
+
 class TestConv2DLayerImplementations:
 
     @pytest.fixture(
         params=[
             ('lasagne.layers', 'Conv2DLayer', {}),
+            ('lasagne.layers', 'Conv2DLayer', {'convolution': conv2d_fft}),
+            ('lasagne.layers', 'Conv2DLayer',
+             {'convolution': conv.conv2d_mm}),
+            ('lasagne.layers', 'Conv2DLayer',
+             {'convolution': conv2d_winograd}),
             ('lasagne.layers.cuda_convnet',
              'Conv2DCCLayer',
              {'flip_filters': True}),
@@ -191,3 +237,262 @@ class TestConv2DLayerImplementations:
 
         except NotImplementedError:
             pytest.skip()
+
+
+class TestConv2DFFT:
+
+    @pytest.mark.parametrize("border_mode", ['valid', 'full'])
+    def test_grad(self, border_mode):
+        rng = np.random.RandomState(42)
+        input = floatX(rng.randn(2, 3, 7, 6))
+        kernel = floatX(rng.randn(4, 3, 3, 2))
+        theano.gradient.verify_grad(conv.FFTConv2D(border_mode),
+                                    [input, kernel], rng=rng)
+
+    def test_fallback(self):
+        import theano.tensor as T
+        input = T.tensor4()
+        kernel = T.tensor4()
+
+        def uses_fft(image_shape, filter_shape, **kwargs):
+            conved = conv.conv2d_fft(input, kernel, image_shape,
+                                     filter_shape, **kwargs)
+            return any(isinstance(node.op, conv.FFTConv2D) for node in
+                       theano.gof.graph.io_toposort([input, kernel],
+                                                    [conved]))
+
+        assert uses_fft((16, 16, 128, 128), (16, 16, 9, 9))
+        assert uses_fft((None, 16, 128, 128), (16, 16, 9, 9))
+        assert not uses_fft((16, 32, 32, 32), (64, 32, 3, 3))
+        assert not uses_fft((16, 16, 128, 128), (16, 16, 9, 9),
+                            subsample=(4, 4))
+        assert not uses_fft((16, 16, None, None), (16, 16, 9, 9))
+        assert not uses_fft(None, None)
+        assert (conv.fft_conv_speedup((16, 16, 128, 128), (16, 16, 9, 9)) >
+                conv.fft_conv_speedup((16, 16, 128, 128), (16, 16, 5, 5)))
+
+    def test_layer(self):
+        from scipy.signal import convolve2d
+        from lasagne.layers import InputLayer, Conv2DLayer, get_output
+        l_in = InputLayer((None, 8, 40, 40))
+        layer = Conv2DLayer(l_in, num_filters=8, filter_size=9,
+                            border_mode='same', nonlinearity=None,
+                            convolution=conv.conv2d_fft)
+        input = floatX(np.random.randn(3, 8, 40, 40))
+        W = layer.W.get_value()
+        expected = [[sum(convolve2d(image, kernel)[4:44, 4:44]
+                         for image, kernel in zip(example, filters))
+                     for filters in W] for example in input]
+        assert np.allclose(get_output(layer, input).eval(), expected)
+
+
+class TestConv2DMM:
+
+    @pytest.mark.parametrize("pad", [((0, 0), (0, 0)), ((2, 1), (0, 2))])
+    @pytest.mark.parametrize("subsample", [(1, 1), (2, 3)])
+    def test_grad(self, pad, subsample):
+        rng = np.random.RandomState(42)
+        input = floatX(rng.randn(2, 3, 8, 7))
+        kernel = floatX(rng.randn(4, 3, 3, 2))
+        theano.gradient.verify_grad(conv.GemmCorr2D(pad, subsample),
+                                    [input, kernel], rng=rng)
+
+    @pytest.mark.parametrize("border_mode", ['valid', 'full', 'same', 1,
+                                             (2, 0)])
+    @pytest.mark.parametrize("subsample", [(1, 1), (2, 2), (3, 1)])
+    def test_border_modes(self, border_mode, subsample):
+        from scipy.signal import correlate2d
+        import theano.tensor as T
+        rng = np.random.RandomState(42)
+        input = floatX(rng.randn(2, 3, 9, 8))
+        kernel = floatX(rng.randn(4, 3, 4, 3))
+        (top, bottom), (left, right) = conv._conv_padding(border_mode,
+                                                          (4, 3))
+        padded = np.pad(input, ((0, 0), (0, 0), (top, bottom),
+                                (left, right)), 'constant')
+        expected = [[sum(correlate2d(image, k[::-1, ::-1], mode='valid')
+                         for image, k in zip(example, filters))
+                     for filters in kernel] for example in padded]
+        expected = np.array(expected)[:, :, ::subsample[0], ::subsample[1]]
+        input_var = T.tensor4()
+        conved = conv.conv2d_mm(input_var, kernel, filter_shape=kernel.shape,
+                                border_mode=border_mode, subsample=subsample)
+        actual = conved.eval({input_var: input})
+        assert actual.shape == expected.shape
+        assert np.allclose(actual, expected)
+
+    def test_same_layer(self):
+        from lasagne.layers import InputLayer, Conv2DLayer, get_output
+        l_in = InputLayer((None, 3, 10, 9))
+        input = floatX(np.random.randn(2, 3, 10, 9))
+        for filter_size in [(3, 3), (4, 2)]:
+            layer = Conv2DLayer(l_in, num_filters=5, filter_size=filter_size,
+                                border_mode='same', nonlinearity=None,
+                                convolution=conv.conv2d_fft)
+            layer_mm = Conv2DLayer(l_in, num_filters=5,
+                                   filter_size=filter_size,
+                                   border_mode='same', nonlinearity=None,
+                                   W=layer.W, b=layer.b,
+                                   convolution=conv.conv2d_mm)
+            assert np.allclose(get_output(layer_mm, input).eval(),
+                               get_output(layer, input).eval())
+
+    def test_missing_filter_shape(self):
+        import theano.tensor as T
+        input = T.tensor4()
+        kernel = T.tensor4()
+        conv.conv2d_mm(input, kernel)
+        with pytest.raises(RuntimeError):
+            conv.conv2d_mm(input, kernel, border_mode='same')
+        with pytest.raises(RuntimeError):
+            conv.conv2d_mm(input, kernel, filter_shape=(2, 3, 3, 3),
+                           border_mode='half')
+
+
+class TestConv2DWinograd:
+
+    @pytest.mark.parametrize("tile_size", [2, 4])
+    def test_grad(self, tile_size):
+        rng = np.random.RandomState(42)
+        input = floatX(rng.randn(2, 3, 7, 6))
+        kernel = floatX(rng.randn(4, 3, 3, 3))
+        theano.gradient.verify_grad(conv.WinogradConv2D(tile_size),
+                                    [input, kernel], rng=rng)
+
+    @pytest.mark.parametrize("tile_size", [None, 2, 4])
+    @pytest.mark.parametrize("border_mode", ['valid', 'full'])
+    @pytest.mark.parametrize("image_size", [(3, 3), (9, 8), (14, 17)])
+    def test_output(self, tile_size, border_mode, image_size):
+        from scipy.signal import convolve2d
+        import theano.tensor as T
+        rng = np.random.RandomState(42)
+        input = floatX(rng.randn(2, 3, *image_size))
+        kernel = floatX(rng.randn(4, 3, 3, 3))
+        expected = [[sum(convolve2d(image, k, mode=border_mode)
+                         for image, k in zip(example, filters))
+                     for filters in kernel] for example in input]
+        input_var = T.tensor4()
+        conved = conv.conv2d_winograd(input_var, kernel,
+                                      filter_shape=kernel.shape,
+                                      border_mode=border_mode,
+                                      tile_size=tile_size)
+        assert np.allclose(conved.eval({input_var: input}), expected)
+
+    def test_transformed_filters_cache(self):
+        import pickle
+        from mock import patch
+        import theano.tensor as T
+        rng = np.random.RandomState(42)
+        input = floatX(rng.randn(2, 3, 6, 6))
+        kernel = theano.shared(floatX(rng.randn(4, 3, 3, 3)))
+        input_var = T.tensor4()
+        op = conv.WinogradConv2D(2)
+        conved = op(input_var, kernel)
+        fn = theano.function([input_var], [conved, theano.grad(
+            conved.sum(), input_var)])
+        G = conv._winograd_transforms[2][1]
+
+        def filter_transforms(apply_transform):
+            return sum(call[0][0] is G
+                       for call in apply_transform.call_args_list)
+        transform = patch.object(conv, '_apply_transform',
+                                 wraps=conv._apply_transform)
+        with transform as apply_transform:
+            first = fn(input)
+            # forward and backward pass transform their filters once each
+            assert filter_transforms(apply_transform) == 4
+            second = fn(input)
+            assert filter_transforms(apply_transform) == 4
+        assert all(np.allclose(a, b) for a, b in zip(first, second))
+        # changes of the filters in place are noticed
+        kernel.get_value(borrow=True)[...] *= 2
+        assert all(np.allclose(a, 2 * b) for a, b in zip(fn(input), first))
+        assert not pickle.loads(pickle.dumps(op))._transformed
+
+    def test_fallback(self):
+        import theano.tensor as T
+        input = T.tensor4()
+        kernel = T.tensor4()
+
+        def uses_winograd(filter_shape, **kwargs):
+            conved = conv.conv2d_winograd(input, kernel,
+                                          filter_shape=filter_shape,
+                                          **kwargs)
+            return any(isinstance(node.op, conv.WinogradConv2D) for node in
+                       theano.gof.graph.io_toposort([input, kernel],
+                                                    [conved]))
+
+        assert uses_winograd((16, 32, 3, 3))
+        assert uses_winograd((16, 32, 3, 3), border_mode='full')
+        assert not uses_winograd((16, 32, 5, 5))
+        assert not uses_winograd((16, 32, 3, 3), subsample=(2, 2))
+        assert not uses_winograd((16, 3, 3, 3))
+        assert not uses_winograd(None)
+        with pytest.raises(ValueError):
+            conv.WinogradConv2D(3)
+        with pytest.raises(ValueError):
+            conv.conv2d_winograd(input, kernel, border_mode='same',
+                                 fallback=None)
+
+    def test_tile_size(self):
+        assert conv._winograd_tile_size((4, 4)) == 2
+        assert conv._winograd_tile_size((34, 34)) == 4
+        assert conv._winograd_tile_size((None, 34)) == 4
+        # 2.25 and 4 times fewer multiplications than the direct method
+        assert conv.winograd_multiplies((34, 34), 2) * 2.25 == 9 * 32 * 32
+        assert conv.winograd_multiplies((34, 34), 4) * 4 == 9 * 32 * 32
+
+
+class TestConv1DAutotuner:
+
+    def test_tune(self, tmpdir):
+        from lasagne.layers import InputLayer, Conv1DLayer, get_output
+        cache_file = str(tmpdir.join('tuning', 'conv1d.json'))
+        tuner = conv.Conv1DAutotuner(cache_file, candidates=[
+            conv.conv1d_mc0, conv.conv1d_sd], repeat=1)
+        l_in = InputLayer((2, 3, 20))
+        layer = Conv1DLayer(l_in, num_filters=4, filter_size=5,
+                            nonlinearity=None, b=None, convolution=tuner)
+        input = floatX(np.random.randn(2, 3, 20))
+        expected = [[sum(np.convolve(x, k, mode='valid')
+                         for x, k in zip(example, filters))
+                     for filters in layer.W.get_value()]
+                    for example in input]
+        assert np.allclose(get_output(layer, input).eval(), expected)
+        timings, = tuner.timings.values()
+        assert set(timings) == set(['conv1d_mc0', 'conv1d_sd'])
+        fastest = min(timings, key=timings.get)
+
+        # the choice is loaded from the cache file
+        tuner = conv.Conv1DAutotuner(cache_file, candidates=[
+            conv.conv1d_mc0, conv.conv1d_sd])
+        choice = tuner.choice((2, 3, 20), (4, 3, 5), dtype=input.dtype)
+        assert choice.__name__ == fastest
+        assert tuner.timings == {}
+
+    def test_skip_candidates(self):
+        def conv1d_wrong(*args, **kwargs):
+            return 2 * conv.conv1d_mc0(*args, **kwargs)
+
+        tuner = conv.Conv1DAutotuner(candidates=[
+            conv.conv1d_mc0, conv.conv1d_sd, conv1d_wrong], repeat=1)
+        # conv1d_sd only supports valid convolutions
+        assert tuner.choice((2, 3, 20), (4, 3, 5), 'full') is conv.conv1d_mc0
+        timings, = tuner.timings.values()
+        assert list(timings) == ['conv1d_mc0']
+
+    def test_unknown_shape(self):
+        tuner = conv.Conv1DAutotuner(fallback=conv.conv1d_mc1)
+        assert tuner.choice((None, 3, 20), (4, 3, 5)) is conv.conv1d_mc1
+        assert tuner.choice(None, None) is conv.conv1d_mc1
+        assert tuner.timings == {}
+
+    def test_invalid_cache_file(self, tmpdir):
+        cache_file = tmpdir.join('conv1d.json')
+        cache_file.write('invalid')
+        tuner = conv.Conv1DAutotuner(str(cache_file), candidates=[
+            conv.conv1d_mc0], repeat=1)
+        with pytest.warns(UserWarning):
+            choice = tuner.choice((2, 3, 20), (4, 3, 5))
+        assert choice is conv.conv1d_mc0
+        assert 'conv1d_mc0' in cache_file.read()
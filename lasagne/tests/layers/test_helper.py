@@ -1,3 +1,4 @@
+import numpy as np
 import pytest
 import theano
 
@@ -65,3 +66,216 @@ class TestGetAllLayers:
         l4 = ElemwiseSumLayer([l2, l3])
         l5 = DenseLayer(l4, 40)
         assert get_all_layers(l5) == [l1, l2, l3, l4, l5]
+
+
+class TestGetOutput:
+    def test_single_input(self):
+        from lasagne.layers import InputLayer, DenseLayer, get_output
+        l1 = InputLayer((10, 20))
+        l2 = DenseLayer(l1, 30)
+        x = theano.tensor.matrix()
+        assert get_output(l1) is l1.input_var
+        assert get_output(l1, x) is x
+        assert get_output(l2, x).owner is not None
+
+    def test_multiple_outputs(self):
+        from lasagne.layers import InputLayer, DenseLayer, get_output
+        l1 = InputLayer((10, 20))
+        l2 = DenseLayer(l1, 30)
+        l3 = DenseLayer(l2, 40)
+        out2, out3 = get_output([l2, l3])
+        # the expression for l2 is built once and reused for l3
+        assert out2 in theano.gof.graph.ancestors([out3])
+
+    def test_dict_input_skips_lower_layers(self):
+        from mock import Mock
+        from lasagne.layers import InputLayer, DenseLayer, get_output
+        l1 = InputLayer((10, 20))
+        l2 = DenseLayer(l1, 30)
+        l3 = DenseLayer(l2, 40)
+        l2.get_output_for = Mock()
+        x = theano.tensor.matrix()
+        get_output(l3, {l2: x})
+        assert not l2.get_output_for.called
+
+    def test_shared_layers_computed_once(self):
+        from mock import Mock
+        from lasagne.layers import (InputLayer, DenseLayer, ElemwiseSumLayer,
+                                    get_output)
+        # stack of diamonds: every block feeds its input into two branches
+        # that are joined again, so naive recursion is exponential in depth
+        l_top = InputLayer((10, 20))
+        layers = []
+        for _ in range(20):
+            l_a = DenseLayer(l_top, 20)
+            l_b = DenseLayer(l_top, 20)
+            l_top = ElemwiseSumLayer([l_a, l_b])
+            layers.extend([l_a, l_b, l_top])
+        for layer in layers:
+            layer.get_output_for = Mock(wraps=layer.get_output_for)
+        l_top.get_output()
+        assert all(layer.get_output_for.call_count == 1 for layer in layers)
+
+
+class TestGetAllParams:
+    def test_get_all_params(self):
+        from lasagne.layers import (InputLayer, DenseLayer, ElemwiseSumLayer,
+                                    get_all_params, get_all_bias_params,
+                                    get_all_non_bias_params)
+        # parameters shared between layers are only returned once
+        l1 = InputLayer((10, 20))
+        l2 = DenseLayer(l1, 30)
+        l3 = DenseLayer(l1, 30, W=l2.W, b=l2.b)
+        l4 = DenseLayer(ElemwiseSumLayer([l2, l3]), 40)
+        assert get_all_params(l4) == [l2.W, l2.b, l4.W, l4.b]
+        assert get_all_bias_params(l4) == [l2.b, l4.b]
+        assert get_all_non_bias_params(l4) == [l2.W, l4.W]
+
+    @pytest.mark.slow
+    def test_linear_time(self):
+        import time
+        from lasagne.layers import (InputLayer, DenseLayer, get_all_params,
+                                    get_all_non_bias_params)
+
+        def timing(num_layers):
+            l_top = InputLayer((10, 1))
+            for _ in range(num_layers):
+                l_top = DenseLayer(l_top, 1)
+            start = time.time()
+            params = get_all_params(l_top)
+            non_bias_params = get_all_non_bias_params(l_top)
+            assert len(params) == 2 * num_layers
+            assert len(non_bias_params) == num_layers
+            return time.time() - start
+
+        # a quadratic implementation takes 100 times as long for 10 times as
+        # many layers, a linear one about 10 times as long.
+        assert timing(10000) < 40 * timing(1000)
+
+
+def test_set_storage_dtype():
+    import numpy as np
+    from lasagne.layers import (InputLayer, DenseLayer, Conv2DLayer,
+                                NINLayer, get_all_params, get_output,
+                                set_storage_dtype, set_all_param_values)
+    l_in = InputLayer((None, 2, 5, 5))
+    l_conv = Conv2DLayer(l_in, num_filters=3, filter_size=3,
+                         untie_biases=True)
+    l_nin = NINLayer(l_conv, num_units=4)
+    l_out = DenseLayer(l_nin, num_units=6)
+    l_tied = DenseLayer(l_nin, num_units=6, W=l_out.W)
+    X = np.random.randn(2, 2, 5, 5).astype(theano.config.floatX)
+    expected = [output.eval() for output in get_output([l_out, l_tied], X)]
+
+    set_storage_dtype([l_out, l_tied], 'float16')
+    params = get_all_params([l_out, l_tied])
+    assert len(params) == 7
+    assert all(param.dtype == 'float16' for param in params)
+    assert l_tied.W is l_out.W
+    assert l_out.storage_dtype == 'float16'
+    outputs = get_output([l_out, l_tied], X)
+    assert all(output.dtype == theano.config.floatX for output in outputs)
+    for output, expected_output in zip(outputs, expected):
+        assert np.allclose(output.eval(), expected_output, rtol=1e-2,
+                           atol=1e-2)
+    # gradients are computed in floatX
+    grad = theano.grad(outputs[0].sum(), l_out.W)
+    assert grad.dtype == 'float16'
+    # values of any dtype can be set
+    set_all_param_values(l_out, [p.get_value().astype(theano.config.floatX)
+                                 for p in get_all_params(l_out)])
+    # other parameters are not cast
+    l_float32 = DenseLayer(l_in, 3, W=theano.shared(
+        np.zeros((50, 3), dtype='float32')))
+    with pytest.raises(TypeError):
+        set_all_param_values(l_float32, [np.zeros((50, 3)), np.zeros(3)])
+
+    set_storage_dtype(l_out, None)
+    assert l_out.W.dtype == theano.config.floatX
+    assert l_out.storage_dtype is None
+    assert DenseLayer(l_in, 3, storage_dtype='float16').W.dtype == 'float16'
+
+
+class TestNetworkGraph:
+    @pytest.fixture
+    def layers(self):
+        from lasagne.layers import InputLayer, DenseLayer, ElemwiseSumLayer
+        # l1 --> l2 --> l4 --> l5
+        #  \---> l3 ----^
+        l1 = InputLayer((10, 20))
+        l2 = DenseLayer(l1, 30)
+        l3 = DenseLayer(l1, 30, W=l2.W, b=None)
+        l4 = ElemwiseSumLayer([l2, l3])
+        l5 = DenseLayer(l4, 40)
+        return l1, l2, l3, l4, l5
+
+    def test_index(self, layers):
+        from lasagne.layers import NetworkGraph, get_all_layers
+        l1, l2, l3, l4, l5 = layers
+        graph = NetworkGraph(l5)
+        assert graph.layers == get_all_layers(l5)
+        assert graph.parents(l1) == []
+        assert graph.parents(l4) == [l2, l3]
+        assert graph.children(l1) == [l2, l3]
+        assert graph.children(l5) == []
+        assert graph.param_layers(l2.W) == [l2, l3]
+        assert graph.param_layers(l5.b) == [l5]
+
+    def test_params(self, layers):
+        from lasagne.layers import (NetworkGraph, get_all_params,
+                                    get_all_bias_params,
+                                    get_all_non_bias_params, count_params)
+        from lasagne.regularization import l2
+        l5 = layers[-1]
+        graph = NetworkGraph(l5)
+        assert graph.params == get_all_params(l5)
+        assert get_all_params(graph) == get_all_params(l5)
+        assert get_all_bias_params(graph) == get_all_bias_params(l5)
+        assert get_all_non_bias_params(graph) == get_all_non_bias_params(l5)
+        assert count_params(graph) == count_params(l5)
+        assert l2(graph).eval() == l2(l5).eval()
+
+    def test_add_invalidates(self, layers):
+        from lasagne.layers import NetworkGraph, DenseLayer
+        l1, l2, l3, l4, l5 = layers
+        graph = NetworkGraph(l2)
+        assert graph.layers == [l1, l2]
+        l6 = DenseLayer(l2, 10)
+        graph.add(l6)
+        assert graph.layers == [l1, l2, l6]
+        assert graph.children(l2) == [l6]
+        assert graph.params == [l2.W, l2.b, l6.W, l6.b]
+
+    def test_invalidate(self, layers):
+        from lasagne.layers import NetworkGraph, DenseLayer
+        l1, l2, l3, l4, l5 = layers
+        graph = NetworkGraph(l3)
+        assert graph.layers == [l1, l3]
+        # insert a layer between l1 and l3
+        l6 = DenseLayer(l1, 10)
+        l3.input_layer = l6
+        # the index is kept until invalidated
+        assert graph.layers == [l1, l3]
+        graph.invalidate()
+        assert graph.layers == [l1, l6, l3]
+        assert graph.parents(l3) == [l6]
+        assert graph.params == [l6.W, l6.b, l3.W]
+        # replace a parameter
+        l3.W = l6.W
+        graph.invalidate()
+        assert graph.params == [l6.W, l6.b]
+
+    def test_param_values(self, layers):
+        from lasagne.layers import (NetworkGraph, get_all_param_values,
+                                    set_all_param_values, set_storage_dtype)
+        l5 = layers[-1]
+        graph = NetworkGraph(l5)
+        values = get_all_param_values(graph)
+        set_all_param_values(graph, [2 * value for value in values])
+        for value, new_value in zip(values, get_all_param_values(l5)):
+            assert np.allclose(2 * value, new_value)
+        set_storage_dtype(graph, 'float16')
+        assert all(param.dtype == 'float16' for param in graph.params)
+        set_all_param_values(graph, values)
+        for value, new_value in zip(values, get_all_param_values(graph)):
+            assert np.allclose(value, new_value, rtol=1e-2, atol=1e-2)
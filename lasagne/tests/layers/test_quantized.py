@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+import theano
+
+
+def test_quantize_weights():
+    from lasagne.layers.quantized import quantize_weights
+    W = np.array([[1.0, -0.5, 0.0], [0.25, 2.0, 0.0]])
+    W_q, scale = quantize_weights(W, axis=1)
+    assert W_q.dtype == np.int8
+    assert np.allclose(scale, [1 / 127., 2 / 127., 1])
+    assert np.all(W_q == [[127, -32, 0], [32, 127, 0]])
+    assert np.allclose(W_q * scale, W, atol=scale / 2)
+    W_q, scale = quantize_weights(W, axis=0)
+    assert np.allclose(scale, [1 / 127., 2 / 127.])
+    assert np.all(W_q[:, 0] == [127, 16])
+
+
+@pytest.mark.parametrize('layer_class, W_shape, axis, kwargs', [
+    ('Dense', (12, 3), 1, {'num_units': 3}),
+    ('NIN', (2, 3), 1, {'num_units': 3, 'untie_biases': True}),
+    ('Conv2D', (3, 2, 3, 3), 0, {'num_filters': 3, 'filter_size': 3,
+                                 'border_mode': 'same'}),
+])
+def test_quantized_layers(layer_class, W_shape, axis, kwargs):
+    import lasagne.layers as L
+    from lasagne.layers.quantized import quantize_weights
+    rng = np.random.RandomState(0)
+    l_in = L.InputLayer((4, 2, 2, 3))
+    W = rng.randn(*W_shape).astype(theano.config.floatX)
+    W_q, scale = quantize_weights(W, axis)
+    layer = getattr(L, '%sLayer' % layer_class)(l_in, W=W, b=None,
+                                                nonlinearity=None, **kwargs)
+    quantized = getattr(L, 'Quantized%sLayer' % layer_class)(
+        l_in, W=W_q, W_scale=scale, **kwargs)
+    assert quantized.get_output_shape() == layer.get_output_shape()
+    assert quantized.get_params() == [quantized.W_q, quantized.W_scale]
+    assert quantized.W_q.dtype == 'int8'
+
+    X = rng.uniform(-1, 1, (4, 2, 2, 3)).astype(theano.config.floatX)
+    expected = L.get_output(layer, X).eval()
+    assert np.allclose(L.get_output(quantized, X).eval(), expected,
+                       atol=0.05)
+
+    # with input quantization, the output is computed from int8 values
+    quantized.input_scale = 1 / 127.
+    X_q = np.round(X * 127) / 127
+    expected = L.get_output(
+        getattr(L, '%sLayer' % layer_class)(l_in, W=W_q * scale.reshape(
+            [-1 if a == axis else 1 for a in range(W.ndim)]), b=None,
+            nonlinearity=None, **kwargs), X_q).eval()
+    assert np.allclose(L.get_output(quantized, X).eval(), expected)
+
+    # biases are added after scaling the output
+    from lasagne.init import Normal
+    layer = getattr(L, '%sLayer' % layer_class)(l_in, W=W, b=Normal(1),
+                                                nonlinearity=None, **kwargs)
+    quantized = getattr(L, 'Quantized%sLayer' % layer_class)(
+        l_in, W=W_q, W_scale=scale, b=layer.b.get_value(), **kwargs)
+    assert np.allclose(L.get_output(quantized, X).eval(),
+                       L.get_output(layer, X).eval(), atol=0.05)
+
+
+def test_quantized_layer_params():
+    from lasagne.layers import QuantizedDenseLayer
+    layer = QuantizedDenseLayer((None, 3), num_units=2,
+                                W=np.ones((3, 2), dtype='int8'),
+                                W_scale=np.ones(2), b=np.zeros(2))
+    assert layer.get_bias_params() == [layer.b]
+    assert layer.get_params() == [layer.W_q, layer.W_scale, layer.b]
+    with pytest.raises(TypeError):
+        QuantizedDenseLayer((None, 3), num_units=2, W=np.ones((3, 2)),
+                            W_scale=np.ones(2))
+    with pytest.raises(ValueError):
+        QuantizedDenseLayer((None, 3), num_units=2,
+                            W=np.ones((2, 2), dtype='int8'),
+                            W_scale=np.ones(2))
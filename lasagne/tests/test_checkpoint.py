@@ -0,0 +1,193 @@
+import numpy as np
+import pytest
+import theano
+
+
+def build_network(num_units=30):
+    from lasagne.layers import InputLayer, DenseLayer
+    l_in = InputLayer((10, 20))
+    l1 = DenseLayer(l_in, num_units=num_units, name='hidden')
+    l2 = DenseLayer(l1, num_units=5, name='output')
+    return l2
+
+
+@pytest.fixture
+def filename(tmpdir):
+    return str(tmpdir.join('model.lsgn'))
+
+
+def test_write_read_arrays(filename):
+    from lasagne.checkpoint import write_arrays, read_arrays, ALIGNMENT
+    arrays = [({'name': 'a'}, np.arange(7, dtype=np.int8)),
+              ({'name': 'b'}, np.random.randn(3, 4)),
+              ({'name': 'c'}, np.zeros((0, 2), dtype=np.float32)),
+              ({'name': 'd'}, np.random.randn(5).astype(np.float32)[::2])]
+    write_arrays(filename, arrays, metadata={'epoch': 3})
+    for mmap_mode in ['r', 'c', None]:
+        metadata, result = read_arrays(filename, mmap_mode)
+        assert metadata == {'epoch': 3}
+        assert [info for info, _ in result] == [info for info, _ in arrays]
+        for (_, expected), (_, actual) in zip(arrays, result):
+            assert actual.dtype == expected.dtype
+            assert np.all(actual == expected)
+            if actual.size and mmap_mode is not None:
+                assert isinstance(actual, np.memmap)
+                assert actual.ctypes.data % ALIGNMENT == 0
+
+
+def test_read_arrays_invalid_file(filename):
+    from lasagne.checkpoint import read_arrays
+    with open(filename, 'wb') as f:
+        f.write(b'\0' * 100)
+    with pytest.raises(ValueError):
+        read_arrays(filename)
+
+
+def test_save_load_params(filename):
+    from lasagne.layers import get_all_param_values
+    from lasagne.checkpoint import save_params, load_params
+    network = build_network()
+    save_params(filename, network)
+    network2 = build_network()
+    load_params(filename, network2)
+    for expected, actual in zip(get_all_param_values(network),
+                                get_all_param_values(network2)):
+        assert np.all(expected == actual)
+    # values are mapped copy-on-write, so they can be modified
+    W = network2.W.get_value(borrow=True)
+    W += 1
+    load_params(filename, network2, mmap_mode=None)
+    assert np.all(network2.W.get_value() == network.W.get_value())
+
+
+def test_save_load_params_storage_dtype(filename):
+    import os
+    from lasagne.layers import get_all_params, set_storage_dtype
+    from lasagne.checkpoint import save_params, load_params
+    network = build_network(num_units=300)
+    save_params(filename, network)
+    size = os.path.getsize(filename)
+    set_storage_dtype(network, 'float16')
+    save_params(filename, network)
+    # the checkpoint follows the storage dtype
+    itemsize = np.dtype(theano.config.floatX).itemsize
+    assert os.path.getsize(filename) < size * 2.5 / itemsize
+    network2 = build_network(num_units=300)
+    load_params(filename, network2)
+    for param, param2 in zip(get_all_params(network),
+                             get_all_params(network2)):
+        assert param2.dtype == theano.config.floatX
+        assert np.all(param.get_value() == param2.get_value())
+    save_params(filename, network2)
+    load_params(filename, network)
+    assert network.W.dtype == 'float16'
+    assert np.all(network.W.get_value() == network2.W.get_value())
+
+
+def test_load_params_by_layer_name(filename):
+    from lasagne.checkpoint import save_params, load_params
+    network = build_network()
+    save_params(filename, network)
+    network2 = build_network()
+    hidden = network2.input_layer
+    hidden_W = hidden.W.get_value()
+    load_params(filename, network2, layer_names=['output'])
+    assert np.all(network2.W.get_value() == network.W.get_value())
+    assert np.all(hidden.W.get_value() == hidden_W)
+    with pytest.raises(ValueError):
+        load_params(filename, network2, layer_names=['nonexistent'])
+
+
+def test_load_params_mismatch(filename):
+    from lasagne.layers import InputLayer, DenseLayer
+    from lasagne.checkpoint import save_params, load_params
+    save_params(filename, build_network())
+    with pytest.raises(ValueError):
+        load_params(filename, build_network(num_units=40))
+    with pytest.raises(ValueError):
+        load_params(filename, DenseLayer(InputLayer((10, 20)), 30))
+
+
+def build_updates(network):
+    import theano.tensor as T
+    from lasagne.layers import get_all_params
+    from lasagne.updates import momentum
+    x = T.matrix('x')
+    loss = network.get_output(x).sum()
+    updates = momentum(loss, get_all_params(network), learning_rate=0.1)
+    return theano.function([x], loss, updates=updates), updates
+
+
+def test_save_load_optimizer_state(filename):
+    from lasagne.layers import get_all_params
+    from lasagne.checkpoint import save_params, load_params
+    network = build_network()
+    train_fn, updates = build_updates(network)
+    train_fn(np.ones((10, 20), dtype=theano.config.floatX))
+    save_params(filename, network, updates)
+
+    network2 = build_network()
+    _, updates2 = build_updates(network2)
+    load_params(filename, network2, updates=updates2)
+    params = set(get_all_params(network))
+    params2 = set(get_all_params(network2))
+    state = [var for var in updates if var not in params]
+    state2 = [var for var in updates2 if var not in params2]
+    assert len(state) == len(state2) == 4
+    for var, var2 in zip(state, state2):
+        assert np.all(var.get_value() == var2.get_value())
+
+    # parameters can still be loaded without the optimizer state
+    load_params(filename, build_network())
+    # the state of a different update rule does not match
+    from lasagne.updates import adagrad
+    with pytest.raises(ValueError):
+        load_params(filename, network2,
+                    updates=adagrad(network2.get_output().sum(),
+                                    get_all_params(network2)))
+
+
+def test_save_load_optimizer_state_object(filename):
+    from lasagne.checkpoint import save_params, load_params
+    from lasagne.updates import OptimizerState
+    network = build_network()
+    train_fn, updates = build_updates(network)
+    train_fn(np.ones((10, 20), dtype=theano.config.floatX))
+    state = OptimizerState(updates)
+    assert list(state.variables.keys()) == [
+        'hidden.W.velocity', 'hidden.b.velocity',
+        'output.W.velocity', 'output.b.velocity']
+    save_params(filename, network, state)
+
+    network2 = build_network()
+    state2 = OptimizerState(build_updates(network2)[1])
+    load_params(filename, network2, updates=state2)
+    for expected, actual in zip(state.get_values().values(),
+                                state2.get_values().values()):
+        assert np.all(expected == actual)
+
+
+def test_checkpoint_writer(filename, tmpdir):
+    from lasagne.layers import get_all_param_values
+    from lasagne.checkpoint import CheckpointWriter, load_params, read_arrays
+    network = build_network()
+    network2 = build_network()
+    train_fn, updates = build_updates(network)
+    with CheckpointWriter(max_pending=2) as writer:
+        writer.save(filename, network, updates, metadata={'epoch': 1})
+        expected = get_all_param_values(network)
+        # the snapshot is not affected by further training
+        train_fn(np.ones((10, 20), dtype=theano.config.floatX))
+        writer.wait()
+        assert read_arrays(filename)[0] == {'epoch': 1}
+        load_params(filename, network2)
+        for value, actual in zip(expected, get_all_param_values(network2)):
+            assert np.all(value == actual)
+
+        # errors on the background thread are reported by the next call
+        writer.save(str(tmpdir.join('missing', 'model.lsgn')), network)
+        with pytest.raises(IOError):
+            writer.wait()
+
+    with pytest.raises(RuntimeError):
+        writer.save(filename, network)
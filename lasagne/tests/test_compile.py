@@ -0,0 +1,134 @@
+import numpy as np
+import pytest
+import theano
+import theano.tensor as T
+
+
+def build_network():
+    from lasagne.layers import InputLayer, DenseLayer, get_all_params
+    from lasagne.updates import sgd
+    l_in = InputLayer((None, 5))
+    l_out = DenseLayer(l_in, num_units=3, nonlinearity=None)
+    x = T.matrix('x')
+    loss = l_out.get_output(x).sum()
+    updates = sgd(loss, get_all_params(l_out), learning_rate=0.1)
+    return l_out, x, loss, updates
+
+
+def test_fingerprint():
+    from lasagne.layers import InputLayer, DenseLayer
+    from lasagne.compile import fingerprint
+    l1 = DenseLayer(InputLayer((None, 5)), num_units=3)
+    l2 = DenseLayer(InputLayer((None, 5)), num_units=3)
+    l3 = DenseLayer(InputLayer((None, 5)), num_units=4)
+    l4 = DenseLayer(InputLayer((None, 5)), num_units=3, nonlinearity=None)
+    assert fingerprint(l1) == fingerprint(l2)
+    assert fingerprint(l1) != fingerprint(l3)
+    assert fingerprint(l1) != fingerprint(l4)
+
+
+def test_memory_cache():
+    from lasagne.compile import FunctionCache
+    cache = FunctionCache(maxsize=1)
+    l_out, x, loss, updates = build_network()
+    fn = cache.function([x], loss, updates=updates, network=l_out)
+    assert cache.function([x], loss, updates=updates, network=l_out) is fn
+    # an identical network with its own parameters needs its own function
+    l_out2, x2, loss2, updates2 = build_network()
+    fn2 = cache.function([x2], loss2, updates=updates2, network=l_out2)
+    assert fn2 is not fn
+    assert len(cache) == 1
+
+
+def test_disk_cache(tmpdir):
+    from lasagne.compile import FunctionCache
+    cache_dir = str(tmpdir.join('cache'))
+    l_out, x, loss, updates = build_network()
+    fn = FunctionCache(cache_dir=cache_dir).function(
+        [x], loss, updates=updates, network=l_out)
+    assert len(tmpdir.join('cache').listdir()) == 1
+
+    l_out2, x2, loss2, updates2 = build_network()
+    fn2 = FunctionCache(cache_dir=cache_dir).function(
+        [x2], loss2, updates=updates2, network=l_out2)
+    assert fn2 is not fn
+
+    # the loaded function must read and update the new network's parameters
+    W_before = l_out.W.get_value()
+    W2_before = l_out2.W.get_value()
+    data = np.ones((2, 5), dtype=theano.config.floatX)
+    expected = data.dot(W2_before).sum()
+    assert np.allclose(fn2(data), expected)
+    assert not np.allclose(l_out2.W.get_value(), W2_before)
+    assert np.allclose(l_out.W.get_value(), W_before)
+
+
+class TestBucketedFunction:
+    @pytest.fixture
+    def network(self):
+        from lasagne.layers import InputLayer, Conv2DLayer, DenseLayer
+        l_in = InputLayer((None, 1, 6, 6))
+        l_conv = Conv2DLayer(l_in, num_filters=2, filter_size=(3, 3))
+        return DenseLayer(l_conv, num_units=3, nonlinearity=None)
+
+    @pytest.fixture
+    def inputs(self):
+        return np.random.RandomState(0).randn(11, 1, 6, 6).astype(
+            theano.config.floatX)
+
+    def test_pad(self, network, inputs):
+        from lasagne.compile import BucketedFunction, FunctionCache
+        from lasagne.layers import get_output
+        x = T.tensor4('x')
+        expected = theano.function([x], get_output(network, x))(inputs)
+        built = []
+
+        def build(batch_size):
+            built.append(batch_size)
+            out = get_output(network, x, batch_size=batch_size)
+            return [out, out.sum(axis=1)]
+        fn = BucketedFunction([x], build, buckets=[1, 4],
+                              cache=FunctionCache())
+        outputs = fn(inputs[:3])
+        assert built == [4]
+        assert outputs[0].shape == (3, 3) and outputs[1].shape == (3,)
+        assert np.allclose(outputs[0], expected[:3])
+        outputs = fn(inputs)
+        assert built == [4]
+        assert np.allclose(outputs[0], expected)
+        assert np.allclose(outputs[1], expected.sum(axis=1))
+        fn(inputs[:1])
+        assert built == [4, 1]
+        with pytest.raises(ValueError):
+            fn(inputs, inputs)
+
+    def test_specialized(self, network, inputs):
+        from lasagne.compile import BucketedFunction
+        from lasagne.layers import get_output
+        x = T.tensor4('x')
+        built = []
+
+        def build(batch_size):
+            built.append(get_output(network, x, batch_size=batch_size))
+            return built[-1]
+        fn = BucketedFunction([x], build, buckets=[4])
+        fn(inputs[:4])
+        nodes = theano.gof.graph.io_toposort([x], built)
+        convs = [node.op for node in nodes
+                 if 'Conv' in type(node.op).__name__]
+        # ConvOp stores the batch size separately, AbstractConv2d does not
+        assert convs and all(getattr(op, 'bsize', None) == 4 or
+                             op.imshp[0] == 4 for op in convs)
+
+    def test_no_pad(self, network, inputs):
+        from lasagne.compile import BucketedFunction
+        from lasagne.layers import get_output
+        x = T.tensor4('x')
+
+        def loss(batch_size):
+            return get_output(network, x, batch_size=batch_size).mean()
+        expected = theano.function([x], loss(None))
+        fn = BucketedFunction([x], loss, buckets=[4], pad=False)
+        assert np.allclose(fn(inputs[:4]), expected(inputs[:4]))
+        assert np.allclose(fn(inputs), expected(inputs))
+        assert sorted(fn.variants, key=str) == [4, None]
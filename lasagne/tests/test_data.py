@@ -0,0 +1,272 @@
+import numpy as np
+import pytest
+import theano
+import theano.tensor as T
+
+
+@pytest.fixture
+def dataset():
+    X = np.arange(230, dtype='float64').reshape(23, 10)
+    y = np.arange(23, dtype='int64')
+    return X, y
+
+
+def test_iterate_minibatches(dataset):
+    from lasagne.data import iterate_minibatches
+    X, y = dataset
+    batches = list(iterate_minibatches([X, y], 5))
+    assert [len(b[1]) for b in batches] == [5, 5, 5, 5, 3]
+    assert np.all(np.concatenate([b[0] for b in batches]) == X)
+    batches = list(iterate_minibatches([X, y], 5, drop_last=True))
+    assert [len(b[1]) for b in batches] == [5, 5, 5, 5]
+    assert [len(b[0]) for b in iterate_minibatches(X, 10)] == [10, 10, 3]
+    with pytest.raises(ValueError):
+        list(iterate_minibatches([X, y[:-1]], 5))
+
+
+def test_iterate_files(dataset, tmpdir):
+    from lasagne.data import iterate_files
+    X, y = dataset
+    np.savez(str(tmpdir.join('a.npz')), X=X[:13], y=y[:13])
+    np.savez(str(tmpdir.join('b.npz')), X=X[13:], y=y[13:])
+    np.save(str(tmpdir.join('c.npy')), X)
+    filenames = [str(tmpdir.join(name)) for name in ('a.npz', 'b.npz')]
+    batches = list(iterate_files(filenames, 5))
+    assert [len(b[1]) for b in batches] == [5, 5, 3, 5, 5]
+    assert np.all(np.concatenate([b[0] for b in batches]) == X)
+    assert np.all(np.concatenate([b[1] for b in batches]) == y)
+    batches = list(iterate_files([str(tmpdir.join('c.npy'))], 10))
+    assert isinstance(batches[0][0], np.memmap)
+    assert np.all(np.concatenate([b[0] for b in batches]) == X)
+
+
+@pytest.mark.parametrize('buffer_size', [1, 7, 100])
+def test_shuffle(dataset, buffer_size):
+    from lasagne.data import iterate_minibatches, shuffle
+    X, y = dataset
+    batches = list(shuffle(iterate_minibatches([X, y], 5), buffer_size,
+                           rng=np.random.RandomState(0)))
+    assert all(len(b[1]) <= 5 for b in batches)
+    X2 = np.concatenate([b[0] for b in batches])
+    y2 = np.concatenate([b[1] for b in batches])
+    assert sorted(y2) == list(y)
+    assert np.all(X2 == X[y2])
+    assert np.any(y2 != y)
+    # the examples within a minibatch are shuffled as well
+    assert any(np.any(np.diff(b[1]) < 0) for b in batches[:-1])
+
+
+def test_shuffle_swap():
+    from lasagne.data import _swap
+    # every example is put into the same slot, one after the other
+    buffer = (np.array([10]),)
+    taken, = _swap(buffer, (np.arange(3),), np.random.RandomState(0))
+    assert list(taken) == [10, 0, 1]
+    assert list(buffer[0]) == [2]
+
+
+def test_prefetch(dataset):
+    from lasagne.data import iterate_minibatches, prefetch
+    X, y = dataset
+    batches = list(prefetch(iterate_minibatches([X, y], 5), dtype='float32'))
+    assert all(b[0].dtype == np.float32 for b in batches)
+    assert all(b[1].dtype == np.int64 for b in batches)
+    assert np.all(np.concatenate([b[0] for b in batches]) == X)
+
+    def failing():
+        yield X, y
+        raise IOError("disk on fire")
+    iterator = prefetch(failing())
+    next(iterator)
+    with pytest.raises(IOError):
+        next(iterator)
+
+    # stopping early does not hang
+    for batch in prefetch(iterate_minibatches([X, y], 1), num_batches=1):
+        break
+
+
+def test_double_buffer(dataset):
+    from lasagne.data import iterate_minibatches, DoubleBuffer
+    X, y = dataset
+    x_var, y_var = T.matrix('x'), T.ivector('y')
+    buffer = DoubleBuffer([x_var, y_var])
+    assert buffer.shared[1].dtype == 'int32'
+    fn = theano.function([], [x_var.sum(axis=1), y_var * 2],
+                         givens=buffer.givens)
+    results = []
+    for num_examples in buffer.feed(iterate_minibatches([X, y], 5)):
+        assert len(buffer.shared[0].get_value(borrow=True)) == num_examples
+        results.append(fn())
+    assert len(results) == 5
+    assert np.allclose(np.concatenate([r[0] for r in results]),
+                       X.sum(axis=1))
+    assert np.all(np.concatenate([r[1] for r in results]) == y * 2)
+
+    for _ in buffer.feed(iterate_minibatches([X, y], 5)):
+        break
+    with pytest.raises(ValueError):
+        list(buffer.feed(iterate_minibatches([X], 5)))
+
+
+class TestShardedDataset:
+    @pytest.fixture
+    def dataset(self, dataset, tmpdir):
+        from lasagne.data import convert_to_shards
+        X, y = dataset
+        return convert_to_shards({'y': y, 'X': X}, str(tmpdir),
+                                 max_shard_bytes=10 * 88)
+
+    def test_convert(self, dataset, tmpdir):
+        assert len(dataset) == 23
+        assert dataset.names == ['X', 'y']
+        assert dataset.shard_sizes == [10, 10, 3]
+        X, y = dataset.shard(2)
+        assert isinstance(X, np.memmap)
+        assert X.shape == (3, 10) and X.dtype == np.float64
+        assert list(y) == [20, 21, 22]
+        assert tmpdir.join('X.00002.npy').check()
+
+    @pytest.mark.parametrize('kind', ['list', 'npz', 'pickle'])
+    def test_convert_sources(self, dataset, tmpdir, kind):
+        import gzip
+        import pickle
+        from lasagne.data import convert_to_shards
+        X, y = np.arange(10.0), np.arange(10)
+        if kind == 'list':
+            source = [X, y]
+        elif kind == 'npz':
+            source = str(tmpdir.join('data.npz'))
+            np.savez(source, arr_0=X, arr_1=y)
+        else:
+            source = str(tmpdir.join('data.pkl.gz'))
+            with gzip.open(source, 'wb') as f:
+                pickle.dump((X, y), f)
+        converted = convert_to_shards(source, str(tmpdir.join('out')),
+                                      names=['inputs', 'targets'])
+        assert converted.names == ['inputs', 'targets']
+        assert np.all(converted.shard(0)[0] == X)
+        with pytest.raises(ValueError):
+            convert_to_shards(source, str(tmpdir.join('out2')),
+                              names=['inputs'])
+
+    def test_convert_nested(self, tmpdir):
+        import gzip
+        import pickle
+        from lasagne.data import convert_to_shards
+        # the layout of mnist.pkl.gz
+        splits = tuple((np.random.rand(n, 4), np.arange(n)) for n in (5, 3, 2))
+        source = str(tmpdir.join('mnist.pkl.gz'))
+        with gzip.open(source, 'wb') as f:
+            pickle.dump(splits, f)
+        with pytest.raises(ValueError):
+            convert_to_shards(source, str(tmpdir.join('out')))
+        converted = convert_to_shards(source, str(tmpdir.join('out')),
+                                      split=1)
+        assert len(converted) == 3
+        assert np.all(converted.shard(0)[0] == splits[1][0])
+        assert np.all(converted.shard(0)[1] == splits[1][1])
+
+    def test_convert_python2_pickle(self, tmpdir):
+        from lasagne.data import convert_to_shards
+        # np.array([1, 128, 255], dtype=np.uint8) pickled by Python 2
+        source = tmpdir.join('data.pkl')
+        source.write_binary(
+            b"\x80\x02]q\x00cnumpy.core.multiarray\n_reconstruct\nq\x01"
+            b"cnumpy\nndarray\nq\x02K\x00\x85q\x03U\x01bq\x04\x87q\x05"
+            b"Rq\x06(K\x01K\x03\x85q\x07cnumpy\ndtype\nq\x08U\x02u1q\t"
+            b"K\x00K\x01\x87q\nRq\x0b(K\x03U\x01|q\x0cNNNJ\xff\xff\xff"
+            b"\xffJ\xff\xff\xff\xffK\x00tq\rb\x89U\x03\x01\x80\xffq\x0e"
+            b"tq\x0fba.")
+        converted = convert_to_shards(str(source), str(tmpdir.join('out')))
+        assert np.all(converted.shard(0)[0] == [1, 128, 255])
+
+    def test_convert_mismatch(self, tmpdir):
+        from lasagne.data import convert_to_shards
+        with pytest.raises(ValueError):
+            convert_to_shards([np.zeros(3), np.zeros(4)], str(tmpdir))
+
+    def test_names(self, dataset):
+        from lasagne.data import ShardedDataset
+        subset = ShardedDataset(dataset.directory, names=['y'])
+        assert len(subset.shard(0)) == 1
+        with pytest.raises(ValueError):
+            ShardedDataset(dataset.directory, names=['z'])
+
+    def test_iterate(self, dataset):
+        batches = list(dataset.iterate(4))
+        assert [len(b[0]) for b in batches] == [4, 4, 2, 4, 4, 2, 3]
+        y = np.concatenate([b[1] for b in batches])
+        assert list(y) == list(range(23))
+        X = np.concatenate([b[0] for b in batches])
+        assert np.all(X[:, 0] == y * 10)
+
+        batches = list(dataset.iterate(4, drop_last=True))
+        assert [len(b[0]) for b in batches] == [4, 4, 4, 4]
+
+    def test_iterate_shuffle(self, dataset):
+        batches = list(dataset.iterate(4, shuffle=True,
+                                       rng=np.random.RandomState(1)))
+        y = np.concatenate([b[1] for b in batches])
+        assert sorted(y) == list(range(23))
+        assert list(y) != list(range(23))
+        # minibatches are contiguous blocks
+        for batch in batches:
+            assert list(batch[1]) == list(range(batch[1][0],
+                                                batch[1][0] + len(batch[1])))
+
+
+class TestPagedDataset:
+    def build_function(self, paged, batch_size):
+        X_shared, y_shared = paged.shared
+        batch_index = T.iscalar('batch_index')
+        batch_slice = slice(batch_index * batch_size,
+                            (batch_index + 1) * batch_size)
+        X_batch, y_batch = T.matrix('x'), T.lvector('y')
+        return theano.function(
+            [batch_index], [X_batch[:, 0], y_batch],
+            givens={X_batch: X_shared[batch_slice],
+                    y_batch: y_shared[batch_slice]})
+
+    def check(self, paged, batch_size, shuffle=False):
+        fn = self.build_function(paged, batch_size)
+        X_values, y_values, sizes = [], [], []
+        for num_examples in paged.chunks(shuffle=shuffle,
+                                         rng=np.random.RandomState(1)):
+            sizes.append(num_examples)
+            assert len(paged.shared[0].get_value(borrow=True)) == num_examples
+            for b in range((num_examples + batch_size - 1) // batch_size):
+                X_batch, y_batch = fn(b)
+                X_values.append(X_batch)
+                y_values.append(y_batch)
+        return (sizes, np.concatenate(X_values),
+                np.concatenate(y_values))
+
+    def test_arrays(self, dataset):
+        from lasagne.data import PagedDataset
+        X, y = dataset
+        paged = PagedDataset([X, y], chunk_size=10)
+        assert len(paged) == 23
+        assert paged.shared[0].dtype == theano.config.floatX
+        assert paged.shared[1].dtype == 'int64'
+        sizes, X0, y2 = self.check(paged, 4)
+        assert sizes == [10, 10, 3]
+        assert list(y2) == list(range(23))
+        assert np.all(X0 == y2 * 10)
+
+        sizes, X0, y2 = self.check(paged, 4, shuffle=True)
+        assert sorted(sizes) == [3, 10, 10] and sizes != [10, 10, 3]
+        assert sorted(y2) == list(range(23))
+        assert np.all(X0 == y2 * 10)
+
+    def test_sharded(self, dataset, tmpdir):
+        from lasagne.data import convert_to_shards, PagedDataset
+        X, y = dataset
+        sharded = convert_to_shards([X, y], str(tmpdir),
+                                    max_shard_bytes=10 * 88)
+        paged = PagedDataset(sharded, chunk_size=6)
+        assert len(paged) == 23
+        sizes, X0, y2 = self.check(paged, 5)
+        assert sizes == [6, 4, 6, 4, 3]
+        assert list(y2) == list(range(23))
+        assert np.all(X0 == y2 * 10)
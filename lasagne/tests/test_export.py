@@ -0,0 +1,195 @@
+import numpy as np
+import pytest
+import theano
+import theano.tensor as T
+
+import lasagne.layers as L
+from lasagne import nonlinearities
+from lasagne.init import Normal
+
+
+def dense_net():
+    l_in = L.InputLayer((None, 3, 4, 5))
+    l1 = L.DenseLayer(l_in, num_units=7, nonlinearity=nonlinearities.tanh)
+    l2 = L.DropoutLayer(l1)
+    return L.DenseLayer(l2, num_units=4, nonlinearity=nonlinearities.softmax)
+
+
+def nin_net():
+    l_in = L.InputLayer((None, 3, 4, 5))
+    l1 = L.NINLayer(l_in, num_units=6, b=None)
+    return L.NINLayer(l1, num_units=2, untie_biases=True,
+                      b=Normal(1.0),
+                      nonlinearity=nonlinearities.sigmoid)
+
+
+def conv2d_net(border_mode='valid', stride=1, untie_biases=False):
+    l_in = L.InputLayer((None, 3, 9, 8))
+    return L.Conv2DLayer(l_in, num_filters=4, filter_size=(3, 2),
+                         border_mode=border_mode, stride=stride,
+                         untie_biases=untie_biases, b=Normal(1.0),
+                         nonlinearity=nonlinearities.leaky_rectify)
+
+
+def conv1d_net(border_mode='valid', stride=1, untie_biases=False):
+    l_in = L.InputLayer((None, 3, 11))
+    return L.Conv1DLayer(l_in, num_filters=4, filter_size=4,
+                         border_mode=border_mode, stride=stride,
+                         untie_biases=untie_biases, b=Normal(1.0))
+
+
+def pool_net(ignore_border=True, pad=0, stride=None):
+    l_in = L.InputLayer((None, 2, 7, 8))
+    l1 = L.MaxPool2DLayer(l_in, pool_size=3, stride=stride, pad=pad,
+                          ignore_border=ignore_border)
+    l2 = L.ReshapeLayer(l1, ([0], [1], -1))
+    return L.MaxPool1DLayer(l2, pool_size=2, ignore_border=ignore_border)
+
+
+def feature_pool_net(pool_function=T.max):
+    l_in = L.InputLayer((None, 6, 3, 4))
+    l1 = L.FeaturePoolLayer(l_in, pool_size=3, pool_function=pool_function)
+    return L.GlobalPoolLayer(l1, pool_function=pool_function)
+
+
+def shape_net():
+    l_in = L.InputLayer((None, 2, 3, 4))
+    l1 = L.DimshuffleLayer(l_in, (0, 3, 'x', 1, 2))
+    l2 = L.PadLayer(l1, width=2, val=1.5)
+    l3 = L.FlattenLayer(l2)
+    return L.ReshapeLayer(l3, (-1, [1]))
+
+
+def merge_net():
+    l_in1 = L.InputLayer((None, 4))
+    l_in2 = L.InputLayer((None, 4))
+    l1 = L.DenseLayer(l_in1, num_units=5)
+    l2 = L.DenseLayer(l_in2, num_units=5)
+    l_sum = L.ElemwiseSumLayer([l1, l2, l1], coeffs=[1, -0.5, 2])
+    l_concat = L.ConcatLayer([l_sum, l_in1, l2], axis=1)
+    return L.NonlinearityLayer(l_concat, nonlinearity=nonlinearities.rectify)
+
+
+def lrn_net():
+    l_in = L.InputLayer((None, 7, 3, 4))
+    return L.LocalResponseNormalization2DLayer(l_in, alpha=0.1, k=2,
+                                               beta=0.75, n=5)
+
+
+NETWORKS = [
+    dense_net,
+    nin_net,
+    lambda: conv2d_net('valid'),
+    lambda: conv2d_net('full'),
+    lambda: conv2d_net('same'),
+    lambda: conv2d_net('valid', stride=2, untie_biases=True),
+    lambda: conv2d_net('full', stride=(2, 3)),
+    lambda: conv1d_net('valid'),
+    lambda: conv1d_net('full', stride=3),
+    lambda: conv1d_net('same', untie_biases=True),
+    lambda: pool_net(),
+    lambda: pool_net(ignore_border=False),
+    lambda: pool_net(ignore_border=False, stride=2),
+    lambda: pool_net(pad=1, stride=2),
+    feature_pool_net,
+    lambda: feature_pool_net(T.mean),
+    lambda: feature_pool_net(T.sum),
+    shape_net,
+    merge_net,
+    lrn_net,
+]
+
+
+def random_inputs(network, batch_size, seed=0):
+    rng = np.random.RandomState(seed)
+    input_layers = [layer for layer in L.get_all_layers(network)
+                    if isinstance(layer, L.InputLayer)]
+    return [rng.randn(batch_size, *layer.shape[1:]).astype(
+        layer.input_var.dtype) for layer in input_layers]
+
+
+@pytest.mark.parametrize('build', NETWORKS)
+def test_export_matches_theano(build):
+    from lasagne.export import export_network
+    network = build()
+    input_vars = [layer.input_var for layer in L.get_all_layers(network)
+                  if isinstance(layer, L.InputLayer)]
+    predict = theano.function(input_vars,
+                              L.get_output(network, deterministic=True))
+    predictor = export_network(network)
+    for batch_size in (5, 2, 5):
+        inputs = random_inputs(network, batch_size, seed=batch_size)
+        expected = predict(*inputs)
+        result = predictor.predict(*inputs)
+        assert result.shape == expected.shape
+        assert np.allclose(result, expected, rtol=1e-5, atol=1e-6)
+
+
+def test_save_load(tmpdir):
+    from lasagne.export import export_network
+    from lasagne.runtime import load
+    network = merge_net()
+    l_out = L.DenseLayer(network, num_units=2)
+    inputs = random_inputs(network, 3)
+    filename = str(tmpdir.join('model.npz'))
+    predictor = export_network([network, l_out], filename)
+    expected = predictor.predict(*inputs)
+    loaded = load(filename)
+    result = loaded.predict(*inputs)
+    assert len(result) == 2
+    for output, expected_output in zip(result, expected):
+        assert np.all(output == expected_output)
+    # the outputs are not overwritten by the next call
+    loaded.predict(*random_inputs(network, 3, seed=1))
+    assert np.all(result[1] == expected[1])
+    with pytest.raises(ValueError):
+        loaded.predict(inputs[0])
+    with pytest.raises(ValueError):
+        loaded.predict(inputs[0][:, :3], inputs[1])
+
+
+def test_export_copies_params():
+    from lasagne.export import export_network
+    network = dense_net()
+    inputs = random_inputs(network, 3)
+    predictor = export_network(network)
+    expected = predictor.predict(*inputs)
+    network.W.set_value(np.zeros_like(network.W.get_value()))
+    assert np.all(predictor.predict(*inputs) == expected)
+
+
+def test_export_unsupported():
+    from lasagne.export import export_network
+    l_in = L.InputLayer((None, 4))
+    with pytest.raises(NotImplementedError):
+        export_network(L.FeatureWTALayer(l_in, pool_size=2))
+    with pytest.raises(NotImplementedError):
+        export_network(L.DenseLayer(l_in, num_units=2,
+                                    nonlinearity=T.nnet.softplus))
+
+
+def test_runtime_without_theano(tmpdir):
+    import os
+    import subprocess
+    import sys
+    import lasagne
+    from lasagne.export import export_network
+    network = dense_net()
+    filename = str(tmpdir.join('network.npz'))
+    export_network(network, filename)
+    X = np.random.RandomState(0).randn(2, 3, 4, 5)
+    np.save(str(tmpdir.join('X.npy')), X)
+    expected = L.get_output(network, X, deterministic=True).eval()
+    np.save(str(tmpdir.join('expected.npy')), expected)
+    # importing the runtime must neither need nor import theano
+    script = ("import sys\n"
+              "sys.modules['theano'] = None\n"
+              "import numpy as np\n"
+              "from lasagne.runtime import load\n"
+              "predictor = load(%r)\n"
+              "output = predictor.predict(np.load(%r))\n"
+              "assert np.allclose(output, np.load(%r))\n" %
+              (filename, str(tmpdir.join('X.npy')),
+               str(tmpdir.join('expected.npy'))))
+    root = os.path.dirname(os.path.dirname(os.path.abspath(lasagne.__file__)))
+    subprocess.check_call([sys.executable, '-E', '-c', script], cwd=root)
@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+import theano
+import theano.tensor as T
+
+from lasagne.utils import floatX
+
+
+def build_network():
+    from lasagne.layers import InputLayer, DenseLayer
+    l_in = InputLayer((10, 20))
+    l_hid = DenseLayer(l_in, num_units=30, name='hidden')
+    return DenseLayer(l_hid, num_units=5, nonlinearity=None, name='output')
+
+
+class TestParamBuffer:
+    @pytest.fixture
+    def network(self):
+        return build_network()
+
+    @pytest.fixture
+    def buffer(self, network):
+        from lasagne.layers import get_all_params
+        from lasagne.flat import ParamBuffer
+        return ParamBuffer(get_all_params(network))
+
+    def test_layout(self, network, buffer):
+        from lasagne.layers import get_all_params
+        params = get_all_params(network)
+        assert buffer.params == params
+        assert len(buffer) == 20 * 30 + 30 + 30 * 5 + 5
+        storage = buffer.flat.get_value(borrow=True)
+        for param, start in zip(params, buffer.offsets):
+            value = param.get_value(borrow=True)
+            assert np.may_share_memory(value, storage)
+            assert np.all(value.ravel() ==
+                          storage[start:start + value.size])
+
+    def test_set_value(self, network, buffer):
+        from lasagne.layers import get_all_param_values
+        value = floatX(np.arange(len(buffer)))
+        buffer.set_value(value)
+        assert np.all(buffer.get_value() == value)
+        assert np.all(get_all_param_values(network)[1] ==
+                      value[600:630])
+        with pytest.raises(ValueError):
+            buffer.set_value(value[:-1])
+
+    def test_storage(self, network):
+        from lasagne.layers import get_all_params, get_all_param_values
+        from lasagne.flat import ParamBuffer
+        params = get_all_params(network)
+        values = get_all_param_values(network)
+        storage = np.zeros(785, dtype=theano.config.floatX)
+        buffer = ParamBuffer(params, storage=storage)
+        assert buffer.flat.get_value(borrow=True) is storage
+        assert np.all(storage == np.concatenate([v.ravel() for v in values]))
+        with pytest.raises(ValueError):
+            ParamBuffer(params, storage=storage[:-1])
+
+    def test_mixed_dtypes(self):
+        from lasagne.flat import ParamBuffer
+        with pytest.raises(ValueError):
+            ParamBuffer([theano.shared(np.zeros(3, dtype='float32')),
+                         theano.shared(np.zeros(3, dtype='float64'))])
+
+    @pytest.mark.parametrize('method', ['sgd', 'adagrad', 'momentum'])
+    def test_updates_match(self, network, buffer, method):
+        from lasagne import updates as lu
+        from lasagne.layers import get_all_params, get_all_param_values
+        kwargs = {'learning_rate': 0.1}
+        update_fn = getattr(lu, method)
+
+        network2 = build_network()
+        params2 = get_all_params(network2)
+        for param, value in zip(params2, get_all_param_values(network)):
+            param.set_value(value)
+
+        x = T.matrix('x')
+        loss = (network.get_output(x) ** 2).mean()
+        loss2 = (network2.get_output(x) ** 2).mean()
+        updates = update_fn(buffer.get_grads(loss), [buffer.flat], **kwargs)
+        assert buffer.flat in updates
+        assert len(updates) in (1, 2)
+        train_fn = theano.function([x], loss, updates=updates,
+                                   givens=buffer.givens)
+        train_fn2 = theano.function([x], loss2,
+                                    updates=update_fn(loss2, params2,
+                                                      **kwargs))
+        inputs = floatX(np.random.randn(10, 20))
+        for _ in range(3):
+            assert np.allclose(train_fn(inputs), train_fn2(inputs))
+        buffer.scatter()
+        for value, value2 in zip(get_all_param_values(network),
+                                 get_all_param_values(network2)):
+            assert np.allclose(value, value2)
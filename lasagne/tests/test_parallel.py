@@ -0,0 +1,169 @@
+import numpy as np
+import pytest
+import theano
+import theano.tensor as T
+
+
+def build_network():
+    from lasagne.layers import InputLayer, DenseLayer
+    rng = np.random.RandomState(42)
+    l_in = InputLayer((None, 8))
+    l_hid = DenseLayer(l_in, num_units=6, W=rng.randn(8, 6))
+    return DenseLayer(l_hid, num_units=2, nonlinearity=None,
+                      W=rng.randn(6, 2))
+
+
+@pytest.fixture
+def data():
+    rng = np.random.RandomState(0)
+    return (rng.randn(23, 8).astype(theano.config.floatX),
+            rng.randn(23, 2).astype(theano.config.floatX))
+
+
+def build_loss(network):
+    x, t = T.matrix('x'), T.matrix('t')
+    return [x, t], ((network.get_output(x) - t) ** 2).mean()
+
+
+class TestDataParallelTrainer:
+    @pytest.mark.parametrize('num_workers', [1, 3])
+    @pytest.mark.parametrize('method', ['sgd', 'adagrad'])
+    def test_matches_sequential(self, data, num_workers, method):
+        import lasagne.updates
+        from lasagne.layers import get_all_params, get_all_param_values
+        from lasagne.parallel import DataParallelTrainer
+        update_fn = getattr(lasagne.updates, method)
+
+        network = build_network()
+        inputs, loss = build_loss(network)
+        params = get_all_params(network)
+        train_fn = theano.function(inputs, loss,
+                                   updates=update_fn(loss, params,
+                                                     learning_rate=0.1))
+
+        network2 = build_network()
+        inputs2, loss2 = build_loss(network2)
+        with DataParallelTrainer(inputs2, loss2, get_all_params(network2),
+                                 update_fn, num_workers=num_workers,
+                                 learning_rate=0.1) as trainer:
+            for _ in range(3):
+                expected = train_fn(*data)
+                assert np.allclose(trainer.train(*data), expected)
+            # batches smaller than the number of workers
+            expected = train_fn(data[0][:2], data[1][:2])
+            assert np.allclose(trainer.train(data[0][:2], data[1][:2]),
+                               expected)
+
+        for value, value2 in zip(get_all_param_values(network),
+                                 get_all_param_values(network2)):
+            assert np.allclose(value, value2)
+
+    def test_errors(self, data):
+        from lasagne.layers import get_all_params
+        from lasagne.parallel import DataParallelTrainer
+        from lasagne.updates import sgd
+        network = build_network()
+        inputs, loss = build_loss(network)
+        trainer = DataParallelTrainer(inputs, loss, get_all_params(network),
+                                      sgd, num_workers=2, learning_rate=0.1)
+        with pytest.raises(ValueError):
+            trainer.train(data[0])
+        with pytest.raises(ValueError):
+            trainer.train(data[0][:0], data[1][:0])
+        with pytest.raises(RuntimeError):
+            trainer.train(data[0][:, :3], data[1])
+        # the workers survive errors
+        trainer.train(*data)
+        trainer.close()
+        with pytest.raises(RuntimeError):
+            trainer.train(*data)
+        # a learning rate passed as positional argument
+        with pytest.raises(ValueError):
+            DataParallelTrainer(inputs, loss, get_all_params(network), sgd,
+                                0.1)
+
+
+class TestHogwildTrainer:
+    def test_single_worker_matches_sequential(self, data):
+        from lasagne.layers import get_all_params, get_all_param_values
+        from lasagne.parallel import HogwildTrainer
+        from lasagne.updates import momentum
+
+        network = build_network()
+        inputs, loss = build_loss(network)
+        train_fn = theano.function(
+            inputs, loss, updates=momentum(loss, get_all_params(network),
+                                           learning_rate=0.01))
+        losses = []
+        for _ in range(2):
+            for start in range(0, 23, 5):
+                losses.append(train_fn(data[0][start:start + 5],
+                                       data[1][start:start + 5]))
+
+        network2 = build_network()
+        inputs2, loss2 = build_loss(network2)
+        with HogwildTrainer(inputs2, loss2, get_all_params(network2),
+                            momentum, num_workers=1,
+                            learning_rate=0.01) as trainer:
+            stats = trainer.train(data, batch_size=5, num_epochs=2)
+        assert stats['updates'] == 10
+        assert np.allclose(stats['loss'], np.mean(losses))
+        assert stats['mean_staleness'] == stats['max_staleness'] == 0
+        assert stats['examples_per_second'] > 0
+        for value, value2 in zip(get_all_param_values(network),
+                                 get_all_param_values(network2)):
+            assert np.allclose(value, value2)
+
+    def test_multiple_workers(self):
+        from lasagne.layers import InputLayer, DenseLayer, get_all_params
+        from lasagne.parallel import HogwildTrainer
+        from lasagne.updates import sgd
+        rng = np.random.RandomState(0)
+        W = rng.randn(8, 2)
+        X = rng.randn(300, 8).astype(theano.config.floatX)
+        y = np.dot(X, W).astype(theano.config.floatX)
+
+        l_in = InputLayer((None, 8))
+        l_out = DenseLayer(l_in, num_units=2, nonlinearity=None)
+        x, t = T.matrix('x'), T.matrix('t')
+        loss = ((l_out.get_output(x) - t) ** 2).mean()
+        with HogwildTrainer([x, t], loss, get_all_params(l_out), sgd,
+                            num_workers=3, learning_rate=0.05) as trainer:
+            first = trainer.train([X, y], batch_size=10)
+            for _ in range(5):
+                stats = trainer.train([X, y], batch_size=10)
+            with pytest.raises(ValueError):
+                trainer.train([X[:0], y[:0]], batch_size=10)
+        assert stats['updates'] == 30
+        assert stats['loss'] < first['loss'] / 10
+        assert stats['max_staleness'] >= stats['mean_staleness'] >= 0
+        assert np.allclose(l_out.W.get_value(), W, atol=0.1)
+
+    def test_update_arguments(self, data):
+        from lasagne.layers import get_all_params, get_all_param_values
+        from lasagne.parallel import HogwildTrainer
+        from lasagne.updates import momentum
+        network = build_network()
+        inputs, loss = build_loss(network)
+        train_fn = theano.function(
+            inputs, loss, updates=momentum(loss, get_all_params(network),
+                                           learning_rate=0.01,
+                                           momentum=0.5))
+        # the momentum only shows from the second update on
+        train_fn(*data)
+        train_fn(*data)
+
+        # the arguments of the update rule are passed by keyword
+        network2 = build_network()
+        inputs2, loss2 = build_loss(network2)
+        with HogwildTrainer(inputs2, loss2, get_all_params(network2),
+                            momentum, num_workers=1, learning_rate=0.01,
+                            momentum=0.5) as trainer:
+            trainer.train(data, batch_size=23, num_epochs=2)
+        for value, value2 in zip(get_all_param_values(network),
+                                 get_all_param_values(network2)):
+            assert np.allclose(value, value2)
+        # a learning rate passed as positional argument
+        with pytest.raises(ValueError):
+            HogwildTrainer(inputs2, loss2, get_all_params(network2),
+                           momentum, 0.01)
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+import theano
+
+
+@pytest.fixture
+def network():
+    import lasagne.layers as L
+    l_in = L.InputLayer((None, 2, 6, 6))
+    l_conv = L.Conv2DLayer(l_in, num_filters=4, filter_size=3)
+    l_pool = L.MaxPool2DLayer(l_conv, pool_size=2)
+    l_nin = L.NINLayer(l_pool, num_units=3)
+    l_drop = L.DropoutLayer(l_nin)
+    return L.DenseLayer(l_drop, num_units=5, nonlinearity=None)
+
+
+@pytest.fixture
+def data():
+    rng = np.random.RandomState(42)
+    return rng.randn(50, 2, 6, 6).astype(theano.config.floatX)
+
+
+def test_calibrate(network, data):
+    import lasagne.layers as L
+    from lasagne.quantization import calibrate
+    layers = L.get_all_layers(network)
+    scales = calibrate(network, data, batch_size=16)
+    assert list(scales.keys()) == [layers[1], layers[3], network]
+    assert np.isclose(scales[layers[1]], np.abs(data).max() / 127)
+    nin_input = L.get_output(layers[2], data).eval()
+    assert np.isclose(scales[layers[3]], np.abs(nin_input).max() / 127)
+    assert calibrate(network, data, percentile=50)[layers[1]] < \
+        scales[layers[1]]
+
+
+def test_quantize_network(network, data):
+    import lasagne.layers as L
+    from lasagne.quantization import calibrate, quantize_network
+    quantized = quantize_network(network, calibrate(network, data))
+    layers = L.get_all_layers(network)
+    quantized_layers = L.get_all_layers(quantized)
+    assert [type(layer).__name__ for layer in quantized_layers] == [
+        'InputLayer', 'QuantizedConv2DLayer', 'MaxPool2DLayer',
+        'QuantizedNINLayer', 'DropoutLayer', 'QuantizedDenseLayer']
+    assert quantized_layers[0] is layers[0]
+    assert quantized_layers[2] is not layers[2]
+    assert quantized_layers[1].input_scale > 0
+    # the original network is unchanged
+    assert L.get_all_layers(network) == layers
+    assert all(layer.input_layer is parent for layer, parent
+               in zip(layers[1:], layers[:-1]))
+
+    expected = L.get_output(network, data, deterministic=True).eval()
+    output = L.get_output(quantized, data, deterministic=True).eval()
+    assert np.allclose(output, expected, atol=0.05 * np.abs(expected).max())
+    weight_only = quantize_network([layers[3], network])
+    assert weight_only[0].input_scale is None
+    assert L.get_all_layers(weight_only[1])[3] is weight_only[0]
+
+
+def test_evaluate_quantization(network, data):
+    from lasagne.quantization import quantize_network, evaluate_quantization
+    from lasagne.layers import get_output
+    quantized = quantize_network(network)
+    targets = get_output(network, data, deterministic=True).eval().argmax(1)
+    targets[:10] = (targets[:10] + 1) % 5
+    report = evaluate_quantization(network, quantized, data, targets,
+                                   batch_size=16)
+    assert report['accuracy'] == 0.8
+    assert report['agreement'] > 0.9
+    assert np.isclose(report['accuracy_delta'],
+                      report['quantized_accuracy'] - report['accuracy'])
+    assert report['max_abs_error'] >= report['mean_abs_error'] > 0
+    assert report['relative_error'] < 0.05
+    itemsize = np.dtype(theano.config.floatX).itemsize
+    num_weights = 4 * 2 * 9 + 4 * 3 + 3 * 4 * 5
+    assert report['weight_bytes'] == num_weights * itemsize
+    assert report['quantized_weight_bytes'] == (num_weights +
+                                                (4 + 3 + 5) * itemsize)
+    one_hot = np.eye(5)[targets]
+    report = evaluate_quantization(network, quantized, data, one_hot)
+    assert report['accuracy'] == 0.8
@@ -0,0 +1,143 @@
+import threading
+
+import numpy as np
+import pytest
+import theano
+
+
+@pytest.fixture
+def network():
+    from lasagne.layers import InputLayer, DenseLayer
+    l_in = InputLayer((None, 5))
+    return DenseLayer(l_in, num_units=3)
+
+
+def test_predict(network):
+    from lasagne.layers import get_output
+    from lasagne.serving import InferenceEngine
+    X = np.random.RandomState(0).randn(40, 5).astype(theano.config.floatX)
+    expected = theano.function([network.input_layer.input_var],
+                               get_output(network))(X)
+    results = [None] * len(X)
+    with InferenceEngine(network, max_batch_size=8,
+                         max_latency=0.05) as engine:
+        def request(idx):
+            results[idx] = engine.predict(X[idx])
+        threads = [threading.Thread(target=request, args=(idx,))
+                   for idx in range(len(X))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert engine.num_requests == len(X)
+        # requests have been coalesced into batches
+        assert engine.num_batches < len(X)
+        assert set(engine.function.variants) <= set([1, 2, 4, 8])
+    assert np.allclose(np.asarray(results), expected)
+    with pytest.raises(RuntimeError):
+        engine.predict(X[0])
+
+
+def test_multiple_inputs_and_outputs():
+    from lasagne.layers import InputLayer, DenseLayer, ElemwiseSumLayer
+    from lasagne.serving import InferenceEngine
+    l_in1 = InputLayer((None, 5))
+    l_in2 = InputLayer((None, 5))
+    l_sum = ElemwiseSumLayer([l_in1, l_in2])
+    l_out = DenseLayer(l_sum, num_units=2)
+    with InferenceEngine([l_sum, l_out]) as engine:
+        x1, x2 = np.ones(5), np.arange(5.0)
+        summed, out = engine.predict(x1, x2)
+        assert np.allclose(summed, x1 + x2)
+        assert out.shape == (2,)
+        with pytest.raises(ValueError):
+            engine.predict(x1)
+
+
+def test_errors(network):
+    from lasagne.serving import InferenceEngine
+    with InferenceEngine(network) as engine:
+        with pytest.raises(ValueError):
+            engine.predict(np.ones(4))
+        # the engine keeps serving after an error
+        assert engine.predict(np.ones(5)).shape == (3,)
+
+
+def test_failing_callback(network, caplog):
+    from lasagne.serving import InferenceEngine
+    results = []
+
+    def failing_callback(result, error):
+        raise RuntimeError("callback failed")
+    with InferenceEngine(network, max_latency=0.05) as engine:
+        engine.submit([np.ones(5)], failing_callback)
+        engine.submit([np.ones(5)], lambda result, error: results.append(
+            result))
+        # the engine keeps serving, including the rest of the batch
+        assert engine.predict(np.ones(5)).shape == (3,)
+    assert len(results) == 1
+    assert "callback failed" in caplog.text
+
+
+def test_invalid_requests(network):
+    from lasagne.layers import InputLayer
+    from lasagne.serving import InferenceEngine
+    with InferenceEngine(network) as engine:
+        with pytest.raises(ValueError):
+            engine.submit([np.ones((5, 1))], None)
+        with pytest.raises(TypeError):
+            engine.submit([np.array(['a'] * 5)], None)
+    # requests that cannot be batched are computed one by one
+    l_in = InputLayer((None, None))
+    results = {}
+    done = threading.Event()
+
+    def callback(idx):
+        def store(result, error):
+            results[idx] = (result, error)
+            if len(results) == 3:
+                done.set()
+        return store
+    with InferenceEngine(l_in, max_latency=0.1) as engine:
+        engine.submit([np.ones(3)], callback(0))
+        engine.submit([np.ones(4)], callback(1))
+        engine.submit([np.ones(3)], callback(2))
+        done.wait()
+        assert engine.num_requests == 3
+    for idx, size in enumerate([3, 4, 3]):
+        assert np.all(results[idx][0] == np.ones(size))
+        assert results[idx][1] is None
+
+
+def test_close(network):
+    from lasagne.serving import InferenceEngine, _Request, _STOP
+    engine = InferenceEngine(network)
+    engine.close()
+    with pytest.raises(RuntimeError):
+        engine.submit([np.ones(5)], None)
+    engine.close()
+    # requests that arrived after the background thread stopped are failed
+    engine = InferenceEngine(network)
+    engine._requests.put(_STOP)
+    engine._thread.join()
+    errors = []
+    engine._requests.put(_Request([np.ones(5)], lambda result, error:
+                                  errors.append(error)))
+    engine.close()
+    assert len(errors) == 1 and isinstance(errors[0], RuntimeError)
+
+
+def test_predict_async(network):
+    asyncio = pytest.importorskip('asyncio')
+    from lasagne.serving import InferenceEngine
+    X = np.random.RandomState(0).randn(10, 5).astype(theano.config.floatX)
+    loop = asyncio.new_event_loop()
+    with InferenceEngine(network, max_latency=0.05) as engine:
+        expected = [engine.predict(x) for x in X]
+        futures = [engine.predict_async(x, loop=loop) for x in X]
+        results = loop.run_until_complete(asyncio.gather(*futures))
+        future = engine.predict_async(np.ones(4), loop=loop)
+        with pytest.raises(ValueError):
+            loop.run_until_complete(future)
+    loop.close()
+    assert np.allclose(results, expected)
@@ -62,3 +62,187 @@ def test_norm_constraint_dim6_raises():
     with pytest.raises(ValueError) as excinfo:
         norm_constraint(param, max_norm)
     assert "Unsupported tensor dimensionality" in str(excinfo.value)
+
+
+@pytest.mark.parametrize('method, kwargs', [
+    ('sgd', {'learning_rate': 0.1}),
+    ('momentum', {'learning_rate': 0.1, 'momentum': 0.5}),
+    ('nesterov_momentum', {'learning_rate': 0.1, 'momentum': 0.5}),
+    ('adagrad', {'learning_rate': 0.1}),
+    ('rmsprop', {'learning_rate': 0.01}),
+    ('adadelta', {}),
+])
+def test_fused(method, kwargs):
+    from mock import patch
+    import numpy as np
+    import theano
+    import theano.tensor as T
+    import lasagne.updates
+    from lasagne.updates import fused
+
+    def make_params():
+        rng = np.random.RandomState(42)
+        return [theano.shared(rng.randn(4, 3).astype(theano.config.floatX)),
+                theano.shared(rng.randn(3).astype(theano.config.floatX)),
+                theano.shared(rng.randn(3, 2).astype(theano.config.floatX)),
+                theano.shared(rng.randn(2).astype(theano.config.floatX),
+                              broadcastable=(False,))]
+
+    def make_loss(params):
+        W1, b1, W2, b2 = params
+        x = theano.shared(np.arange(8.0).reshape(2, 4))
+        h = T.tanh(T.dot(x, W1) + b1)
+        return ((T.dot(h, W2) + b2) ** 2).sum()
+
+    update_fn = getattr(lasagne.updates, method)
+    params = make_params()
+    params_fused = make_params()
+    updates = update_fn(make_loss(params), params, **kwargs)
+    loss_fused = make_loss(params_fused)
+    with patch('theano.shared', wraps=theano.shared) as shared:
+        updates_fused = fused(update_fn, loss_fused, params_fused, **kwargs)
+    assert list(updates_fused.keys())[:4] == params_fused
+    # one flat accumulator per kind of state
+    num_state = (len(updates) - 4) // 4
+    assert len(updates_fused) == 4 + num_state
+    # no other shared variables, such as a copy of the params, are created
+    assert shared.call_count == num_state
+
+    step = theano.function([], [], updates=updates)
+    step_fused = theano.function([], [], updates=updates_fused)
+    for _ in range(3):
+        step()
+        step_fused()
+    for param, param_fused in zip(params, params_fused):
+        assert param.dtype == param_fused.dtype
+        assert np.allclose(param.get_value(), param_fused.get_value(),
+                           rtol=1e-4)
+
+
+def test_fused_groups_dtypes():
+    import numpy as np
+    import theano
+    from lasagne.updates import fused, adagrad
+    params = [theano.shared(np.ones(3, dtype='float32'), name='a'),
+              theano.shared(np.ones(3, dtype='float64'), name='b'),
+              theano.shared(np.ones(3, dtype='float32'), name='c')]
+    loss = sum(param.sum() for param in params)
+    updates = fused(adagrad, loss, params)
+    assert list(updates.keys())[:3] == params
+    assert [var.name for var in list(updates.keys())[3:]] == [
+        'fused.float32.accu', 'fused.float64.accu']
+    assert [var.get_value().shape for var in list(updates.keys())[3:]] == [
+        (6,), (3,)]
+
+
+@pytest.mark.parametrize('method', ['sgd', 'adagrad', 'fused_rmsprop'])
+def test_gradient_accumulator(method):
+    import numpy as np
+    import theano
+    import theano.tensor as T
+    import lasagne.updates
+    from lasagne.updates import GradientAccumulator, OptimizerState, fused
+    from lasagne.layers import InputLayer, DenseLayer, get_all_params
+
+    if method.startswith('fused_'):
+        def update_fn(loss_or_grads, params, **kwargs):
+            return fused(getattr(lasagne.updates, method[6:]),
+                         loss_or_grads, params, **kwargs)
+    else:
+        update_fn = getattr(lasagne.updates, method)
+
+    def build_network():
+        l_in = InputLayer((None, 4))
+        l_out = DenseLayer(l_in, num_units=3, nonlinearity=None,
+                           W=np.ones((4, 3)), b=np.arange(3.0))
+        return l_out, get_all_params(l_out)
+
+    rng = np.random.RandomState(42)
+    inputs = rng.randn(20, 4).astype(theano.config.floatX)
+    targets = rng.randn(20, 3).astype(theano.config.floatX)
+    x, t = T.matrix('x'), T.matrix('t')
+
+    # reference: one update on the whole batch
+    l_out, params = build_network()
+    loss = ((l_out.get_output(x) - t) ** 2).mean()
+    step = theano.function([x, t], loss,
+                           updates=update_fn(loss, params,
+                                             learning_rate=0.1))
+    step(inputs, targets)
+
+    # accumulate over four micro-batches
+    l_out2, params2 = build_network()
+    loss2 = ((l_out2.get_output(x) - t) ** 2).mean()
+    accumulator = GradientAccumulator(loss2, params2)
+    micro_step = theano.function([x, t], loss2, updates=accumulator.updates)
+    apply_step = theano.function(
+        [], updates=accumulator.apply(update_fn, learning_rate=0.1))
+    state = OptimizerState(accumulator.updates)
+    assert list(state.variables.keys())[-1] == 'grad_count'
+    for idx in range(0, 20, 5):
+        micro_step(inputs[idx:idx + 5], targets[idx:idx + 5])
+    assert accumulator.count.get_value() == 4
+    assert np.any(accumulator.accumulators[0].get_value() != 0)
+    apply_step()
+    assert accumulator.count.get_value() == 0
+    assert np.all(accumulator.accumulators[0].get_value() == 0)
+    for param, param2 in zip(params, params2):
+        assert np.allclose(param.get_value(), param2.get_value())
+
+
+class TestOptimizerState:
+    @pytest.fixture
+    def params(self):
+        import numpy as np
+        import theano
+        return [theano.shared(np.ones((2, 3), dtype=theano.config.floatX),
+                              name='W'),
+                theano.shared(np.ones(3, dtype=theano.config.floatX),
+                              name='b'),
+                theano.shared(np.ones(3, dtype=theano.config.floatX),
+                              name='b'),
+                theano.shared(np.ones(3, dtype=theano.config.floatX))]
+
+    def test_names(self, params):
+        import theano.tensor as T
+        from lasagne.updates import adadelta, OptimizerState
+        loss = sum(T.sum(p) for p in params)
+        state = OptimizerState(adadelta(loss, params))
+        assert list(state.variables.keys()) == [
+            'W.accu', 'W.delta_accu', 'b.accu', 'b.delta_accu',
+            'b.accu_1', 'b.delta_accu_1', 'state6', 'state7']
+        assert len(state) == 8
+        assert state['W.accu'].get_value().shape == (2, 3)
+
+    def test_params_argument(self, params):
+        import theano
+        import theano.tensor as T
+        from lasagne.updates import sgd, OptimizerState
+        counter = theano.shared(0)
+        updates = sgd(sum(T.sum(p) for p in params), params, 0.1)
+        updates[counter] = counter + 1
+        assert len(OptimizerState(updates)) == 0
+        state = OptimizerState(updates, params)
+        assert list(state.variables.values()) == [counter]
+
+    def test_get_set_values(self, params):
+        import numpy as np
+        import theano
+        import theano.tensor as T
+        from lasagne.updates import rmsprop, OptimizerState
+        loss = sum(T.sum(p ** 2) for p in params)
+        updates = rmsprop(loss, params)
+        state = OptimizerState(updates)
+        theano.function([], loss, updates=updates)()
+        values = state.get_values()
+        assert all(np.all(v > 0) for v in values.values())
+
+        state2 = OptimizerState(rmsprop(loss, params))
+        state2.set_values(values)
+        for name, value in values.items():
+            assert np.all(state2[name].get_value() == value)
+        state2.set_values(list(values.values()))
+        with pytest.raises(ValueError):
+            state2.set_values({})
+        with pytest.raises(ValueError):
+            state2.set_values([])
@@ -38,3 +38,30 @@ def test_compute_norms_ndim6_raises():
         compute_norms(array)
 
     assert "Unsupported tensor dimensionality" in str(excinfo.value)
+
+
+def test_unique():
+    from lasagne.utils import unique
+    assert unique([3, 1, 3, 2, 1]) == [3, 1, 2]
+    assert unique(iter('abcab')) == ['a', 'b', 'c']
+
+
+def test_upcast():
+    import numpy as np
+    import theano
+    import theano.tensor as T
+    from lasagne.utils import upcast
+
+    x = T.matrix(dtype=theano.config.floatX)
+    assert upcast(x) is x
+    x = T.matrix(dtype='float16')
+    y = upcast(x, 'float32')
+    assert y.dtype == 'float32'
+    f = theano.function([x], [y, T.grad(y.sum(), x), y.shape])
+    value = np.random.randn(3, 4).astype('float16')
+    result, grad, shape = f(value)
+    assert result.dtype == 'float32'
+    assert np.all(result == value)
+    assert grad.dtype == 'float16'
+    assert np.all(grad == 1)
+    assert tuple(shape) == (3, 4)
@@ -2,10 +2,21 @@
 Alternative convolution implementations for Theano
 """
 
+from collections import OrderedDict
+import json
+import os
+import tempfile
+import timeit
+import warnings
+
 import numpy as np
 
+import theano
 import theano.tensor as T
 
+from ..utils import as_tuple
+from .padding import pad
+
 
 # 1D convolutions
 
@@ -256,6 +267,883 @@ def conv1d_md(input, filters, image_shape, filter_shape, border_mode='valid',
 
 # TODO: conv1d_md_channelslast?
 
+
+class Conv1DAutotuner(object):
+    """
+    1D convolution that uses the fastest of a set of implementations
+
+    An instance can be passed as the `convolution` of
+    :class:`lasagne.layers.Conv1DLayer`. The first time it is called for a
+    combination of image shape, filter shape, border mode, stride and
+    dtype, it compiles and times all the implementations that support the
+    convolution, and uses the fastest one from then on. The choices are
+    stored in a JSON file, so the benchmark is run only once per machine.
+
+    If the image or filter shape is not fully known, for example for a
+    variable batch size, `fallback` is used instead.
+
+    Parameters
+    ----------
+    cache_file : str or None
+        The JSON file to store the choices in. If None, the choices are only
+        kept in memory.
+    candidates : list of callable or None
+        The implementations to choose from, by default
+        :func:`conv1d_sc`, :func:`conv1d_mc0`, :func:`conv1d_mc1`,
+        :func:`conv1d_unstrided`, :func:`conv1d_sd` and :func:`conv1d_md`.
+        Implementations raising an error for the given convolution, or
+        computing a different output than `fallback`, are skipped.
+    fallback : callable
+        The implementation to use if the shapes are not known, and to
+        compare the output of the others with.
+    with_grad : bool
+        Whether to time the gradients as well, as for training, or only the
+        output, as for prediction.
+    repeat : int
+        The number of calls to time each implementation with. The fastest
+        call counts.
+
+    Attributes
+    ----------
+    timings : dict
+        The time of a call of each of the implementations benchmarked by
+        this instance, for each convolution, keyed as the cache file.
+    """
+    def __init__(self, cache_file=None, candidates=None, fallback=conv1d_mc0,
+                 with_grad=True, repeat=5):
+        self.cache_file = cache_file
+        if candidates is None:
+            candidates = [conv1d_sc, conv1d_mc0, conv1d_mc1,
+                          conv1d_unstrided, conv1d_sd, conv1d_md]
+        self.candidates = OrderedDict((fn.__name__, fn) for fn in candidates)
+        self.fallback = fallback
+        self.with_grad = with_grad
+        self.repeat = repeat
+        self.timings = {}
+        self._choices = None
+
+    def _load(self):
+        if self.cache_file is None or not os.path.exists(self.cache_file):
+            return {}
+        try:
+            with open(self.cache_file) as f:
+                return json.load(f)
+        except Exception as e:
+            warnings.warn("Could not load the tuning cache %s, it will be "
+                          "rebuilt (original exception: %s)" %
+                          (self.cache_file, e))
+            return {}
+
+    def _store(self, key, name):
+        if self.cache_file is None:
+            return
+        # merge with the choices stored by other processes in the meantime
+        choices = self._load()
+        choices[key] = name
+        directory = os.path.dirname(os.path.abspath(self.cache_file))
+        tmp_path = None
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(choices, f, indent=0, sort_keys=True)
+            # renaming is atomic, so other processes never see partial files
+            os.rename(tmp_path, self.cache_file)
+        except Exception as e:
+            warnings.warn("Could not store the tuning cache %s (original "
+                          "exception: %s)" % (self.cache_file, e))
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def choice(self, image_shape, filter_shape, border_mode='valid',
+               subsample=(1,), dtype=None):
+        """
+        Returns the fastest implementation for the given convolution,
+        benchmarking the candidates if it is not known yet, or `fallback`
+        if the shapes are not fully known.
+        """
+        if (image_shape is None or filter_shape is None or
+                None in image_shape or None in filter_shape):
+            return self.fallback
+        image_shape = tuple(int(size) for size in image_shape)
+        filter_shape = tuple(int(size) for size in filter_shape)
+        subsample = tuple(int(s) for s in subsample)
+        dtype = np.dtype(dtype or theano.config.floatX).name
+        key = repr((image_shape, filter_shape, border_mode, subsample, dtype,
+                    self.with_grad, theano.config.device))
+        if self._choices is None:
+            self._choices = self._load()
+        name = self._choices.get(key)
+        if name not in self.candidates:
+            timings = self._benchmark(image_shape, filter_shape,
+                                      border_mode, subsample, dtype)
+            self.timings[key] = timings
+            if not timings:
+                return self.fallback
+            name = min(timings, key=timings.get)
+            self._choices[key] = name
+            self._store(key, name)
+        return self.candidates[name]
+
+    def _benchmark(self, image_shape, filter_shape, border_mode, subsample,
+                   dtype):
+        rng = np.random.RandomState(42)
+        input = theano.shared(rng.randn(*image_shape).astype(dtype))
+        filters = theano.shared(rng.randn(*filter_shape).astype(dtype))
+        expected = None
+        timings = OrderedDict()
+        for name, fn in [(None, self.fallback)] + list(
+                self.candidates.items()):
+            try:
+                conved = fn(input, filters, image_shape, filter_shape,
+                            border_mode=border_mode, subsample=subsample)
+                outputs = [conved]
+                if self.with_grad:
+                    outputs += T.grad(conved.sum(), [input, filters])
+                f = theano.function([], outputs)
+                output = f()[0]
+            except Exception:
+                # not supported for this convolution
+                continue
+            if name is None:
+                expected = output
+                continue
+            if expected is None or (output.shape != expected.shape or
+                                    not np.allclose(output, expected,
+                                                    rtol=1e-3, atol=1e-3)):
+                continue
+            timings[name] = min(timeit.repeat(f, number=1,
+                                              repeat=self.repeat))
+        return timings
+
+    def __call__(self, input, filters, image_shape=None, filter_shape=None,
+                 border_mode='valid', subsample=(1,)):
+        fn = self.choice(image_shape, filter_shape, border_mode, subsample,
+                         input.dtype)
+        return fn(input, filters, image_shape, filter_shape,
+                  border_mode=border_mode, subsample=subsample)
+
+
+conv1d_autotune = Conv1DAutotuner(os.path.join(
+    theano.config.compiledir, 'lasagne_conv1d_tuning.json'))
+"""
+autotuning 1D convolution storing its choices in Theano's compilation
+directory, which is specific to the machine and the Python and Theano
+versions; see :class:`Conv1DAutotuner`
+"""
+
+
 # 2D convolutions
 
-# TODO
+try:
+    import scipy.fft as fft
+except ImportError:  # scipy < 1.4
+    from numpy import fft
+
+
+def _next_fast_len(n):
+    """
+    smallest 5-smooth number >= n, for which FFTs are fast
+    """
+    best = None
+    p5 = 1
+    while best is None or p5 < best:
+        p35 = p5
+        while best is None or p35 < best:
+            p235 = p35
+            while p235 < n:
+                p235 *= 2
+            if best is None or p235 < best:
+                best = p235
+            p35 *= 3
+        p5 *= 5
+    return best
+
+
+_fft_shapes = {}
+
+
+def _fft_shape(image_shape, filter_shape, border_mode):
+    """
+    size of the FFTs for the given spatial shapes, cached per shape
+    """
+    key = (image_shape, filter_shape, border_mode)
+    if key not in _fft_shapes:
+        if border_mode == 'valid':
+            # the wrap-around of a circular convolution only affects the
+            # outputs that are cropped off
+            sizes = image_shape
+        else:
+            sizes = [i + k - 1 for i, k in zip(image_shape, filter_shape)]
+        _fft_shapes[key] = tuple(_next_fast_len(n) for n in sizes)
+    return _fft_shapes[key]
+
+
+class FFTConv2D(theano.Op):
+    """
+    2D convolution of a batch of images with a stack of filters computed by
+    real FFTs on the CPU, with border_mode 'valid' or 'full' and unit
+    stride. The spectra of the filters are computed once per call and reused
+    across the batch, which is transformed in chunks to stay in cache. The
+    gradients are convolutions computed by FFT as well.
+    """
+    __props__ = ('border_mode',)
+
+    # bytes of spectra to process at once
+    chunk_size = 1 << 24
+
+    def __init__(self, border_mode='valid'):
+        if border_mode not in ('valid', 'full'):
+            raise ValueError("Unsupported border_mode for FFTConv2D: "
+                             "%s" % border_mode)
+        self.border_mode = border_mode
+
+    def make_node(self, input, filters):
+        input = T.as_tensor_variable(input)
+        filters = T.as_tensor_variable(filters)
+        if input.ndim != 4 or filters.ndim != 4:
+            raise TypeError("FFTConv2D needs 4D input and filters")
+        broadcastable = (input.broadcastable[0], filters.broadcastable[0],
+                         False, False)
+        dtype = theano.scalar.upcast(input.dtype, filters.dtype)
+        return theano.Apply(self, [input, filters],
+                            [T.TensorType(dtype, broadcastable)()])
+
+    def infer_shape(self, node, shapes):
+        (b, c, h, w), (f, c_, kh, kw) = shapes
+        if self.border_mode == 'valid':
+            return [(b, f, h - kh + 1, w - kw + 1)]
+        return [(b, f, h + kh - 1, w + kw - 1)]
+
+    def perform(self, node, inputs, output_storage):
+        input, filters = inputs
+        b, c, h, w = input.shape
+        f, c_, kh, kw = filters.shape
+        if c != c_:
+            raise ValueError("FFTConv2D: input has %d channels, filters "
+                             "have %d" % (c, c_))
+        if self.border_mode == 'valid':
+            start = (kh - 1, kw - 1)
+            out_shape = (h - kh + 1, w - kw + 1)
+        else:
+            start = (0, 0)
+            out_shape = (h + kh - 1, w + kw - 1)
+        s = _fft_shape((h, w), (kh, kw), self.border_mode)
+        # (f, c, H, W // 2 + 1) to (frequencies, c, f)
+        spectra = fft.rfftn(filters, s, axes=(2, 3))
+        spectrum_shape = spectra.shape[2:]
+        num_freqs = spectra.shape[2] * spectra.shape[3]
+        spectra = np.ascontiguousarray(
+            spectra.reshape(f, c, num_freqs).transpose(2, 1, 0))
+
+        output = np.empty((b, f) + out_shape, dtype=node.outputs[0].dtype)
+        step = max(1, self.chunk_size //
+                   (num_freqs * max(c, f) * spectra.itemsize))
+        for i in range(0, b, step):
+            chunk = fft.rfftn(input[i:i + step], s, axes=(2, 3))
+            n = chunk.shape[0]
+            # (n, c, H, W // 2 + 1) to (frequencies, n, c)
+            chunk = np.ascontiguousarray(
+                chunk.reshape(n, c, num_freqs).transpose(2, 0, 1))
+            # sum over the input channels for each frequency
+            conved = np.matmul(chunk, spectra)
+            conved = np.ascontiguousarray(conved.transpose(1, 2, 0))
+            conved = fft.irfftn(conved.reshape((n, f) + spectrum_shape), s,
+                                axes=(2, 3))
+            output[i:i + step] = conved[:, :, start[0]:start[0] + out_shape[0],
+                                        start[1]:start[1] + out_shape[1]]
+        output_storage[0][0] = output
+
+    def grad(self, inputs, output_grads):
+        input, filters = inputs
+        grad, = output_grads
+        # filters flipped, with input and output channels swapped
+        filters_t = filters[:, :, ::-1, ::-1].dimshuffle(1, 0, 2, 3)
+        if self.border_mode == 'valid':
+            grad_input = FFTConv2D('full')(grad, filters_t)
+            grad_filters = FFTConv2D('valid')(
+                input.dimshuffle(1, 0, 2, 3),
+                grad[:, :, ::-1, ::-1].dimshuffle(1, 0, 2, 3))
+            grad_filters = grad_filters[:, :, ::-1, ::-1].dimshuffle(
+                1, 0, 2, 3)
+        else:
+            grad_input = FFTConv2D('valid')(grad, filters_t)
+            grad_filters = FFTConv2D('valid')(
+                grad.dimshuffle(1, 0, 2, 3),
+                input[:, :, ::-1, ::-1].dimshuffle(1, 0, 2, 3))
+        return [T.cast(grad_input, input.dtype),
+                T.cast(grad_filters, filters.dtype)]
+
+
+def fft_conv_speedup(image_shape, filter_shape, border_mode='valid',
+                     subsample=(1, 1)):
+    """
+    Estimates how many times faster :func:`conv2d_fft` computes a
+    convolution than the direct method.
+
+    The estimate is based on the number of multiply-adds of both methods,
+    with constants measured on a CPU. If the batch size is None, the cost
+    of transforming the filters is assumed to be amortized over a large
+    batch.
+    """
+    batch_size, channels, height, width = image_shape
+    num_filters, _, filter_height, filter_width = filter_shape
+    if border_mode == 'valid':
+        out_height = height - filter_height + 1
+        out_width = width - filter_width + 1
+    else:
+        out_height = height + filter_height - 1
+        out_width = width + filter_width - 1
+    out_size = (((out_height - 1) // subsample[0] + 1) *
+                ((out_width - 1) // subsample[1] + 1))
+    direct = channels * num_filters * out_size * filter_height * filter_width
+    fft_height, fft_width = _fft_shape((height, width),
+                                       (filter_height, filter_width),
+                                       border_mode)
+    size = fft_height * fft_width
+    # per example: transform the input and output channels, multiply the
+    # spectra; the filters are transformed once per batch
+    transforms = channels + num_filters
+    if batch_size is not None:
+        transforms += channels * num_filters / float(batch_size)
+    fft_cost = (16 * transforms * size * np.log2(size) +
+                2 * channels * num_filters * size)
+    return direct / fft_cost
+
+
+def conv2d_fft(input, filters, image_shape=None, filter_shape=None,
+               border_mode='valid', subsample=(1, 1),
+               fallback=T.nnet.conv2d):
+    """
+    using real FFTs, for large filters
+
+    Computes the convolution by multiplying the spectra of the input and
+    the filters, which takes time independent of the filter size. This is
+    faster than the direct method for large filters, such as 7x7 and larger
+    filters on large images. Strided convolutions are computed unstrided
+    and subsampled.
+
+    Unless `fallback` is None, the convolution is delegated to `fallback`
+    (with the same arguments) if `image_shape` or `filter_shape` are not
+    known or :func:`fft_conv_speedup` does not expect the FFT to be faster.
+    """
+    if fallback is not None:
+        if (border_mode not in ('valid', 'full') or image_shape is None or
+                filter_shape is None or None in image_shape[1:] or
+                None in filter_shape or
+                fft_conv_speedup(image_shape, filter_shape, border_mode,
+                                 subsample) <= 1):
+            return fallback(input, filters, image_shape=image_shape,
+                            filter_shape=filter_shape,
+                            border_mode=border_mode, subsample=subsample)
+    conved = FFTConv2D(border_mode)(input, filters)
+    if tuple(subsample) != (1, 1):
+        conved = conved[:, :, ::subsample[0], ::subsample[1]]
+    return conved
+
+
+def _conv_padding(border_mode, filter_size):
+    """
+    zero-padding ((top, bottom), (left, right)) of the input that turns a
+    correlation with the flipped filters into the convolution of the given
+    border mode
+    """
+    if border_mode == 'valid':
+        return ((0, 0), (0, 0))
+    elif border_mode == 'full':
+        return tuple((k - 1, k - 1) for k in filter_size)
+    elif border_mode == 'same':
+        # as Conv2DLayer: the full convolution shifted by (k - 1) // 2
+        return tuple((k // 2, (k - 1) // 2) for k in filter_size)
+    elif isinstance(border_mode, (int, tuple, list)):
+        return tuple((int(p), int(p)) for p in as_tuple(border_mode, 2))
+    raise RuntimeError("Unsupported border_mode: %s" % (border_mode,))
+
+
+class _GemmCorr2DBase(theano.Op):
+    """
+    base class of the im2col + GEMM correlation and its gradients
+    """
+    __props__ = ('pad', 'subsample')
+
+    # bytes of im2col matrix to process at once
+    chunk_size = 1 << 25
+
+    def __init__(self, pad=((0, 0), (0, 0)), subsample=(1, 1)):
+        self.pad = tuple(tuple(int(p) for p in pads) for pads in pad)
+        self.subsample = tuple(int(s) for s in subsample)
+
+    def _output_shape(self, image_shape, filter_size):
+        return tuple((size + before + after - k) // s + 1
+                     for size, (before, after), k, s
+                     in zip(image_shape, self.pad, filter_size,
+                            self.subsample))
+
+    def _chunks(self, batch_size, cols_shape, itemsize):
+        step = max(1, self.chunk_size //
+                   (int(np.prod(cols_shape)) * itemsize))
+        return range(0, batch_size, step), step
+
+    def _padded_shape(self, image_shape):
+        return tuple(size + before + after
+                     for size, (before, after) in zip(image_shape, self.pad))
+
+    def _im2col(self, input, filter_size, out_shape):
+        """
+        (n, c, h, w) images to a matrix with the (c, kh, kw) inputs of each
+        of the (n, oh, ow) output positions in a row
+        """
+        n, c = input.shape[:2]
+        (top, _), (left, _) = self.pad
+        if any(sum(pads) for pads in self.pad):
+            padded = np.zeros((n, c) + self._padded_shape(input.shape[2:]),
+                              dtype=input.dtype)
+            padded[:, :, top:top + input.shape[2],
+                   left:left + input.shape[3]] = input
+        else:
+            padded = input
+        sn, sc, sy, sx = padded.strides
+        windows = np.lib.stride_tricks.as_strided(
+            padded, (n,) + out_shape + (c,) + filter_size,
+            (sn, sy * self.subsample[0], sx * self.subsample[1], sc, sy, sx))
+        return np.ascontiguousarray(windows).reshape(
+            n * out_shape[0] * out_shape[1], -1)
+
+
+class GemmCorr2D(_GemmCorr2DBase):
+    """
+    2D correlation of a batch of images with a stack of filters on the CPU,
+    with zero-padding ``((top, bottom), (left, right))`` and strides. The
+    images are unrolled into a matrix holding the inputs of each output
+    position in a row (im2col), which is multiplied with the filters by a
+    single matrix product, so most of the time is spent in the (possibly
+    multithreaded) BLAS library. The batch is processed in chunks to bound
+    the memory used by the im2col matrix. The gradients are computed the
+    same way.
+    """
+    def make_node(self, input, filters):
+        input = T.as_tensor_variable(input)
+        filters = T.as_tensor_variable(filters)
+        if input.ndim != 4 or filters.ndim != 4:
+            raise TypeError("GemmCorr2D needs 4D input and filters")
+        broadcastable = (input.broadcastable[0], filters.broadcastable[0],
+                         False, False)
+        dtype = theano.scalar.upcast(input.dtype, filters.dtype)
+        return theano.Apply(self, [input, filters],
+                            [T.TensorType(dtype, broadcastable)()])
+
+    def infer_shape(self, node, shapes):
+        (b, c, h, w), (f, c_, kh, kw) = shapes
+        return [(b, f) + self._output_shape((h, w), (kh, kw))]
+
+    def perform(self, node, inputs, output_storage):
+        input, filters = inputs
+        b, c = input.shape[:2]
+        f, c_ = filters.shape[:2]
+        if c != c_:
+            raise ValueError("GemmCorr2D: input has %d channels, filters "
+                             "have %d" % (c, c_))
+        filter_size = filters.shape[2:]
+        out_shape = self._output_shape(input.shape[2:], filter_size)
+        output = np.empty((b, f) + out_shape, dtype=node.outputs[0].dtype)
+        # filters as columns, to multiply the rows of the im2col matrix
+        W = filters.reshape(f, -1).T
+        starts, step = self._chunks(b, out_shape + filters.shape[1:],
+                                    input.itemsize)
+        for i in starts:
+            cols = self._im2col(input[i:i + step], filter_size, out_shape)
+            product = np.dot(cols, W)
+            output[i:i + step] = product.reshape(
+                (-1,) + out_shape + (f,)).transpose(0, 3, 1, 2)
+        output_storage[0][0] = output
+
+    def grad(self, inputs, output_grads):
+        input, filters = inputs
+        grad, = output_grads
+        grad_input = GemmCorr2DGradInputs(self.pad, self.subsample)(
+            filters, grad, input.shape[2:])
+        grad_filters = GemmCorr2DGradWeights(self.pad, self.subsample)(
+            input, grad, filters.shape[2:])
+        return [T.cast(grad_input, input.dtype),
+                T.cast(grad_filters, filters.dtype)]
+
+
+class GemmCorr2DGradWeights(_GemmCorr2DBase):
+    """
+    gradient of :class:`GemmCorr2D` with respect to the filters, given the
+    input, the gradient of the output and the filter size
+    """
+    def make_node(self, input, grad, filter_size):
+        input = T.as_tensor_variable(input)
+        grad = T.as_tensor_variable(grad)
+        filter_size = T.as_tensor_variable(filter_size)
+        broadcastable = (grad.broadcastable[1], input.broadcastable[1],
+                         False, False)
+        dtype = theano.scalar.upcast(input.dtype, grad.dtype)
+        return theano.Apply(self, [input, grad, filter_size],
+                            [T.TensorType(dtype, broadcastable)()])
+
+    def infer_shape(self, node, shapes):
+        filter_size = node.inputs[2]
+        return [(shapes[1][1], shapes[0][1], filter_size[0], filter_size[1])]
+
+    def perform(self, node, inputs, output_storage):
+        input, grad, filter_size = inputs
+        b, c = input.shape[:2]
+        f = grad.shape[1]
+        filter_size = tuple(int(k) for k in filter_size)
+        out_shape = grad.shape[2:]
+        grad_W = np.zeros((c * filter_size[0] * filter_size[1], f),
+                          dtype=node.outputs[0].dtype)
+        starts, step = self._chunks(b, out_shape + (c,) + filter_size,
+                                    input.itemsize)
+        for i in starts:
+            cols = self._im2col(input[i:i + step], filter_size, out_shape)
+            grad_out = grad[i:i + step].transpose(0, 2, 3, 1).reshape(-1, f)
+            grad_W += np.dot(cols.T, grad_out)
+        output_storage[0][0] = np.ascontiguousarray(
+            grad_W.T).reshape((f, c) + filter_size)
+
+    def connection_pattern(self, node):
+        return [[True], [True], [False]]
+
+
+class GemmCorr2DGradInputs(_GemmCorr2DBase):
+    """
+    gradient of :class:`GemmCorr2D` with respect to the input, given the
+    filters, the gradient of the output and the image size
+    """
+    def make_node(self, filters, grad, image_shape):
+        filters = T.as_tensor_variable(filters)
+        grad = T.as_tensor_variable(grad)
+        image_shape = T.as_tensor_variable(image_shape)
+        broadcastable = (grad.broadcastable[0], filters.broadcastable[1],
+                         False, False)
+        dtype = theano.scalar.upcast(filters.dtype, grad.dtype)
+        return theano.Apply(self, [filters, grad, image_shape],
+                            [T.TensorType(dtype, broadcastable)()])
+
+    def infer_shape(self, node, shapes):
+        image_shape = node.inputs[2]
+        return [(shapes[1][0], shapes[0][1], image_shape[0], image_shape[1])]
+
+    def perform(self, node, inputs, output_storage):
+        filters, grad, image_shape = inputs
+        b, f = grad.shape[:2]
+        c = filters.shape[1]
+        kh, kw = filters.shape[2:]
+        image_shape = tuple(int(size) for size in image_shape)
+        padded_shape = self._padded_shape(image_shape)
+        oh, ow = grad.shape[2:]
+        sh, sw = self.subsample
+        (top, _), (left, _) = self.pad
+        W = filters.reshape(f, -1)
+        grad_input = np.empty((b, c) + image_shape,
+                              dtype=node.outputs[0].dtype)
+        starts, step = self._chunks(b, (oh, ow, c, kh, kw), grad.itemsize)
+        for i in starts:
+            grad_out = grad[i:i + step].transpose(0, 2, 3, 1).reshape(-1, f)
+            n = len(grad_out) // (oh * ow)
+            # col2im: add the gradient of each input position of the
+            # windows to the padded input, one filter position at a time
+            grad_cols = np.dot(grad_out, W).reshape((n, oh, ow, c, kh, kw))
+            grad_cols = np.ascontiguousarray(
+                grad_cols.transpose(4, 5, 0, 3, 1, 2))
+            grad_padded = np.zeros((n, c) + padded_shape,
+                                   dtype=grad_input.dtype)
+            for y in range(kh):
+                for x in range(kw):
+                    grad_padded[:, :, y:y + sh * (oh - 1) + 1:sh,
+                                x:x + sw * (ow - 1) + 1:sw] += grad_cols[y, x]
+            grad_input[i:i + step] = grad_padded[
+                :, :, top:top + image_shape[0], left:left + image_shape[1]]
+        output_storage[0][0] = grad_input
+
+    def connection_pattern(self, node):
+        return [[True], [True], [False]]
+
+
+def conv2d_mm(input, filters, image_shape=None, filter_shape=None,
+              border_mode='valid', subsample=(1, 1)):
+    """
+    using im2col and a single matrix product on the CPU
+
+    The border mode may be 'valid', 'full' or 'same' (with the semantics of
+    :class:`lasagne.layers.Conv2DLayer`, also for even filter sizes and
+    strides), or an int or a pair of ints for explicit zero-padding on
+    both sides (as the `pad` argument of
+    :class:`lasagne.layers.corrmm.Conv2DMMLayer`). Strided convolutions
+    only compute the output positions they keep.
+    """
+    if filter_shape is None:
+        if border_mode in ('full', 'same'):
+            raise RuntimeError("conv2d_mm needs the filter_shape for "
+                               "border_mode %s" % border_mode)
+        filter_shape = (None, None, None, None)
+    pad = _conv_padding(border_mode, filter_shape[2:])
+    return GemmCorr2D(pad, as_tuple(subsample, 2))(
+        input, filters[:, :, ::-1, ::-1])
+
+
+# transforms (B^T, G, A^T) of Winograd's minimal filtering algorithm
+# F(m x m, 3 x 3), from Lavin & Gray: "Fast Algorithms for Convolutional
+# Neural Networks" (2015)
+_winograd_transforms = {
+    2: (np.array([[1, 0, -1, 0],
+                  [0, 1, 1, 0],
+                  [0, -1, 1, 0],
+                  [0, 1, 0, -1]]),
+        np.array([[1, 0, 0],
+                  [1 / 2., 1 / 2., 1 / 2.],
+                  [1 / 2., -1 / 2., 1 / 2.],
+                  [0, 0, 1]]),
+        np.array([[1, 1, 1, 0],
+                  [0, 1, -1, -1]])),
+    4: (np.array([[4, 0, -5, 0, 1, 0],
+                  [0, -4, -4, 1, 1, 0],
+                  [0, 4, -4, -1, 1, 0],
+                  [0, -2, -1, 2, 1, 0],
+                  [0, 2, -1, -2, 1, 0],
+                  [0, 4, 0, -5, 0, 1]]),
+        np.array([[1 / 4., 0, 0],
+                  [-1 / 6., -1 / 6., -1 / 6.],
+                  [-1 / 6., 1 / 6., -1 / 6.],
+                  [1 / 24., 1 / 12., 1 / 6.],
+                  [1 / 24., -1 / 12., 1 / 6.],
+                  [0, 0, 1]]),
+        np.array([[1, 1, 1, 1, 1, 0],
+                  [0, 1, -1, 2, -2, 0],
+                  [0, 1, 1, 4, 4, 0],
+                  [0, 1, -1, 8, -8, 1]])),
+}
+
+
+def _apply_transform(T_, x, axis):
+    """
+    multiplies T_ with axis 0 or 1 of x, by adding up the slices of x
+    weighted by the entries of T_, most of which are 0 or +-1
+    """
+    def index(i):
+        return (slice(None),) * axis + (i,)
+    out = np.empty(x.shape[:axis] + (len(T_),) + x.shape[axis + 1:],
+                   dtype=x.dtype)
+    tmp = np.empty(x.shape[:axis] + x.shape[axis + 1:], dtype=x.dtype)
+    for i, row in enumerate(T_):
+        o = out[index(i)]
+        nonzero = np.flatnonzero(row)
+        np.multiply(x[index(nonzero[0])], row[nonzero[0]], out=o)
+        for j in nonzero[1:]:
+            if row[j] == 1:
+                np.add(o, x[index(j)], out=o)
+            elif row[j] == -1:
+                np.subtract(o, x[index(j)], out=o)
+            else:
+                np.multiply(x[index(j)], row[j], out=tmp)
+                np.add(o, tmp, out=o)
+    return out
+
+
+def winograd_multiplies(image_shape, tile_size=None):
+    """
+    number of multiplications per input and output channel of a 'valid'
+    convolution of an image of the given (rows, columns) with 3x3 filters
+    by Winograd's algorithm with the given tile size (by default, the one
+    :class:`WinogradConv2D` chooses), excluding the transforms
+    """
+    if tile_size is None:
+        tile_size = _winograd_tile_size(image_shape)
+    tiles = [(size - 2 + tile_size - 1) // tile_size for size in image_shape]
+    return tiles[0] * tiles[1] * (tile_size + 2) ** 2
+
+
+def _winograd_tile_size(image_shape):
+    """
+    tile size needing the fewest multiplications for the given image size,
+    or the largest for unknown sizes
+    """
+    if None in image_shape:
+        return 4
+    return min(sorted(_winograd_transforms, reverse=True),
+               key=lambda m: winograd_multiplies(image_shape, m))
+
+
+class WinogradConv2D(theano.Op):
+    """
+    'valid' 2D convolution of a batch of images with a stack of 3x3 filters
+    with unit stride, computed by Winograd's minimal filtering algorithm
+    F(m x m, 3 x 3) on the CPU. The image is split into overlapping tiles
+    of (m + 2) x (m + 2) inputs, giving m x m outputs each, which are
+    computed with (m + 2)^2 multiplications instead of 9 m^2: 2.25 times
+    fewer for m = 2 and 4 times fewer for m = 4. The transformed filters
+    are reused across the batch, and across calls for as long as the
+    filters do not change, and the products of the transformed tiles are
+    summed over the input channels by one matrix product per tile position.
+    The tile size `m` is chosen for the image size at runtime if
+    `tile_size` is None.
+    """
+    __props__ = ('tile_size',)
+
+    # bytes of transformed tiles to process at once
+    chunk_size = 1 << 25
+
+    def __init__(self, tile_size=None):
+        if tile_size is not None and tile_size not in _winograd_transforms:
+            raise ValueError("Unsupported tile_size for WinogradConv2D: "
+                             "%s" % tile_size)
+        self.tile_size = tile_size
+        self._transformed = {}
+
+    def __getstate__(self):
+        # the transformed filters are not worth storing
+        state = self.__dict__.copy()
+        state['_transformed'] = {}
+        return state
+
+    def __setstate__(self, state):
+        state.setdefault('_transformed', {})
+        self.__dict__.update(state)
+
+    def transform_filters(self, filters, m, dtype):
+        """
+        Returns the filters flipped and transformed for F(m x m, 3 x 3), as
+        an array of shape ``(a * a, c, f)`` with ``a = m + 2``. The result
+        is cached along with a copy of the filters, so it is recomputed
+        only when they change, such as after an update of the parameters.
+        Comparing and copying the filters costs a fraction of transforming
+        them, which is all that is lost when they change on every call.
+        """
+        key = (m, np.dtype(dtype).name)
+        cached = self._transformed.get(key)
+        if cached is not None and np.array_equal(cached[0], filters):
+            return cached[1]
+        f, c = filters.shape[:2]
+        a = m + 2
+        G = _winograd_transforms[m][1]
+        # flip the filters to correlate, transform to (a, a, c, f)
+        U = np.ascontiguousarray(
+            filters[:, :, ::-1, ::-1].transpose(2, 3, 1, 0), dtype=dtype)
+        U = _apply_transform(G, _apply_transform(G, U, 0), 1)
+        U = U.reshape(a * a, c, f)
+        self._transformed[key] = (filters.copy(), U)
+        return U
+
+    def make_node(self, input, filters):
+        input = T.as_tensor_variable(input)
+        filters = T.as_tensor_variable(filters)
+        if input.ndim != 4 or filters.ndim != 4:
+            raise TypeError("WinogradConv2D needs 4D input and filters")
+        broadcastable = (input.broadcastable[0], filters.broadcastable[0],
+                         False, False)
+        dtype = theano.scalar.upcast(input.dtype, filters.dtype)
+        return theano.Apply(self, [input, filters],
+                            [T.TensorType(dtype, broadcastable)()])
+
+    def infer_shape(self, node, shapes):
+        (b, c, h, w), (f, c_, kh, kw) = shapes
+        return [(b, f, h - kh + 1, w - kw + 1)]
+
+    def perform(self, node, inputs, output_storage):
+        input, filters = inputs
+        b, c, h, w = input.shape
+        f, c_ = filters.shape[:2]
+        if filters.shape[2:] != (3, 3):
+            raise ValueError("WinogradConv2D needs 3x3 filters, got %dx%d" %
+                             filters.shape[2:])
+        if c != c_:
+            raise ValueError("WinogradConv2D: input has %d channels, "
+                             "filters have %d" % (c, c_))
+        dtype = node.outputs[0].dtype
+        out_shape = (h - 2, w - 2)
+        m = self.tile_size or _winograd_tile_size((h, w))
+        BT, _, AT = _winograd_transforms[m]
+        a = m + 2
+        tiles = tuple((size + m - 1) // m for size in out_shape)
+        num_tiles = tiles[0] * tiles[1]
+        U = self.transform_filters(filters, m, dtype)
+
+        output = np.empty((b, f) + out_shape, dtype=dtype)
+        step = max(1, self.chunk_size //
+                   (a * a * num_tiles * max(c, f) * output.itemsize))
+        for i in range(0, b, step):
+            chunk = input[i:i + step]
+            n = len(chunk)
+            padded_shape = (tiles[0] * m + 2, tiles[1] * m + 2)
+            if padded_shape != (h, w) or chunk.dtype != dtype:
+                # zero-pad to whole tiles
+                padded = np.zeros((n, c) + padded_shape, dtype=dtype)
+                padded[:, :, :h, :w] = chunk
+                chunk = padded
+            # gather the tiles as (a, a, n, tile rows, tile columns, c)
+            sn, sc, sy, sx = chunk.strides
+            d = np.ascontiguousarray(np.lib.stride_tricks.as_strided(
+                chunk, (a, a, n) + tiles + (c,),
+                (sy, sx, sn, sy * m, sx * m, sc)))
+            V = _apply_transform(BT, _apply_transform(BT, d, 0), 1)
+            # sum over the input channels for each tile position
+            M = np.matmul(V.reshape(a * a, n * num_tiles, c), U)
+            Y = M.reshape(a, a, n * num_tiles, f)
+            Y = _apply_transform(AT, _apply_transform(AT, Y, 0), 1)
+            # scatter the (m, m) outputs of the tiles
+            Y = Y.reshape((m, m, n) + tiles + (f,))
+            for y in range(min(m, out_shape[0])):
+                rows = len(range(y, out_shape[0], m))
+                for x in range(min(m, out_shape[1])):
+                    cols = len(range(x, out_shape[1], m))
+                    output[i:i + step, :, y::m, x::m] = Y[
+                        y, x, :, :rows, :cols].transpose(0, 3, 1, 2)
+        output_storage[0][0] = output
+
+    def grad(self, inputs, output_grads):
+        input, filters = inputs
+        grad, = output_grads
+        # full convolution with the filters flipped, with input and output
+        # channels swapped
+        filters_t = filters[:, :, ::-1, ::-1].dimshuffle(1, 0, 2, 3)
+        # a separate instance, so the transformed filters cached for the
+        # forward and backward pass do not replace each other
+        grad_input = WinogradConv2D(self.tile_size)(
+            pad(grad, 2, batch_ndim=2), filters_t)
+        # the correlation of the input with the gradient, flipped
+        grad_filters = GemmCorr2DGradWeights()(
+            input, grad, filters.shape[2:])[:, :, ::-1, ::-1]
+        return [T.cast(grad_input, input.dtype),
+                T.cast(grad_filters, filters.dtype)]
+
+
+def conv2d_winograd(input, filters, image_shape=None, filter_shape=None,
+                    border_mode='valid', subsample=(1, 1), tile_size=None,
+                    fallback=T.nnet.conv2d):
+    """
+    using Winograd's minimal filtering algorithm, for 3x3 filters
+
+    Computes the convolution with 2.25 (for `tile_size` 2) to 4 (for
+    `tile_size` 4) times fewer multiplications than the direct method. If
+    `tile_size` is None, the tile size needing the fewest multiplications
+    is chosen for the image size. Full convolutions are computed as valid
+    convolutions of the zero-padded input.
+
+    Unless `fallback` is None, the convolution is delegated to `fallback`
+    (with the same arguments) if `filter_shape` is not known to be 3x3, if
+    the convolution is strided, or if there are fewer than 16 input
+    channels, for which the time to transform the tiles outweighs the
+    multiplications saved. Otherwise, strided convolutions are computed
+    unstrided and subsampled.
+    """
+    if fallback is not None:
+        if (border_mode not in ('valid', 'full') or filter_shape is None or
+                tuple(filter_shape[2:]) != (3, 3) or
+                filter_shape[1] is None or filter_shape[1] < 16 or
+                tuple(subsample) != (1, 1)):
+            return fallback(input, filters, image_shape=image_shape,
+                            filter_shape=filter_shape,
+                            border_mode=border_mode, subsample=subsample)
+    if border_mode == 'full':
+        input = pad(input, 2, batch_ndim=2)
+    elif border_mode != 'valid':
+        raise ValueError("Unsupported border_mode for conv2d_winograd: "
+                         "%s" % border_mode)
+    conved = WinogradConv2D(tile_size)(input, filters)
+    if tuple(subsample) != (1, 1):
+        conved = conved[:, :, ::subsample[0], ::subsample[1]]
+    return conved
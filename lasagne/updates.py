@@ -19,6 +19,17 @@ Two functions can be used to further modify the updates to include momentum:
  * apply_momentum()
  * apply_nesterov_momentum()
 
+Any of the update functions can be applied to all parameters of the same
+dtype at once, concatenating them into a single vector, to reduce the
+number of operations per update step for networks of many small tensors:
+
+ * fused()
+
+To train with batches that do not fit into memory at once, gradients can
+be accumulated over several smaller batches before applying an update:
+
+ * GradientAccumulator
+
 Finally, we provide a helper function to constrain the norm of a
 tensor variable:
 
@@ -27,6 +38,13 @@ tensor variable:
 This can be used to constrain the norm of parameters (as an alternative
 to weight decay), or for a form of gradient clipping.
 
+The shared variables holding the state of the update rules (velocities and
+accumulators) are named after the parameter they belong to and can be
+collected from an update dictionary to be saved or restored, e.g. when
+resuming training:
+
+ * OptimizerState
+
 Usage
 --------
 >>> import lasagne
@@ -64,7 +82,10 @@ __all__ = [
     "adagrad",
     "rmsprop",
     "adadelta",
+    "fused",
+    "GradientAccumulator",
     "norm_constraint",
+    "OptimizerState",
 ]
 
 
@@ -96,6 +117,35 @@ def get_or_compute_grads(loss_or_grads, params):
         return theano.grad(loss_or_grads, params)
 
 
+def create_accumulator(param, kind):
+    """Helper function creating a shared variable for optimizer state.
+
+    Parameters
+    ----------
+    param : shared variable
+        The parameter the state belongs to
+    kind : str
+        The kind of state, e.g. ``'velocity'``
+
+    Returns
+    -------
+    shared variable
+        A shared variable of the same shape, type and broadcast pattern as
+        `param`, initialized to zeros. It is named ``<param name>.<kind>``
+        and tagged for :class:`OptimizerState` to find it.
+    """
+    if isinstance(param, theano.compile.SharedVariable):
+        shape = param.get_value(borrow=True).shape
+    else:
+        # a symbolic stand-in for a group of parameters, see fused()
+        shape = param.tag.shape
+    name = "%s.%s" % (param.name, kind) if param.name is not None else None
+    accu = theano.shared(np.zeros(shape, dtype=param.dtype),
+                         broadcastable=param.broadcastable, name=name)
+    accu.tag.optimizer_state = kind
+    return accu
+
+
 def sgd(loss_or_grads, params, learning_rate):
     """Stochastic Gradient Descent (SGD) updates.
 
@@ -162,9 +212,7 @@ def apply_momentum(updates, params=None, momentum=0.9):
     updates = OrderedDict(updates)
 
     for param in params:
-        value = param.get_value(borrow=True)
-        velocity = theano.shared(np.zeros(value.shape, dtype=value.dtype),
-                                 broadcastable=param.broadcastable)
+        velocity = create_accumulator(param, 'velocity')
         x = momentum * velocity + updates[param]
         updates[velocity] = x - param
         updates[param] = x
@@ -253,9 +301,7 @@ def apply_nesterov_momentum(updates, params=None, momentum=0.9):
     updates = OrderedDict(updates)
 
     for param in params:
-        value = param.get_value(borrow=True)
-        velocity = theano.shared(np.zeros(value.shape, dtype=value.dtype),
-                                 broadcastable=param.broadcastable)
+        velocity = create_accumulator(param, 'velocity')
         x = momentum * velocity + updates[param] - param
         updates[velocity] = x
         updates[param] = momentum * x + updates[param]
@@ -357,9 +403,7 @@ def adagrad(loss_or_grads, params, learning_rate=1.0, epsilon=1e-6):
     updates = OrderedDict()
 
     for param, grad in zip(params, grads):
-        value = param.get_value(borrow=True)
-        accu = theano.shared(np.zeros(value.shape, dtype=value.dtype),
-                             broadcastable=param.broadcastable)
+        accu = create_accumulator(param, 'accu')
         accu_new = accu + grad ** 2
         updates[accu] = accu_new
         updates[param] = param - (learning_rate * grad /
@@ -416,9 +460,7 @@ def rmsprop(loss_or_grads, params, learning_rate=1.0, rho=0.9, epsilon=1e-6):
     updates = OrderedDict()
 
     for param, grad in zip(params, grads):
-        value = param.get_value(borrow=True)
-        accu = theano.shared(np.zeros(value.shape, dtype=value.dtype),
-                             broadcastable=param.broadcastable)
+        accu = create_accumulator(param, 'accu')
         accu_new = rho * accu + (1 - rho) * grad ** 2
         updates[accu] = accu_new
         updates[param] = param - (learning_rate * grad /
@@ -486,13 +528,10 @@ def adadelta(loss_or_grads, params, learning_rate=1.0, rho=0.95, epsilon=1e-6):
     updates = OrderedDict()
 
     for param, grad in zip(params, grads):
-        value = param.get_value(borrow=True)
         # accu: accumulate gradient magnitudes
-        accu = theano.shared(np.zeros(value.shape, dtype=value.dtype),
-                             broadcastable=param.broadcastable)
+        accu = create_accumulator(param, 'accu')
         # delta_accu: accumulate update magnitudes (recursively!)
-        delta_accu = theano.shared(np.zeros(value.shape, dtype=value.dtype),
-                                   broadcastable=param.broadcastable)
+        delta_accu = create_accumulator(param, 'delta_accu')
 
         # update accu (as in rmsprop)
         accu_new = rho * accu + (1 - rho) * grad ** 2
@@ -510,6 +549,99 @@ def adadelta(loss_or_grads, params, learning_rate=1.0, rho=0.95, epsilon=1e-6):
     return updates
 
 
+def fused(update_fn, loss_or_grads, params, *args, **kwargs):
+    """Applies an update function to all parameters of a dtype at once.
+
+    The gradients of all parameters of the same dtype are flattened and
+    concatenated into a single vector, the update function is applied to
+    this vector, and the result is split up into updates for the individual
+    parameters. This computes the update rule in a handful of operations on
+    one large vector instead of separately for each (param, grad) pair.
+
+    Parameters
+    ----------
+    update_fn : callable
+        An update function taking `loss_or_grads` and `params` as its first
+        two arguments, such as :func:`sgd` or :func:`rmsprop`
+    loss_or_grads : symbolic expression or list of expressions
+        A scalar loss expression, or a list of gradient expressions
+    params : list of shared variables
+        The variables to generate update expressions for
+    *args, **kwargs
+        Any additional arguments are passed on to `update_fn`
+
+    Returns
+    -------
+    OrderedDict
+        A dictionary mapping each parameter to its update expression, and
+        each flat accumulator created by `update_fn` to its update expression
+
+    Notes
+    -----
+    The update rule must act elementwise, except for the learning rate and
+    other hyperparameters. Concatenating the parameters and gradients costs
+    two copies per update step, so the speedup grows with the number of
+    operations of the update rule: it is largest for :func:`rmsprop` and
+    :func:`adadelta`, while plain :func:`sgd` may even become slower. The
+    graph to optimize is much smaller, though, which reduces compile time.
+
+    The accumulators created by `update_fn` hold the state of all
+    parameters of a dtype in a single vector, so they are not
+    interchangeable with the accumulators of the non-fused update function.
+    `update_fn` is given a symbolic vector in place of these parameters, so
+    it must create its state with :func:`create_accumulator`, as the update
+    functions of this module do.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> import theano
+    >>> from lasagne.updates import fused, rmsprop
+    >>> W = theano.shared(np.ones((3, 2)), name='W')
+    >>> b = theano.shared(np.ones(2), name='b')
+    >>> loss = (W.sum(axis=0) * b).sum()
+    >>> updates = fused(rmsprop, loss, [W, b], learning_rate=0.01)
+    >>> [var.name for var in updates]
+    ['W', 'b', 'fused.float64.accu']
+    """
+    grads = get_or_compute_grads(loss_or_grads, params)
+    groups = OrderedDict()
+    for param, grad in zip(params, grads):
+        groups.setdefault(param.dtype, []).append((param, grad))
+
+    # keep the parameter updates in the order of `params`
+    updates = OrderedDict((param, None) for param in params)
+    state_updates = OrderedDict()
+    for dtype, pairs in groups.items():
+        shapes = [param.get_value(borrow=True).shape for param, _ in pairs]
+        sizes = [int(np.prod(shape)) for shape in shapes]
+        # symbolic stand-in for the concatenated parameters, with the shape
+        # to create flat state for
+        flat = T.TensorType(dtype, (False,))("fused.%s" % dtype)
+        flat.tag.shape = (sum(sizes),)
+        flat_grad = T.concatenate([T.flatten(grad) for _, grad in pairs])
+        flat_updates = update_fn([flat_grad], [flat], *args, **kwargs)
+
+        flat_param = T.concatenate([T.flatten(param) for param, _ in pairs])
+        keys = list(flat_updates.keys())
+        values = theano.clone(list(flat_updates.values()),
+                              replace={flat: flat_param})
+        for var, value in zip(keys, values):
+            if var is not flat:
+                state_updates[var] = value
+
+        # split the flat update with a single op, then restore the shapes
+        new_params = [values[keys.index(flat)]]
+        if len(sizes) > 1:
+            new_params = T.split(new_params[0], sizes, len(sizes))
+        for (param, _), shape, new_param in zip(pairs, shapes, new_params):
+            updates[param] = T.patternbroadcast(new_param.reshape(shape),
+                                                param.broadcastable)
+
+    updates.update(state_updates)
+    return updates
+
+
 def norm_constraint(tensor_var, max_norm, norm_axes=None, epsilon=1e-7):
     """Max weight norm constraints and gradient clipping
 
@@ -588,3 +720,197 @@ def norm_constraint(tensor_var, max_norm, norm_axes=None, epsilon=1e-7):
         (tensor_var * (target_norms / (dtype(epsilon) + norms)))
 
     return constrained_output
+
+
+class GradientAccumulator(object):
+    """Accumulates gradients over several batches before updating.
+
+    Instead of computing the gradient of a loss over a large batch at once,
+    the batch can be split into micro-batches that are processed one after
+    the other. Each micro-step adds the gradients of a micro-batch to
+    accumulators, and an apply-step runs any update function on the
+    average of the accumulated gradients and resets the accumulators.
+
+    Parameters
+    ----------
+    loss_or_grads : symbolic expression or list of expressions
+        A scalar loss expression for a micro-batch, or a list of gradient
+        expressions
+    params : list of shared variables
+        The variables to accumulate gradients for
+
+    Attributes
+    ----------
+    accumulators : list of shared variables
+        The accumulated gradients, one for each parameter. They are named
+        ``<param name>.grad``, so they are part of the
+        :class:`OptimizerState` of the apply-step.
+    count : shared variable
+        The number of micro-steps since the last apply-step.
+    updates : OrderedDict
+        The update dictionary for the micro-step.
+
+    Notes
+    -----
+    The gradients are averaged over micro-steps. If the loss is a mean over
+    the micro-batch, and all micro-batches have the same size, this results
+    in the gradient of the mean loss over the effective batch.
+
+    Examples
+    --------
+    >>> w = theano.shared(np.zeros(3, dtype=theano.config.floatX))
+    >>> x = T.vector('x')
+    >>> loss = T.sum((w - x) ** 2)
+    >>> accumulator = GradientAccumulator(loss, [w])
+    >>> micro_step = theano.function([x], loss, updates=accumulator.updates)
+    >>> apply_step = theano.function(
+    ...     [], updates=accumulator.apply(sgd, learning_rate=0.5))
+    >>> batches = np.eye(3, dtype=theano.config.floatX)
+    >>> losses = [micro_step(batch) for batch in batches]
+    >>> apply_step()
+    []
+    >>> np.allclose(w.get_value(), 1 / 3.)
+    True
+    """
+    def __init__(self, loss_or_grads, params):
+        self.params = list(params)
+        grads = get_or_compute_grads(loss_or_grads, self.params)
+        self.accumulators = [create_accumulator(param, 'grad')
+                             for param in self.params]
+        self.count = theano.shared(np.zeros((), dtype=theano.config.floatX),
+                                   name='grad_count')
+        self.count.tag.optimizer_state = 'count'
+
+        self.updates = OrderedDict()
+        for accu, grad in zip(self.accumulators, grads):
+            self.updates[accu] = accu + grad
+        self.updates[self.count] = self.count + 1
+
+    @property
+    def grads(self):
+        """The symbolic averages of the accumulated gradients."""
+        count = T.maximum(self.count, 1)
+        return [T.cast(accu / count, accu.dtype)
+                for accu in self.accumulators]
+
+    def apply(self, update_fn, *args, **kwargs):
+        """Returns the update dictionary for the apply-step.
+
+        Parameters
+        ----------
+        update_fn : callable
+            An update function taking a list of gradients and the list of
+            parameters as its first two arguments, such as :func:`sgd` or
+            :func:`rmsprop`
+        *args, **kwargs
+            Any additional arguments are passed on to `update_fn`
+
+        Returns
+        -------
+        OrderedDict
+            The updates of `update_fn`, followed by updates resetting the
+            accumulators and the counter to zero
+        """
+        updates = update_fn(self.grads, self.params, *args, **kwargs)
+        for accu in self.accumulators:
+            updates[accu] = T.zeros_like(accu)
+        updates[self.count] = T.zeros_like(self.count)
+        return updates
+
+
+class OptimizerState(object):
+    """Named collection of the shared variables holding optimizer state.
+
+    The update functions in this module keep their state (e.g., the
+    velocities of :func:`momentum` or the accumulated squared gradients of
+    :func:`adagrad`) in shared variables that are updated along with the
+    parameters. This class collects these variables from an update
+    dictionary, so they can be inspected, saved and restored.
+
+    Parameters
+    ----------
+    updates : OrderedDict or list of pairs
+        An update dictionary as returned by the functions in this module.
+    params : iterable of shared variables, optional
+        If given, all variables updated by `updates` that are not in
+        `params` are considered optimizer state. By default, only the
+        variables created by the functions in this module are.
+
+    Attributes
+    ----------
+    variables : OrderedDict
+        A dictionary mapping unique names to the state variables, in the
+        order of `updates`. Variables are named ``<param name>.<kind>``;
+        names occurring multiple times (e.g., for unnamed layers) are made
+        unique by appending ``_1``, ``_2`` and so on.
+
+    Examples
+    --------
+    >>> w = theano.shared(np.zeros((3, 2), dtype=theano.config.floatX),
+    ...                   name='W')
+    >>> updates = adagrad(T.sum(w ** 2), [w])
+    >>> state = OptimizerState(updates)
+    >>> list(state.variables.keys())
+    ['W.accu']
+    >>> values = state.get_values()
+    >>> state.set_values(values)
+    """
+    def __init__(self, updates, params=None):
+        if isinstance(updates, dict):
+            updates = updates.items()
+        if params is None:
+            variables = [var for var, _ in updates
+                         if hasattr(var.tag, 'optimizer_state')]
+        else:
+            params = set(params)
+            variables = [var for var, _ in updates if var not in params]
+
+        self.variables = OrderedDict()
+        for idx, var in enumerate(variables):
+            name = var.name if var.name is not None else "state%d" % idx
+            unique_name, count = name, 0
+            while unique_name in self.variables:
+                count += 1
+                unique_name = "%s_%d" % (name, count)
+            self.variables[unique_name] = var
+
+    def __len__(self):
+        return len(self.variables)
+
+    def __getitem__(self, name):
+        return self.variables[name]
+
+    def get_values(self):
+        """Returns the current values of all state variables.
+
+        Returns
+        -------
+        OrderedDict
+            A dictionary mapping the names of the state variables to copies
+            of their values
+        """
+        return OrderedDict((name, var.get_value())
+                           for name, var in self.variables.items())
+
+    def set_values(self, values):
+        """Sets the values of all state variables.
+
+        Parameters
+        ----------
+        values : dict or list of numpy arrays
+            A dictionary mapping names to values, as returned by
+            :meth:`get_values`, or a list of values in the order of
+            :attr:`variables`. All state variables must be covered.
+        """
+        if isinstance(values, dict):
+            missing = set(self.variables) - set(values)
+            if missing:
+                raise ValueError("no values given for optimizer state "
+                                 "variable(s) %s" % ", ".join(sorted(missing)))
+            values = [values[name] for name in self.variables]
+        elif len(values) != len(self.variables):
+            raise ValueError("mismatch: got %d values to set %d optimizer "
+                             "state variables" %
+                             (len(values), len(self.variables)))
+        for var, value in zip(self.variables.values(), values):
+            var.set_value(value)
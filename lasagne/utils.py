@@ -20,6 +20,58 @@ def floatX(arr):
     return arr.astype(theano.config.floatX)
 
 
+class _Upcast(theano.Op):
+    """
+    Casts a tensor to a wider dtype with numpy, which converts float16 much
+    faster than the generic elemwise cast.
+    """
+    __props__ = ('dtype',)
+
+    def __init__(self, dtype):
+        self.dtype = dtype
+
+    def make_node(self, x):
+        x = T.as_tensor_variable(x)
+        return theano.Apply(self, [x],
+                            [T.TensorType(self.dtype, x.broadcastable)()])
+
+    def perform(self, node, inputs, output_storage):
+        output_storage[0][0] = inputs[0].astype(self.dtype)
+
+    def infer_shape(self, node, shapes):
+        return shapes
+
+    def grad(self, inputs, output_grads):
+        return [T.cast(output_grads[0], inputs[0].dtype)]
+
+
+def upcast(x, dtype=None):
+    """Casts a parameter to the dtype used for computation.
+
+    Layers call this on their parameters, which may be stored at a lower
+    precision (see the `storage_dtype` argument of
+    :class:`lasagne.layers.Layer`).
+
+    Parameters
+    ----------
+    x : Theano expression
+        The parameter to cast.
+    dtype : a numpy data-type, optional
+        The dtype to cast to. Defaults to the Theano ``floatX`` dtype.
+
+    Returns
+    -------
+    Theano expression
+        `x` itself if it is of dtype `dtype` already, otherwise `x` cast
+        to `dtype`.
+    """
+    if dtype is None:
+        dtype = theano.config.floatX
+    if x.dtype == dtype:
+        return x
+    return _Upcast(dtype)(x)
+
+
 def shared_empty(dim=2, dtype=None):
     """Creates empty Theano shared variable.
 
@@ -107,7 +159,8 @@ def unique(l):
     """Filters duplicates of iterable.
 
     Create a new list from l with duplicate entries removed,
-    while preserving the original order.
+    while preserving the original order. Runs in linear time,
+    so the elements of `l` need to be hashable.
 
     Parameters
     ----------
@@ -119,9 +172,11 @@ def unique(l):
     list
         A list of elements of `l` without duplicates and in the same order.
     """
+    seen = set()
     new_list = []
     for el in l:
-        if el not in new_list:
+        if el not in seen:
+            seen.add(el)
             new_list.append(el)
 
     return new_list